@@ -0,0 +1,50 @@
+"""开发与 CI 用的工具：冷启动导入耗时的测量
+
+只在 check-import-time 命令与测试中导入，应用启动时不加载。
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+# 冷启动（导入并创建应用）的导入耗时预算，以及创建应用时不应导入的重量级依赖
+IMPORT_BUDGET_MS = int(os.environ.get('IMPORT_BUDGET_MS', '500'))
+DEFERRED_MODULES = ('numpy', 'openai', 'httpx', 'tiktoken')
+
+def parse_importtime(output):
+    """解析 python -X importtime 的输出，返回 [(顶层模块, 累计微秒)] 与导入过的模块名集合"""
+    top_level = []
+    modules = set()
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue  # 表头
+        modules.add(name.strip())
+        # 模块名前的缩进表示嵌套层级，顶层只有一个空格
+        if not name.startswith('  '):
+            top_level.append((name.strip(), int(cumulative)))
+    return top_level, modules
+
+def measure_cold_start():
+    """在子进程中用 python -X importtime 导入并创建应用
+
+    返回 (导入总毫秒数, 提前导入的重量级依赖, [(顶层模块, 累计微秒)])；创建应用失败时抛出 RuntimeError。
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        code = (
+            'from src.main import create_app; '
+            f'create_app({{"DATABASE_PATH": {os.path.join(tmp, "app.db")!r}}})'
+        )
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True, text=True
+        )
+    if result.returncode != 0:
+        raise RuntimeError(f"创建应用失败：\n{result.stderr[-2000:]}")
+    top_level, modules = parse_importtime(result.stderr)
+    total_ms = sum(us for _, us in top_level) / 1000
+    loaded = sorted({name.split('.')[0] for name in modules} & set(DEFERRED_MODULES))
+    return total_ms, loaded, top_level
@@ -1,47 +1,135 @@
 import os
 import sys
+import click
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory
+from flask import Flask, current_app
+from flask.cli import with_appcontext
 from flask_cors import CORS
 from src.models.user import db
-from src.models.progress import UserProgress, ProblemSolvingRecord, LearningStats
-from src.routes.user import user_bp
-from src.routes.progress import progress_bp
-
-app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
-app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
-
-# 启用CORS
-CORS(app)
-
-app.register_blueprint(user_bp, url_prefix='/api')
-app.register_blueprint(progress_bp, url_prefix='/api')
-
-# uncomment if you need to use database
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
-with app.app_context():
-    db.create_all()
-
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve(path):
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
-            return "Static folder not configured", 404
-
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
+from src.models.database import configure_database
+from src.models.migrations import MIGRATIONS, upgrade_schema, current_version
+from src.services.static_assets import StaticManifest, precompress
+
+DEFAULT_DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'database', 'app.db')
+
+def register_blueprints(app):
+    """导入并注册各个蓝图；蓝图模块（及其依赖）在创建应用时才导入"""
+    from src.routes.user import user_bp
+    from src.routes.progress import progress_bp
+    from src.routes.ai_tutor import ai_tutor_bp
+    from src.routes.recommendation import recommendation_bp
+
+    app.register_blueprint(user_bp, url_prefix='/api')
+    app.register_blueprint(progress_bp, url_prefix='/api')
+    app.register_blueprint(ai_tutor_bp, url_prefix='/api/tutor')
+    app.register_blueprint(recommendation_bp, url_prefix='/api/recommend')
+
+def check_schema(app):
+    """数据库结构不是最新版本时提示先执行 upgrade-db（启动时不再自动建表和迁移）"""
+    with app.app_context():
+        version = current_version()
+    latest = MIGRATIONS[-1][0]
+    if version < latest:
+        app.logger.warning(
+            f"数据库结构版本 {version} 低于 {latest}，请先执行 flask --app src.main upgrade-db"
+        )
+
+@click.command('upgrade-db')
+@click.option('--vacuum', is_flag=True, help='迁移后执行 VACUUM，回收迁移释放的空间')
+@with_appcontext
+def upgrade_db_command(vacuum):
+    """创建数据表并升级数据库结构到最新版本"""
+    # create_all 不会给已有的表补列和索引，由迁移负责原地升级
+    applied = upgrade_schema()
+    click.echo(f"已应用迁移：{applied}，当前结构版本：{current_version()}")
+    if vacuum:
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.exec_driver_sql('VACUUM')
+        click.echo("已完成 VACUUM")
+
+@click.command('compress-static')
+@with_appcontext
+def compress_static_command():
+    """为 static/ 中的文本类文件生成 .gz（安装 brotli 时还有 .br）预压缩版本"""
+    static_manifest = current_app.extensions['static_manifest']
+    written = []
+    for entry in static_manifest.ensure_built().values():
+        if entry.compressible:
+            written.extend(precompress(entry.path, use_brotli=True))
+    static_manifest.build()
+    click.echo(f"已生成 {len(written)} 个预压缩文件：{static_manifest.stats()['precompressed']}")
+
+@click.command('check-import-time')
+@click.option('--budget-ms', type=int, help='导入耗时预算（毫秒），默认取环境变量 IMPORT_BUDGET_MS 或 500')
+def check_import_time_command(budget_ms):
+    """用 python -X importtime 测量冷启动的导入耗时，超出预算或提前导入重量级依赖时失败"""
+    from src.devtools import IMPORT_BUDGET_MS, measure_cold_start
+    if budget_ms is None:
+        budget_ms = IMPORT_BUDGET_MS
+    try:
+        total_ms, loaded, top_level = measure_cold_start()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    for name, us in sorted(top_level, key=lambda m: -m[1])[:8]:
+        click.echo(f"{us / 1000:8.1f} ms  {name}")
+    click.echo(f"导入总耗时 {total_ms:.1f} ms，预算 {budget_ms} ms")
+    if loaded:
+        raise click.ClickException(f"创建应用时导入了应按需加载的依赖：{', '.join(loaded)}")
+    if total_ms > budget_ms:
+        raise click.ClickException(f"导入耗时 {total_ms:.1f} ms 超出预算 {budget_ms} ms")
+
+def create_app(config=None):
+    """创建应用
+
+    config 中的配置覆盖默认值，DATABASE_PATH 指定数据库文件。
+    数据表的创建与迁移默认不在这里执行，部署时先运行 flask --app src.main upgrade-db；
+    UPGRADE_SCHEMA 为真时（本地直接运行 main.py）在启动前升级。
+    """
+    app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
+    app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
+    app.config['DATABASE_PATH'] = DEFAULT_DATABASE_PATH
+    app.config['UPGRADE_SCHEMA'] = False
+    app.config.update(config or {})
+
+    # 启用CORS
+    CORS(app)
+
+    # 主库与报表读库：WAL 模式，报表查询使用独立的只读连接池
+    configure_database(app, db, app.config['DATABASE_PATH'])
+    register_blueprints(app)
+    if app.config['UPGRADE_SCHEMA']:
+        with app.app_context():
+            upgrade_schema()
     else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
-        else:
-            return "index.html not found", 404
+        check_schema(app)
+
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(compress_static_command)
+    app.cli.add_command(check_import_time_command)
+
+    # 前端静态文件：第一次请求时生成内存清单，预压缩版本由 compress-static 在部署时生成
+    static_manifest = StaticManifest(app.static_folder, lazy=True)
+    app.extensions['static_manifest'] = static_manifest
+
+    @app.route('/', defaults={'path': ''})
+    @app.route('/<path:path>')
+    def serve(path):
+        return static_manifest.serve(path or 'index.html')
+
+    # 每个应用一个解题记录写入队列：启用延迟写入时重放上次未写完的记录并启动后台写入线程
+    from src.routes.progress import create_problem_record_queue
+    create_problem_record_queue(app)
+    return app
 
+def __getattr__(name):
+    # 兼容 src.main:app 的用法：第一次访问时创建应用
+    if name == 'app':
+        app = globals()['app'] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
+    app = create_app({'UPGRADE_SCHEMA': True})
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,49 @@
+from datetime import datetime
+from src.models.user import db
+
+class ConversationTurn(db.Model):
+    """导师对话中的一条消息（学生提问或导师回复）"""
+    __tablename__ = 'conversation_turns'
+    __table_args__ = (
+        db.Index('ix_conversation_turns_user_conversation', 'user_id', 'conversation_key', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(50), nullable=False, default='default_user')
+    conversation_key = db.Column(db.String(32), nullable=False)  # 由问题背景计算，同一问题的对话共用
+    role = db.Column(db.String(16), nullable=False)  # user, assistant
+    content = db.Column(db.Text, nullable=False)
+    tokens = db.Column(db.Integer, nullable=False, default=0)  # 作为一条对话消息的 token 数
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'role': self.role,
+            'content': self.content,
+            'tokens': self.tokens,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class ConversationSummary(db.Model):
+    """对话的滚动摘要：summarized_until 及之前的消息已并入摘要，不再原样发送"""
+    __tablename__ = 'conversation_summaries'
+    __table_args__ = (
+        db.Index('ux_conversation_summaries_user_conversation', 'user_id', 'conversation_key', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(50), nullable=False, default='default_user')
+    conversation_key = db.Column(db.String(32), nullable=False)
+    summary = db.Column(db.Text, nullable=False, default='')
+    tokens = db.Column(db.Integer, nullable=False, default=0)
+    summarized_until = db.Column(db.Integer, nullable=False, default=0)  # 已并入摘要的最后一条消息 id
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'summary': self.summary,
+            'tokens': self.tokens,
+            'summarized_until': self.summarized_until,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -0,0 +1,79 @@
+"""数据库连接配置
+
+主库与报表读库共用同一个 SQLite 文件：每个连接建立时开启 WAL 并设置
+synchronous / busy_timeout / mmap_size / cache_size，读写互不阻塞。
+报表读库（SQLALCHEMY_BINDS 中的 reports）是独立的连接池，连接设为 query_only；
+被 reporting_reads 装饰的视图里 db.session 的查询走读库，长时间的报表查询不占用写连接，
+也不会挡住进度写入。刷新（flush）等写操作仍然走主库。
+"""
+import functools
+import os
+from contextvars import ContextVar
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+READ_BIND = 'reports'
+
+_reporting = ContextVar('reporting_reads', default=False)
+
+def connection_pragmas():
+    """根据环境变量 DB_BUSY_TIMEOUT_MS / DB_MMAP_SIZE / DB_CACHE_SIZE_KB 生成连接参数"""
+    return {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.environ.get('DB_BUSY_TIMEOUT_MS', '5000')),
+        'mmap_size': int(os.environ.get('DB_MMAP_SIZE', str(256 << 20))),
+        # 负数表示以 KiB 为单位
+        'cache_size': -int(os.environ.get('DB_CACHE_SIZE_KB', '20000'))
+    }
+
+def install_pragmas(engine, query_only=False):
+    """在 engine 每次新建连接时设置 pragma"""
+    pragmas = connection_pragmas()
+    if query_only:
+        pragmas['query_only'] = 'ON'
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+def configure_database(app, db, path):
+    """配置主库与报表读库并初始化 db"""
+    uri = f"sqlite:///{path}"
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.setdefault('SQLALCHEMY_BINDS', {})[READ_BIND] = {
+        'url': uri,
+        'pool_size': int(os.environ.get('DB_READ_POOL_SIZE', '5')),
+        'max_overflow': int(os.environ.get('DB_READ_POOL_OVERFLOW', '5'))
+    }
+    db.init_app(app)
+    with app.app_context():
+        for key, engine in db.engines.items():
+            install_pragmas(engine, query_only=key == READ_BIND)
+
+class RoutingSession(Session):
+    """报表视图中把查询路由到读库的会话"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _reporting.get() and not self._flushing:
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def reporting_reads(view):
+    """视图内的数据库查询使用报表读库（只读）"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = _reporting.set(True)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _reporting.reset(token)
+    return wrapper
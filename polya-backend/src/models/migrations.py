@@ -0,0 +1,250 @@
+"""数据库结构迁移
+
+db.create_all() 只会创建不存在的表，不会给已有的表补列或补索引。
+这里用 SQLite 的 PRAGMA user_version 记录结构版本，按顺序执行尚未应用的迁移，
+使已有数据的 database/app.db 可以原地升级。每个迁移在一个事务内执行。
+"""
+import json
+import sqlite3
+from src.models.user import db
+from src.models.progress import pack_steps
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """注册一个结构迁移"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def _table_columns(cursor, table):
+    return {row[1] for row in cursor.execute(f'PRAGMA table_info({table})')}
+
+
+def _add_column(cursor, table, column, ddl):
+    if column not in _table_columns(cursor, table):
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+
+
+def rebuild_learning_stats(cursor):
+    """根据 user_progress 重建 learning_stats 的聚合列"""
+    per_user = {}
+    rows = cursor.execute(
+        'SELECT user_id, module, COUNT(*), COALESCE(SUM(score), 0) FROM user_progress '
+        'WHERE completed = 1 GROUP BY user_id, module'
+    )
+    for user_id, module, count, score_sum in rows:
+        per_user.setdefault(user_id, {})[module] = {
+            'score_sum': score_sum, 'completed_count': count
+        }
+
+    updates = []
+    for (user_id,) in cursor.execute('SELECT user_id FROM learning_stats').fetchall():
+        module_stats = per_user.get(user_id, {})
+        completed_count = sum(m['completed_count'] for m in module_stats.values())
+        score_sum = sum(m['score_sum'] for m in module_stats.values())
+        updates.append((
+            score_sum,
+            completed_count,
+            json.dumps(module_stats, ensure_ascii=False),
+            completed_count,
+            score_sum / completed_count if completed_count else 0.0,
+            user_id
+        ))
+    cursor.executemany(
+        'UPDATE learning_stats SET score_sum = ?, completed_count = ?, module_stats = ?, '
+        'total_problems_solved = ?, average_score = ? WHERE user_id = ?',
+        updates
+    )
+
+
+@migration(1, '学习统计增量聚合列')
+def add_learning_stats_aggregates(cursor):
+    _add_column(cursor, 'learning_stats', 'score_sum', 'INTEGER DEFAULT 0')
+    _add_column(cursor, 'learning_stats', 'completed_count', 'INTEGER DEFAULT 0')
+    _add_column(cursor, 'learning_stats', 'module_stats', 'TEXT')
+    rebuild_learning_stats(cursor)
+
+
+@migration(2, '进度表复合索引与唯一约束')
+def add_progress_indexes(cursor):
+    # 建唯一索引前先去重：同一课程只保留最近更新的一条进度
+    cursor.execute('''
+        DELETE FROM user_progress WHERE id NOT IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY user_id, module, lesson_id
+                    ORDER BY updated_at DESC, id DESC
+                ) AS rn FROM user_progress
+            ) WHERE rn = 1
+        )
+    ''')
+    # 同一用户的多条统计合并到最新一条，累计学习时间相加
+    cursor.execute('''
+        UPDATE learning_stats SET total_time_spent = (
+            SELECT SUM(COALESCE(s.total_time_spent, 0)) FROM learning_stats s
+            WHERE s.user_id = learning_stats.user_id
+        ), streak_days = (
+            SELECT MAX(COALESCE(s.streak_days, 0)) FROM learning_stats s
+            WHERE s.user_id = learning_stats.user_id
+        )
+        WHERE id IN (SELECT MAX(id) FROM learning_stats GROUP BY user_id HAVING COUNT(*) > 1)
+    ''')
+    cursor.execute(
+        'DELETE FROM learning_stats WHERE id NOT IN (SELECT MAX(id) FROM learning_stats GROUP BY user_id)'
+    )
+    rebuild_learning_stats(cursor)
+
+    cursor.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_user_progress_user_module_lesson '
+        'ON user_progress (user_id, module, lesson_id)'
+    )
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS ix_user_progress_user_completed '
+        'ON user_progress (user_id, completed)'
+    )
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS ix_user_progress_user_updated '
+        'ON user_progress (user_id, updated_at)'
+    )
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS ix_problem_records_user_type_created '
+        'ON problem_solving_records (user_id, problem_type, created_at)'
+    )
+    cursor.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_learning_stats_user ON learning_stats (user_id)'
+    )
+
+
+def rebuild_daily_activity(cursor):
+    """根据原始进度与解题记录重建每日活动汇总表"""
+    cursor.execute('DELETE FROM daily_user_activity')
+    cursor.execute('''
+        INSERT INTO daily_user_activity (
+            user_id, activity_date, active_lessons, completed_lessons,
+            total_time, score_sum, problem_records
+        )
+        SELECT user_id, date(updated_at), COUNT(*),
+               SUM(CASE WHEN completed = 1 THEN 1 ELSE 0 END),
+               SUM(CASE WHEN completed = 1 THEN COALESCE(time_spent, 0) ELSE 0 END),
+               SUM(CASE WHEN completed = 1 THEN COALESCE(score, 0) ELSE 0 END),
+               0
+        FROM user_progress WHERE updated_at IS NOT NULL
+        GROUP BY user_id, date(updated_at)
+    ''')
+    cursor.execute('''
+        INSERT INTO daily_user_activity (
+            user_id, activity_date, active_lessons, completed_lessons,
+            total_time, score_sum, problem_records
+        )
+        SELECT user_id, date(created_at), 0, 0, 0, 0, COUNT(*)
+        FROM problem_solving_records WHERE created_at IS NOT NULL
+        GROUP BY user_id, date(created_at)
+        ON CONFLICT (user_id, activity_date) DO UPDATE SET
+            problem_records = excluded.problem_records
+    ''')
+
+
+@migration(3, '每日学习活动汇总表')
+def add_daily_activity(cursor):
+    # 表本身由 create_all 创建，这里回填历史数据
+    rebuild_daily_activity(cursor)
+
+
+@migration(4, '排行榜索引')
+def add_leaderboard_indexes(cursor):
+    for name, column in (
+        ('ix_learning_stats_rank_solved', 'total_problems_solved'),
+        ('ix_learning_stats_rank_score', 'average_score'),
+        ('ix_learning_stats_rank_streak', 'streak_days'),
+    ):
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON learning_stats ({column} DESC, id)')
+
+
+@migration(5, '解题记录延迟写入去重列')
+def add_problem_record_ingest_id(cursor):
+    _add_column(cursor, 'problem_solving_records', 'ingest_id', 'VARCHAR(32)')
+    cursor.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_problem_records_ingest_id '
+        'ON problem_solving_records (ingest_id)'
+    )
+
+
+@migration(6, '解题步骤数据压缩存储')
+def compress_steps_data(cursor):
+    _add_column(cursor, 'problem_solving_records', 'steps_blob', 'BLOB')
+    if 'steps_data' not in _table_columns(cursor, 'problem_solving_records'):
+        return
+    last_id = 0
+    while True:
+        rows = cursor.execute(
+            'SELECT id, steps_data FROM problem_solving_records WHERE id > ? ORDER BY id LIMIT 1000',
+            (last_id,)
+        ).fetchall()
+        if not rows:
+            break
+        cursor.executemany(
+            'UPDATE problem_solving_records SET steps_blob = ? WHERE id = ?',
+            [(pack_steps(text or '{}'), record_id) for record_id, text in rows]
+        )
+        last_id = rows[-1][0]
+    if sqlite3.sqlite_version_info >= (3, 35, 0):
+        cursor.execute('ALTER TABLE problem_solving_records DROP COLUMN steps_data')
+    else:
+        # 旧版 SQLite 不支持删除列，清空后不再占用空间
+        cursor.execute('UPDATE problem_solving_records SET steps_data = NULL')
+
+
+@migration(7, '补全进度更新时间')
+def fill_progress_updated_at(cursor):
+    # 进度列表按 (updated_at, id) 做游标分页，更新时间不能为空
+    cursor.execute(
+        "UPDATE user_progress SET updated_at = COALESCE(created_at, '1970-01-01 00:00:00.000000') "
+        "WHERE updated_at IS NULL"
+    )
+
+
+def current_version(engine=None):
+    """获取数据库当前结构版本"""
+    engine = engine or db.engine
+    with engine.connect() as conn:
+        return conn.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def upgrade_schema(engine=None):
+    """创建缺失的表并依次执行尚未应用的迁移，返回本次应用的版本号列表"""
+    engine = engine or db.engine
+    db.metadata.create_all(engine)
+
+    applied = []
+    raw = engine.raw_connection()
+    try:
+        conn = raw.driver_connection
+        isolation_level = conn.isolation_level
+        # 手动管理事务：DDL 与版本号更新要在同一个事务里提交
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        try:
+            for version, description, func in MIGRATIONS:
+                cursor.execute('BEGIN IMMEDIATE')
+                try:
+                    if cursor.execute('PRAGMA user_version').fetchone()[0] >= version:
+                        cursor.execute('ROLLBACK')
+                        continue
+                    func(cursor)
+                    cursor.execute(f'PRAGMA user_version = {int(version)}')
+                    cursor.execute('COMMIT')
+                except Exception:
+                    cursor.execute('ROLLBACK')
+                    raise
+                applied.append(version)
+        finally:
+            cursor.close()
+            conn.isolation_level = isolation_level
+    finally:
+        raw.close()
+    return applied
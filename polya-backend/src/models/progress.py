@@ -1,12 +1,17 @@
-from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import json
-
-db = SQLAlchemy()
+import zlib
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from src.models.user import db
 
 class UserProgress(db.Model):
     """用户学习进度模型"""
     __tablename__ = 'user_progress'
+    __table_args__ = (
+        db.Index('ux_user_progress_user_module_lesson', 'user_id', 'module', 'lesson_id', unique=True),
+        db.Index('ix_user_progress_user_completed', 'user_id', 'completed'),
+        db.Index('ix_user_progress_user_updated', 'user_id', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(50), nullable=False, default='default_user')
@@ -30,45 +35,175 @@ class UserProgress(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
+    
+    @classmethod
+    def upsert(cls, user_id, module, lesson_id, completed, score, time_spent, now=None):
+        """单条 INSERT ... ON CONFLICT DO UPDATE 写入进度，并通过 RETURNING 返回写入后的记录"""
+        now = now or datetime.utcnow()
+        stmt = sqlite_insert(cls).values(
+            user_id=user_id,
+            module=module,
+            lesson_id=lesson_id,
+            completed=completed,
+            score=score,
+            time_spent=time_spent,
+            created_at=now,
+            updated_at=now
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'module', 'lesson_id'],
+            set_={
+                'completed': stmt.excluded.completed,
+                'score': stmt.excluded.score,
+                'time_spent': stmt.excluded.time_spent,
+                'updated_at': stmt.excluded.updated_at
+            }
+        ).returning(cls)
+        return db.session.scalars(
+            stmt, execution_options={'populate_existing': True}
+        ).one()
+
+    @classmethod
+    def load_states(cls, keys, chunk_size=300):
+        """批量读取 (user_id, module, lesson_id) 对应的现有进度，返回 {键: (completed, score, time_spent, updated_at)}"""
+        keys = list(keys)
+        states = {}
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            rows = db.session.execute(
+                db.select(
+                    cls.user_id, cls.module, cls.lesson_id,
+                    cls.completed, cls.score, cls.time_spent, cls.updated_at
+                ).where(db.tuple_(cls.user_id, cls.module, cls.lesson_id).in_(chunk))
+            )
+            for user_id, module, lesson_id, completed, score, time_spent, updated_at in rows:
+                states[(user_id, module, lesson_id)] = (completed, score, time_spent, updated_at)
+        return states
+    
+    @classmethod
+    def bulk_upsert(cls, rows):
+        """批量 UPSERT 进度记录（executemany），rows 为列名到值的字典列表，返回按输入顺序的记录 id"""
+        if not rows:
+            return []
+        stmt = sqlite_insert(cls)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'module', 'lesson_id'],
+            set_={
+                'completed': stmt.excluded.completed,
+                'score': stmt.excluded.score,
+                'time_spent': stmt.excluded.time_spent,
+                'updated_at': stmt.excluded.updated_at
+            }
+        ).returning(cls.id, sort_by_parameter_order=True)
+        return db.session.scalars(stmt, rows).all()
+
+# 步骤数据的存储格式：首字节为格式版本，1 表示使用下面的预置字典压缩的 zlib 数据。
+# 单条记录只有几百字节，预置常见的键名与四步法用语能明显提高压缩率；字典内容一经使用不能修改，
+# 需要调整时新增格式版本
+STEPS_FORMAT_ZLIB = 1
+STEPS_ZDICT = json.dumps({
+    'understand': {'unknown': '', 'data': '', 'condition': '', 'answer': '', 'notes': '', 'completed': True},
+    'plan': {'strategy': '', 'related_problem': '', 'answer': '', 'notes': '', 'completed': True},
+    'execute': {'steps': [], 'answer': '', 'notes': '', 'completed': False},
+    'review': {'check': '', 'other_methods': '', 'answer': '', 'notes': '', 'completed': False},
+    '理解问题': '未知量是什么？已知数据是什么？条件是什么？',
+    '制定计划': '你以前见过这个问题吗？能否利用相关问题的结果或方法？',
+    '执行计划': '检查每一个步骤，你能清楚地看出这一步是正确的吗？',
+    '回顾反思': '你能检验结果吗？能否用不同的方法得出结果？'
+}, ensure_ascii=False).encode('utf-8')
+
+def pack_steps(data):
+    """把步骤数据（对象或 JSON 文本）压缩为存储格式"""
+    text = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    compressor = zlib.compressobj(9, zdict=STEPS_ZDICT)
+    return bytes([STEPS_FORMAT_ZLIB]) + compressor.compress(text.encode('utf-8')) + compressor.flush()
+
+def unpack_steps(blob):
+    """解压存储格式的步骤数据，返回对象"""
+    if not blob:
+        return {}
+    if blob[0] != STEPS_FORMAT_ZLIB:
+        raise ValueError(f'未知的步骤数据格式：{blob[0]}')
+    decompressor = zlib.decompressobj(zdict=STEPS_ZDICT)
+    return json.loads(decompressor.decompress(blob[1:]) + decompressor.flush())
 
 class ProblemSolvingRecord(db.Model):
-    """解题记录模型"""
+    """解题记录模型
+    
+    四步法数据压缩后存在 steps_blob 中，并延迟加载：列表与聚合查询只读取窄行，
+    访问 get_steps_data() 时才读取并解压。
+    """
     __tablename__ = 'problem_solving_records'
+    __table_args__ = (
+        db.Index('ix_problem_records_user_type_created', 'user_id', 'problem_type', 'created_at'),
+        db.Index('ux_problem_records_ingest_id', 'ingest_id', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(50), nullable=False, default='default_user')
     problem_type = db.Column(db.String(50), nullable=False)  # math, logic, life, work
     problem_id = db.Column(db.String(50), nullable=False)
-    steps_data = db.Column(db.Text)  # JSON格式存储四步法数据
+    steps_blob = db.deferred(db.Column(db.LargeBinary))  # 压缩存储的四步法数据，见 pack_steps
     completion_time = db.Column(db.Integer, default=0)  # 完成时间（秒）
     success_rate = db.Column(db.Float, default=0.0)  # 成功率
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    ingest_id = db.Column(db.String(32))  # 延迟写入时的记录 id，用于重放去重
+    
+    # to_dict() 可输出的字段，steps_data 以外的字段都对应同名列
+    FIELDS = (
+        'id', 'user_id', 'problem_type', 'problem_id', 'steps_data',
+        'completion_time', 'success_rate', 'created_at'
+    )
+    
+    @staticmethod
+    def storage_row(record):
+        """把含 steps_data（对象或 JSON 文本）的记录字典转换为可直接插入的列值"""
+        row = dict(record)
+        row['steps_blob'] = pack_steps(row.pop('steps_data', None) or {})
+        return row
+    
+    @classmethod
+    def insert_new(cls, rows):
+        """批量插入带 ingest_id 的记录，跳过已存在的 ingest_id，返回实际插入行的 (user_id, created_at)"""
+        stmt = sqlite_insert(cls).on_conflict_do_nothing(index_elements=['ingest_id'])
+        return db.session.execute(
+            stmt.returning(cls.user_id, cls.created_at), [cls.storage_row(row) for row in rows]
+        ).all()
+    
+    @classmethod
+    def load_options(cls, fields=None):
+        """只加载输出 fields 所需的列"""
+        fields = fields or cls.FIELDS
+        columns = [getattr(cls, name) for name in fields if name != 'steps_data']
+        if 'steps_data' in fields:
+            columns.append(cls.steps_blob)
+        return [db.load_only(*columns)]
     
     def get_steps_data(self):
         """获取步骤数据"""
-        if self.steps_data:
-            return json.loads(self.steps_data)
-        return {}
+        return unpack_steps(self.steps_blob)
     
     def set_steps_data(self, data):
         """设置步骤数据"""
-        self.steps_data = json.dumps(data, ensure_ascii=False)
+        self.steps_blob = pack_steps(data)
     
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'problem_type': self.problem_type,
-            'problem_id': self.problem_id,
-            'steps_data': self.get_steps_data(),
-            'completion_time': self.completion_time,
-            'success_rate': self.success_rate,
-            'created_at': self.created_at.isoformat() if self.created_at else None
-        }
+    def to_dict(self, fields=None):
+        data = {}
+        for name in fields or self.FIELDS:
+            if name == 'steps_data':
+                data[name] = self.get_steps_data()
+            elif name == 'created_at':
+                data[name] = self.created_at.isoformat() if self.created_at else None
+            else:
+                data[name] = getattr(self, name)
+        return data
 
 class LearningStats(db.Model):
     """学习统计模型"""
     __tablename__ = 'learning_stats'
+    __table_args__ = (
+        db.Index('ux_learning_stats_user', 'user_id', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(50), nullable=False, default='default_user')
@@ -78,6 +213,10 @@ class LearningStats(db.Model):
     streak_days = db.Column(db.Integer, default=0)  # 连续学习天数
     last_activity = db.Column(db.DateTime, default=datetime.utcnow)
     skill_levels = db.Column(db.Text)  # JSON格式存储各技能等级
+    # 增量维护的聚合值，避免每次写入都重新扫描全部进度记录
+    score_sum = db.Column(db.Integer, default=0)  # 已完成课程的分数总和
+    completed_count = db.Column(db.Integer, default=0)  # 已完成课程数
+    module_stats = db.Column(db.Text)  # JSON格式存储各模块的分数总和与完成数
     
     def get_skill_levels(self):
         """获取技能等级数据"""
@@ -94,15 +233,291 @@ class LearningStats(db.Model):
         """设置技能等级数据"""
         self.skill_levels = json.dumps(data, ensure_ascii=False)
     
+    def get_module_stats(self):
+        """获取各模块聚合数据"""
+        if self.module_stats:
+            return json.loads(self.module_stats)
+        return {}
+    
+    def set_module_stats(self, data):
+        """设置各模块聚合数据"""
+        self.module_stats = json.dumps(data, ensure_ascii=False)
+    
+    def apply_progress_change(self, module, was_completed, old_score, completed, score):
+        """根据单条进度记录的新旧状态增量更新聚合值
+        
+        重复提交、完成→未完成、分数变化都只调整差值，不会重复累计。
+        """
+        old_score = (old_score or 0) if was_completed else 0
+        new_score = (score or 0) if completed else 0
+        count_delta = int(bool(completed)) - int(bool(was_completed))
+        self.apply_module_deltas({module: (count_delta, new_score - old_score)})
+    
+    def apply_module_deltas(self, module_deltas):
+        """按模块一次性累加多条进度变化，module_deltas 为 {模块: (完成数差值, 分数差值)}"""
+        module_deltas = {m: d for m, d in module_deltas.items() if d != (0, 0)}
+        if not module_deltas:
+            return
+        
+        module_stats = self.get_module_stats()
+        for module, (count_delta, score_delta) in module_deltas.items():
+            self.completed_count = (self.completed_count or 0) + count_delta
+            self.score_sum = (self.score_sum or 0) + score_delta
+            entry = module_stats.setdefault(module, {'score_sum': 0, 'completed_count': 0})
+            entry['score_sum'] += score_delta
+            entry['completed_count'] += count_delta
+        self.set_module_stats(module_stats)
+        
+        self._refresh_derived()
+    
+    def rebuild_aggregates(self):
+        """根据原始进度记录重建聚合值"""
+        rows = db.session.query(
+            UserProgress.module,
+            db.func.count(UserProgress.id),
+            db.func.coalesce(db.func.sum(UserProgress.score), 0)
+        ).filter(
+            UserProgress.user_id == self.user_id,
+            UserProgress.completed.is_(True)
+        ).group_by(UserProgress.module).all()
+        
+        module_stats = {
+            module: {'score_sum': int(score_sum), 'completed_count': count}
+            for module, count, score_sum in rows
+        }
+        self.set_module_stats(module_stats)
+        self.completed_count = sum(m['completed_count'] for m in module_stats.values())
+        self.score_sum = sum(m['score_sum'] for m in module_stats.values())
+        self._refresh_derived()
+    
+    @classmethod
+    def upsert_progress_change(cls, user_id, module, lesson_id, completed, score, time_spent, now=None):
+        """按进度记录新旧状态的差值原子地更新统计，返回更新后的统计记录
+        
+        旧状态由子查询从 user_progress 中读取，因此必须在写入进度记录之前执行；
+        统计记录不存在时直接插入。
+        """
+        now = now or datetime.utcnow()
+        old_row = db.and_(
+            UserProgress.user_id == user_id,
+            UserProgress.module == module,
+            UserProgress.lesson_id == lesson_id
+        )
+        old_completed = db.func.coalesce(
+            db.select(db.cast(UserProgress.completed, db.Integer)).where(old_row).scalar_subquery(), 0
+        )
+        old_score = db.func.coalesce(
+            db.select(
+                db.case((UserProgress.completed.is_(True), UserProgress.score), else_=0)
+            ).where(old_row).scalar_subquery(), 0
+        )
+        count_delta = int(bool(completed)) - old_completed
+        score_delta = ((score or 0) if completed else 0) - old_score
+        
+        stmt = sqlite_insert(cls).values(
+            user_id=user_id,
+            score_sum=score_delta,
+            completed_count=count_delta,
+            total_problems_solved=count_delta,
+            total_time_spent=time_spent,
+            average_score=db.case(
+                (count_delta > 0, db.cast(score_delta, db.Float) / count_delta), else_=0.0
+            ),
+            module_stats=db.func.json_object(
+                module, db.func.json_object('score_sum', score_delta, 'completed_count', count_delta)
+            ),
+            streak_days=0,
+            last_activity=now
+        )
+        excluded = stmt.excluded
+        new_sum = db.func.coalesce(cls.score_sum, 0) + excluded.score_sum
+        new_count = db.func.coalesce(cls.completed_count, 0) + excluded.completed_count
+        module_path = cls.module_json_path(module)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id'],
+            set_={
+                'score_sum': new_sum,
+                'completed_count': new_count,
+                'total_problems_solved': new_count,
+                'average_score': db.case(
+                    (new_count > 0, db.cast(new_sum, db.Float) / new_count), else_=0.0
+                ),
+                'module_stats': db.func.json_set(
+                    db.func.coalesce(cls.module_stats, '{}'),
+                    module_path,
+                    db.func.json_object(
+                        'score_sum',
+                        db.func.coalesce(db.func.json_extract(cls.module_stats, module_path + '.score_sum'), 0)
+                        + excluded.score_sum,
+                        'completed_count',
+                        db.func.coalesce(db.func.json_extract(cls.module_stats, module_path + '.completed_count'), 0)
+                        + excluded.completed_count
+                    )
+                ),
+                'total_time_spent': db.func.coalesce(cls.total_time_spent, 0) + excluded.total_time_spent,
+                'last_activity': excluded.last_activity
+            }
+        ).returning(cls)
+        return db.session.scalars(
+            stmt, execution_options={'populate_existing': True}
+        ).one()
+    
+    @staticmethod
+    def module_json_path(module):
+        """module_stats 中某个模块的 JSON 路径"""
+        return f'$."{module}"'
+    
+    def _refresh_derived(self):
+        """由聚合值推导完成数与平均分"""
+        self.total_problems_solved = self.completed_count
+        if self.completed_count:
+            self.average_score = self.score_sum / self.completed_count
+        else:
+            self.average_score = 0.0
+    
     def to_dict(self):
         return {
             'id': self.id,
             'user_id': self.user_id,
             'total_problems_solved': self.total_problems_solved,
             'total_time_spent': self.total_time_spent,
-            'average_score': self.average_score,
+            # 整数值的 REAL 列经 RETURNING 返回时可能是 int，这里统一为 float
+            'average_score': float(self.average_score or 0),
             'streak_days': self.streak_days,
             'last_activity': self.last_activity.isoformat() if self.last_activity else None,
             'skill_levels': self.get_skill_levels()
         }
 
+
+# 排行榜索引：按 (指标 DESC, id) 排序取前 K 名或计算排名时只需扫描索引
+db.Index('ix_learning_stats_rank_solved', LearningStats.total_problems_solved.desc(), LearningStats.id)
+db.Index('ix_learning_stats_rank_score', LearningStats.average_score.desc(), LearningStats.id)
+db.Index('ix_learning_stats_rank_streak', LearningStats.streak_days.desc(), LearningStats.id)
+
+class DailyUserActivity(db.Model):
+    """每日学习活动汇总模型，由写入接口增量维护，分析接口每天最多读取一行"""
+    __tablename__ = 'daily_user_activity'
+    __table_args__ = (
+        db.Index('ux_daily_user_activity_user_date', 'user_id', 'activity_date', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(50), nullable=False, default='default_user')
+    activity_date = db.Column(db.Date, nullable=False)
+    active_lessons = db.Column(db.Integer, default=0)  # 最后更新于当天的进度记录数
+    completed_lessons = db.Column(db.Integer, default=0)  # 其中已完成的记录数
+    total_time = db.Column(db.Integer, default=0)  # 已完成记录的学习时间（秒）
+    score_sum = db.Column(db.Integer, default=0)  # 已完成记录的分数总和
+    problem_records = db.Column(db.Integer, default=0)  # 当天保存的解题记录数
+    
+    @classmethod
+    def record_progress_change(cls, user_id, module, lesson_id, completed, score, time_spent, now=None):
+        """把一条进度记录从旧的更新日期移到今天
+        
+        旧状态从 user_progress 中读取，因此必须在写入进度记录之前执行。
+        """
+        now = now or datetime.utcnow()
+        old = db.select(
+            UserProgress.user_id,
+            db.func.date(UserProgress.updated_at).label('day'),
+            db.cast(UserProgress.completed, db.Integer).label('completed'),
+            db.case((UserProgress.completed.is_(True), UserProgress.time_spent), else_=0).label('time_spent'),
+            db.case((UserProgress.completed.is_(True), UserProgress.score), else_=0).label('score')
+        ).where(
+            UserProgress.user_id == user_id,
+            UserProgress.module == module,
+            UserProgress.lesson_id == lesson_id
+        ).subquery()
+        db.session.execute(
+            db.update(cls).where(
+                cls.user_id == old.c.user_id,
+                cls.activity_date == old.c.day
+            ).values(
+                active_lessons=cls.active_lessons - 1,
+                completed_lessons=cls.completed_lessons - old.c.completed,
+                total_time=cls.total_time - db.func.coalesce(old.c.time_spent, 0),
+                score_sum=cls.score_sum - db.func.coalesce(old.c.score, 0)
+            )
+        )
+        cls._upsert_day(
+            user_id, now.date(),
+            active_lessons=1,
+            completed_lessons=int(bool(completed)),
+            total_time=(time_spent or 0) if completed else 0,
+            score_sum=(score or 0) if completed else 0
+        )
+    
+    @classmethod
+    def record_problem(cls, user_id, now=None):
+        """记录当天新增一条解题记录"""
+        now = now or datetime.utcnow()
+        cls._upsert_day(user_id, now.date(), problem_records=1)
+    
+    @classmethod
+    def record_problems(cls, counts):
+        """批量记录新增解题记录，counts 为 {(user_id, 日期): 条数}"""
+        for (user_id, day), count in counts.items():
+            cls._upsert_day(user_id, day, problem_records=count)
+    
+    DELTA_COLUMNS = ('active_lessons', 'completed_lessons', 'total_time', 'score_sum', 'problem_records')
+    
+    @classmethod
+    def bulk_apply(cls, deltas, today):
+        """批量累加每日汇总，deltas 为 {(user_id, 日期): {列名: 差值}}
+        
+        today 的行不存在时插入；更早日期的行只更新已有记录（与单条写入时一致）。
+        """
+        upserts, updates = [], []
+        for (user_id, day), values in deltas.items():
+            row = {name: values.get(name, 0) for name in cls.DELTA_COLUMNS}
+            if not any(row.values()):
+                continue
+            row.update(user_id=user_id, activity_date=day)
+            (upserts if day == today else updates).append(row)
+        if upserts:
+            stmt = sqlite_insert(cls)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['user_id', 'activity_date'],
+                set_={name: getattr(cls, name) + getattr(stmt.excluded, name) for name in cls.DELTA_COLUMNS}
+            )
+            db.session.execute(stmt, upserts)
+        if updates:
+            table = cls.__table__
+            db.session.execute(
+                db.update(table).where(
+                    table.c.user_id == db.bindparam('b_user_id'),
+                    table.c.activity_date == db.bindparam('b_activity_date')
+                ).values({
+                    name: table.c[name] + db.bindparam(f'b_{name}') for name in cls.DELTA_COLUMNS
+                }),
+                [{f'b_{k}': v for k, v in row.items()} for row in updates]
+            )
+    
+    @classmethod
+    def _upsert_day(cls, user_id, day, **deltas):
+        stmt = sqlite_insert(cls).values(
+            user_id=user_id,
+            activity_date=day,
+            active_lessons=deltas.get('active_lessons', 0),
+            completed_lessons=deltas.get('completed_lessons', 0),
+            total_time=deltas.get('total_time', 0),
+            score_sum=deltas.get('score_sum', 0),
+            problem_records=deltas.get('problem_records', 0)
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'activity_date'],
+            set_={
+                name: getattr(cls, name) + getattr(stmt.excluded, name)
+                for name in deltas
+            }
+        )
+        db.session.execute(stmt)
+    
+    def to_dict(self):
+        return {
+            'date': self.activity_date.isoformat(),
+            'completed_lessons': self.completed_lessons,
+            'total_time': self.total_time,
+            'average_score': self.score_sum / self.completed_lessons if self.completed_lessons else 0,
+            'problem_records': self.problem_records
+        }
@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
+from src.models.database import RoutingSession
 
-db = SQLAlchemy()
+# 提交后不使对象过期，避免序列化返回值时再次查询数据库；报表视图的查询路由到读库
+db = SQLAlchemy(session_options={'expire_on_commit': False, 'class_': RoutingSession})
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -1,9 +1,17 @@
-from flask import Blueprint, request, jsonify
-import openai
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
 import json
 import os
+import threading
+import time
 from datetime import datetime
 from src.models.progress import db, UserProgress, ProblemSolvingRecord
+from src.services.llm_cache import LLMResponseCache, cache_key
+from src.services.llm_client import LLMClient
+from src.services.single_flight import SingleFlight
+from src.services.semantic_cache import SemanticAnswerIndex
+from src.services.conversation_history import ConversationHistory, SUMMARY_MAX_TOKENS, format_turns
+from src.services.conditional import conditional_get, content_hash, CACHE_STATIC
+from src.services.lazy import LazyObject
 
 ai_tutor_bp = Blueprint('ai_tutor', __name__)
 
@@ -75,11 +83,17 @@ POLYA_KNOWLEDGE = {
     }
 }
 
-def get_ai_response(user_message, context=None):
-    """调用OpenAI API获取AI导师回复"""
-    try:
-        # 构建系统提示
-        system_prompt = """你是一位专业的解题导师，专门指导学生运用波利亚四步解题法。你的任务是：
+# 知识库内容不变，ETag 在启动时计算一次
+KNOWLEDGE_BASE_HASH = content_hash(POLYA_KNOWLEDGE)
+
+# 上游模型与生成参数
+LLM_PARAMS = {
+    'model': 'gpt-3.5-turbo',
+    'max_tokens': 500,
+    'temperature': 0.7
+}
+
+SYSTEM_PROMPT = """你是一位专业的解题导师，专门指导学生运用波利亚四步解题法。你的任务是：
 
 1. 根据波利亚四步法（理解问题→构思方案→执行方案→回顾总结）指导学生
 2. 提供启发性的提示，而不是直接给出答案
@@ -95,25 +109,188 @@ def get_ai_response(user_message, context=None):
 
 请始终保持耐心和鼓励，引导学生独立思考。"""
 
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ]
-        
-        if context:
-            messages.append({"role": "assistant", "content": f"上下文信息：{context}"})
-        
-        messages.append({"role": "user", "content": user_message})
-
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=500,
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content
+SUMMARY_PROMPT = """请把下面的辅导对话压缩成一段简洁的摘要，供后续辅导时参考。
+保留：问题要点、学生已完成的解题步骤与结论、仍存在的困惑和错误、导师给过的关键提示。
+不要添加对话中没有的内容。"""
+
+llm_cache = LLMResponseCache.from_env()
+llm_client = LLMClient.from_env()
+single_flight = SingleFlight.from_env()
+# 索引构造时加载 numpy 与索引文件，第一次查询时才创建
+semantic_index = LazyObject(SemanticAnswerIndex.from_env)
+
+def build_messages(user_message, context=None, history=None):
+    """构建发送给模型的消息列表，history 为插入在当前问题之前的历史消息"""
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT}
+    ]
+    
+    if context:
+        messages.append({"role": "assistant", "content": f"上下文信息：{context}"})
+    
+    messages.extend(history or [])
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+def create_completion(messages, use_cache=True, on_generated=None):
+    """调用模型生成回复，命中缓存时直接返回
+    
+    use_cache=False 时跳过缓存读取，但仍用新的回复刷新缓存。调用失败时抛出异常，不会写入缓存。
+    同时进行的相同请求只发起一次上游调用；on_generated 只由实际发起调用的请求以新回复调用。
+    """
+    key = cache_key(messages, LLM_PARAMS)
+    if use_cache:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return cached
+    
+    def compute():
+        start = time.perf_counter()
+        response = llm_client.complete(messages, **LLM_PARAMS)
+        content = response.choices[0].message.content
+        llm_cache.set(key, content, time.perf_counter() - start)
+        if on_generated:
+            on_generated(content)
+        return content
+    
+    return single_flight.call(key, compute, recheck=(lambda: llm_cache.get(key)) if use_cache else None)
+
+def stream_completion(messages, use_cache=True, on_generated=None):
+    """以流式方式调用模型，逐段产出回复文本（生成器）
+    
+    命中缓存时一次性产出完整回复。只有完整生成的回复才写入缓存，并以全文调用 on_generated
+    （在读取上游的后台线程中，只调用一次）。
+    同时进行的相同请求共用一次上游流，后加入的请求从第一个片段开始收到回复；
+    所有请求都断开（生成器被关闭）后关闭上游连接，停止继续生成。
+    """
+    key = cache_key(messages, LLM_PARAMS)
+    if use_cache:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+    
+    def produce():
+        start = time.perf_counter()
+        stream = llm_client.stream(messages, **LLM_PARAMS)
+        parts = []
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        finally:
+            stream.close()
+        llm_cache.set(key, ''.join(parts), time.perf_counter() - start)
+        if on_generated:
+            on_generated(''.join(parts))
+    
+    chunks = single_flight.stream(key, produce, recheck=(lambda: llm_cache.get(key)) if use_cache else None)
+    try:
+        yield from chunks
+    finally:
+        chunks.close()
+
+def error_reply(error):
+    return f"抱歉，AI导师暂时无法回复。请稍后再试。错误信息：{str(error)}"
+
+def get_ai_response(user_message, context=None, use_cache=True):
+    """调用OpenAI API获取AI导师回复"""
+    try:
+        return create_completion(build_messages(user_message, context), use_cache)
     except Exception as e:
-        return f"抱歉，AI导师暂时无法回复。请稍后再试。错误信息：{str(e)}"
+        return error_reply(e)
+
+def summarize_turns(previous_summary, turns):
+    """调用模型把较早的对话并入滚动摘要"""
+    content = f"已有摘要：\n{previous_summary}\n\n" if previous_summary else ''
+    content += f"需要并入的对话：\n{format_turns(turns)}"
+    response = llm_client.complete(
+        [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": content}],
+        model=LLM_PARAMS['model'], max_tokens=SUMMARY_MAX_TOKENS, temperature=0.2
+    )
+    return response.choices[0].message.content
+
+# 正在后台滚动摘要的对话 (user_id, problem_context)，同一对话同时只有一个线程
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+
+def roll_summary_in_background(user_id, problem_context):
+    """在后台线程中调用模型把超出预算的较早消息并入保存的摘要，不占用对话请求的时间"""
+    key = (user_id, problem_context)
+    with _summarizing_lock:
+        if key in _summarizing:
+            return None
+        _summarizing.add(key)
+    app = current_app._get_current_object()
+    
+    def run():
+        try:
+            with app.app_context():
+                try:
+                    ConversationHistory(user_id, problem_context).fit_budget(summarize_turns)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"滚动对话摘要失败：{e}")
+        finally:
+            with _summarizing_lock:
+                _summarizing.discard(key)
+    
+    thread = threading.Thread(target=run, name='conversation-summary', daemon=True)
+    thread.start()
+    return thread
+
+def single_chunk(text):
+    yield text
+
+def cache_bypassed(data):
+    """请求是否要求绕过回复缓存（请求体 no_cache 或查询参数 no_cache=1）"""
+    return bool(data.get('no_cache')) or request.args.get('no_cache') in ('1', 'true')
+
+def wants_stream():
+    """请求是否要求以 Server-Sent Events 流式返回（Accept: text/event-stream 或 stream=1）"""
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best_match(
+        ['application/json', 'text/event-stream']
+    ) == 'text/event-stream'
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_response(first_event, first_data, chunks, result_key, on_done=None):
+    """先发送 first_event，再逐段转发 chunks 中的回复片段，最后发送带完整文本的 done 事件
+    
+    事件依次为：first_event、若干 delta（{"content": 片段}）、done 或 error。
+    完整生成后以全文调用 on_done。
+    """
+    def generate():
+        yield sse_event(first_event, first_data)
+        parts = []
+        try:
+            for delta in chunks:
+                parts.append(delta)
+                yield sse_event('delta', {'content': delta})
+        except Exception as e:
+            yield sse_event('error', {'error': error_reply(e)})
+            return
+        finally:
+            chunks.close()
+        if on_done:
+            on_done(''.join(parts))
+        yield sse_event('done', {
+            result_key: ''.join(parts),
+            'timestamp': datetime.utcnow().isoformat()
+        })
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @ai_tutor_bp.route('/chat', methods=['POST'])
 def chat_with_tutor():
@@ -132,15 +309,54 @@ def chat_with_tutor():
     if problem_context:
         context += f"\n问题背景：{problem_context}"
     
-    # 获取AI回复
-    ai_response = get_ai_response(user_message, context)
+    use_cache = not cache_bypassed(data)
+    # 带上该问题下的对话历史，超出预算的较早消息先并入摘要
+    history = ConversationHistory(user_id, problem_context)
+    # 超出预算时本次提示词先用截取式摘要，回复之后再在后台调用模型生成保存的摘要
+    needs_summary = history.fit_prompt()
+    fresh = history.is_empty
+    # 没有历史的新对话中，已回答过的近义问题直接复用回复，不调用模型
+    reused = semantic_index.lookup(user_message, current_step, problem_context) if use_cache and fresh else None
+    messages = build_messages(user_message, context, history.prompt_messages())
     
-    # 记录对话历史（可选）
-    try:
-        # 这里可以添加对话历史记录到数据库的逻辑
-        pass
-    except Exception as e:
-        print(f"记录对话历史失败：{e}")
+    def remember(answer):
+        # 记录对话历史
+        try:
+            history.record(user_message, answer)
+        except Exception as e:
+            db.session.rollback()
+            print(f"记录对话历史失败：{e}")
+        if needs_summary:
+            roll_summary_in_background(user_id, problem_context)
+    
+    def index_answer(answer):
+        # 只由实际调用模型生成回复的请求写入近义问题索引，合并到同一次调用上的请求不重复写入
+        try:
+            semantic_index.add(user_message, current_step, problem_context, answer)
+        except Exception as e:
+            print(f"记录近义问题索引失败：{e}")
+    
+    on_generated = index_answer if fresh else None
+    if wants_stream():
+        if reused is not None:
+            chunks = single_chunk(reused)
+        else:
+            chunks = stream_completion(messages, use_cache, on_generated)
+        return stream_response('step_info', {
+            'current_step': current_step,
+            'step_info': POLYA_KNOWLEDGE[f'step{current_step}']
+        }, chunks, 'response', on_done=remember)
+    
+    # 获取AI回复
+    if reused is not None:
+        ai_response = reused
+        remember(ai_response)
+    else:
+        try:
+            ai_response = create_completion(messages, use_cache, on_generated)
+            remember(ai_response)
+        except Exception as e:
+            ai_response = error_reply(e)
     
     return jsonify({
         'response': ai_response,
@@ -149,6 +365,15 @@ def chat_with_tutor():
         'step_info': POLYA_KNOWLEDGE[f'step{current_step}']
     })
 
+@ai_tutor_bp.route('/history', methods=['GET', 'DELETE'])
+def conversation_history():
+    """获取或清空某个问题下的对话历史（摘要与尚未并入摘要的消息）"""
+    user_id = request.args.get('user_id', 'default_user')
+    history = ConversationHistory(user_id, request.args.get('problem_context', ''))
+    if request.method == 'DELETE':
+        history.clear()
+    return jsonify(history.to_dict())
+
 @ai_tutor_bp.route('/hint', methods=['POST'])
 def get_hint():
     """获取解题提示"""
@@ -227,14 +452,37 @@ def analyze_solution():
 
 请用鼓励和建设性的语气回复。"""
     
-    ai_analysis = get_ai_response(analysis_prompt)
+    if wants_stream():
+        return stream_response('step_info', {
+            'step_info': {
+                key: {'name': step['name'], 'description': step['description']}
+                for key, step in POLYA_KNOWLEDGE.items()
+            }
+        }, stream_completion(build_messages(analysis_prompt), not cache_bypassed(data)), 'analysis')
+    
+    ai_analysis = get_ai_response(analysis_prompt, use_cache=not cache_bypassed(data))
     
     return jsonify({
         'analysis': ai_analysis,
         'timestamp': datetime.utcnow().isoformat()
     })
 
+@ai_tutor_bp.route('/cache-stats', methods=['GET'])
+def get_cache_stats():
+    """获取回复缓存命中率与节省的上游延迟、近义问题复用情况（当前进程）"""
+    stats = llm_cache.stats()
+    stats['semantic'] = semantic_index.stats()
+    return jsonify(stats)
+
+@ai_tutor_bp.route('/client-stats', methods=['GET'])
+def get_client_stats():
+    """获取上游调用的延迟分位数、结果计数、重试与对冲次数及请求合并情况（当前进程）"""
+    stats = llm_client.stats()
+    stats['single_flight'] = single_flight.stats()
+    return jsonify(stats)
+
 @ai_tutor_bp.route('/knowledge-base', methods=['GET'])
+@conditional_get(lambda: [KNOWLEDGE_BASE_HASH], CACHE_STATIC)
 def get_knowledge_base():
     """获取波利亚四步法知识库"""
     return jsonify(POLYA_KNOWLEDGE)
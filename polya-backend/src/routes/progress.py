@@ -1,16 +1,75 @@
-from flask import Blueprint, request, jsonify
-from src.models.progress import db, UserProgress, ProblemSolvingRecord, LearningStats
-from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, current_app
+import click
+from src.models.progress import db, UserProgress, ProblemSolvingRecord, LearningStats, DailyUserActivity
+from datetime import datetime, timedelta, date
 import json
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from src.models.database import reporting_reads
+from src.services.result_cache import result_cache
+from src.services.conditional import conditional_get, user_version_parts, CACHE_PRIVATE_REVALIDATE
+from src.services.pagination import wants_legacy, wants_stream, page_args, keyset_page, ndjson_response
+from src.services.write_behind import WriteBehindQueue, QueueFull
 
 progress_bp = Blueprint('progress', __name__)
 
+# 模块名会作为 module_stats 的 JSON 路径，只允许字母、数字、下划线和连字符
+MODULE_PATTERN = re.compile(r'^[\w-]+$')
+# 单次批量写入最多包含的进度事件与解题记录数
+BATCH_MAX_ITEMS = 10000
+
+# 进度列表按 (updated_at, id) 分页，命中 ix_user_progress_user_updated；
+# 翻页期间被更新的进度会移到末尾再次出现，不会被跳过
+PROGRESS_PAGE_COLUMNS = (UserProgress.updated_at, UserProgress.id)
+
 @progress_bp.route('/progress', methods=['GET'])
+@conditional_get(user_version_parts(result_cache), CACHE_PRIVATE_REVALIDATE)
 def get_user_progress():
-    """获取用户学习进度"""
+    """获取用户学习进度
+    
+    按更新时间游标分页：limit（默认 50，最多 500）、cursor（上一页的 next_cursor），可按 module 过滤；
+    第一页附带学习统计。stream=1 时以 NDJSON 逐行输出全部进度。
+    legacy=1 时返回按模块分组的完整进度（旧格式）。结果按用户数据版本缓存。
+    """
     user_id = request.args.get('user_id', 'default_user')
+    if wants_legacy():
+        return jsonify(result_cache.get_or_compute(
+            'progress', user_id, None, lambda: build_user_progress(user_id)
+        ))
+    module = request.args.get('module')
+    if module and not MODULE_PATTERN.match(module):
+        return jsonify({'error': '无效的模块名称'}), 400
+    try:
+        limit, cursor = page_args(PROGRESS_PAGE_COLUMNS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # 获取各模块进度
+    query = UserProgress.query.filter(UserProgress.user_id == user_id)
+    if module:
+        query = query.filter(UserProgress.module == module)
+    if wants_stream():
+        return ndjson_response(query, PROGRESS_PAGE_COLUMNS, UserProgress.to_dict, cursor)
+    params = {'module': module, 'limit': limit, 'cursor': request.args.get('cursor')}
+    return jsonify(result_cache.get_or_compute(
+        'progress_page', user_id, params, lambda: build_progress_page(user_id, query, limit, cursor)
+    ))
+
+def build_progress_page(user_id, query, limit, cursor):
+    items, next_cursor = keyset_page(query, PROGRESS_PAGE_COLUMNS, limit, cursor)
+    page = {
+        'progress': [p.to_dict() for p in items],
+        'next_cursor': next_cursor
+    }
+    if cursor is None:
+        stats = LearningStats.query.filter_by(user_id=user_id).first()
+        page['stats'] = stats.to_dict() if stats else None
+    return page
+
+def build_user_progress(user_id):
+    # 获取各模块进度（旧格式）
     theory_progress = UserProgress.query.filter_by(
         user_id=user_id, module='theory'
     ).all()
@@ -30,73 +89,97 @@ def get_user_progress():
         db.session.add(stats)
         db.session.commit()
     
-    return jsonify({
+    return {
         'theory': [p.to_dict() for p in theory_progress],
         'cases': [p.to_dict() for p in cases_progress],
         'practice': [p.to_dict() for p in practice_progress],
         'stats': stats.to_dict()
-    })
+    }
 
 @progress_bp.route('/progress', methods=['POST'])
 def update_progress():
     """更新学习进度"""
-    data = request.get_json()
-    user_id = data.get('user_id', 'default_user')
-    module = data.get('module')
-    lesson_id = data.get('lesson_id')
-    completed = data.get('completed', False)
-    score = data.get('score', 0)
-    time_spent = data.get('time_spent', 0)
-    
-    # 查找或创建进度记录
-    progress = UserProgress.query.filter_by(
-        user_id=user_id, module=module, lesson_id=lesson_id
-    ).first()
-    
-    if not progress:
-        progress = UserProgress(
-            user_id=user_id,
-            module=module,
-            lesson_id=lesson_id
-        )
-        db.session.add(progress)
+    # 与批量写入使用相同的校验，分数与学习时间必须是整数
+    try:
+        event = parse_progress_event(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    user_id, module, lesson_id = event['user_id'], event['module'], event['lesson_id']
+    completed, score, time_spent = event['completed'], event['score'], event['time_spent']
     
-    progress.completed = completed
-    progress.score = score
-    progress.time_spent = time_spent
-    progress.updated_at = datetime.utcnow()
-    
-    # 更新学习统计
-    stats = LearningStats.query.filter_by(user_id=user_id).first()
-    if not stats:
-        stats = LearningStats(user_id=user_id)
-        db.session.add(stats)
-    
-    if completed:
-        stats.total_problems_solved += 1
-    
-    stats.total_time_spent += time_spent
-    stats.last_activity = datetime.utcnow()
-    
-    # 计算平均分数
-    all_progress = UserProgress.query.filter_by(
-        user_id=user_id, completed=True
-    ).all()
-    if all_progress:
-        total_score = sum(p.score for p in all_progress)
-        stats.average_score = total_score / len(all_progress)
+    now = datetime.utcnow()
+    # 先按旧进度与新进度的差值更新统计和每日汇总（旧状态在同一条语句内读取），再写入进度；
+    # 写入都是 UPSERT，在同一事务内执行，并发的首次写入也不会产生重复记录
+    stats = LearningStats.upsert_progress_change(
+        user_id, module, lesson_id, completed, score, time_spent, now
+    )
+    DailyUserActivity.record_progress_change(
+        user_id, module, lesson_id, completed, score, time_spent, now
+    )
+    progress = UserProgress.upsert(
+        user_id, module, lesson_id, completed, score, time_spent, now
+    )
     
     db.session.commit()
+    result_cache.bump_version(user_id)
+    
+    stats_data = stats.to_dict()
+    leaderboard_snapshot.patch(stats_data)
     
     return jsonify({
         'success': True,
         'progress': progress.to_dict(),
-        'stats': stats.to_dict()
+        'stats': stats_data
     })
 
+def write_problem_records(entries):
+    """把延迟写入队列中的一批解题记录在一个事务内写入，已写入过的 ingest_id（重放）会被跳过"""
+    rows = [
+        dict(data, ingest_id=entry_id, created_at=datetime.fromisoformat(data['created_at']))
+        for entry_id, data in entries
+    ]
+    try:
+        inserted = ProblemSolvingRecord.insert_new(rows)
+        DailyUserActivity.record_problems(Counter((user_id, created_at.date()) for user_id, created_at in inserted))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    for user_id in {user_id for user_id, _ in inserted}:
+        result_cache.bump_version(user_id)
+
+def create_problem_record_queue(app):
+    """为应用创建解题记录写入队列（保存在 app.extensions 中），启用延迟写入时重放遗留日志并启动写入线程
+    
+    每个应用一个队列，经该应用的上下文写入它自己的数据库；日志默认放在数据库文件旁的 write_behind 目录。
+    """
+    queue = WriteBehindQueue.from_env(
+        write_problem_records,
+        journal_dir=os.path.join(os.path.dirname(os.path.abspath(app.config['DATABASE_PATH'])), 'write_behind'),
+        name='problem-record-writer'
+    )
+    app.extensions['problem_record_queue'] = queue
+    queue.start(app)
+    return queue
+
+def problem_record_queue():
+    """当前应用的解题记录写入队列"""
+    return current_app.extensions['problem_record_queue']
+
 @progress_bp.route('/problem-record', methods=['POST'])
 def save_problem_record():
-    """保存解题记录"""
+    """保存解题记录
+    
+    启用延迟写入（PROBLEM_RECORD_WRITE_BEHIND=1）时记录进入写入队列，立即返回 202 与记录 id，
+    可通过 GET /problem-record/<记录 id> 查询是否已写入；队列已满时返回 503。
+    fields 参数（逗号分隔）指定返回记录中的字段。
+    """
+    try:
+        fields = parse_record_fields()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if problem_record_queue().started:
+        return enqueue_problem_record(request.get_json(silent=True))
     data = request.get_json()
     user_id = data.get('user_id', 'default_user')
     problem_type = data.get('problem_type')
@@ -110,116 +193,512 @@ def save_problem_record():
         problem_type=problem_type,
         problem_id=problem_id,
         completion_time=completion_time,
-        success_rate=success_rate
+        success_rate=success_rate,
+        created_at=datetime.utcnow()
     )
     record.set_steps_data(steps_data)
     
     db.session.add(record)
+    DailyUserActivity.record_problem(user_id, record.created_at)
     db.session.commit()
+    result_cache.bump_version(user_id)
     
     return jsonify({
         'success': True,
-        'record': record.to_dict()
+        'record': record.to_dict(fields)
     })
 
-@progress_bp.route('/analytics', methods=['GET'])
-def get_analytics():
-    """获取学习分析数据"""
+def parse_record_fields():
+    """解析 fields 参数，未指定时返回 None（全部字段）"""
+    value = request.args.get('fields')
+    if not value:
+        return None
+    fields = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in ProblemSolvingRecord.FIELDS]
+    if unknown or not fields:
+        raise ValueError(f"无效的字段：{', '.join(unknown)}，可选字段：{', '.join(ProblemSolvingRecord.FIELDS)}")
+    return fields
+
+def enqueue_problem_record(item):
+    try:
+        record = parse_problem_record(item)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    record['created_at'] = datetime.utcnow().isoformat()
+    try:
+        record_id = problem_record_queue().submit(record)
+    except QueueFull:
+        response = jsonify({'error': '解题记录写入繁忙，请稍后重试'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    return jsonify({
+        'success': True,
+        'status': 'queued',
+        'record_id': record_id
+    }), 202
+
+@progress_bp.route('/problem-record/<record_id>', methods=['GET'])
+def get_problem_record_status(record_id):
+    """查询延迟写入的解题记录：仍在队列中返回 202，已写入返回记录（支持 fields 参数）"""
+    try:
+        fields = parse_record_fields()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if problem_record_queue().is_pending(record_id):
+        return jsonify({'status': 'queued', 'record_id': record_id}), 202
+    record = ProblemSolvingRecord.query.options(
+        *ProblemSolvingRecord.load_options(fields)
+    ).filter_by(ingest_id=record_id).first()
+    if record is None:
+        return jsonify({'error': '记录不存在'}), 404
+    return jsonify({'status': 'stored', 'record': record.to_dict(fields)})
+
+@progress_bp.route('/problem-records', methods=['GET'])
+def list_problem_records():
+    """获取用户最近的解题记录
+    
+    可按 problem_type 过滤，limit 默认 20、最多 100。fields 参数指定返回的字段，
+    只查询这些字段对应的列；不需要 steps_data 时不读取也不解压步骤数据。
+    """
     user_id = request.args.get('user_id', 'default_user')
+    problem_type = request.args.get('problem_type')
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    try:
+        fields = parse_record_fields()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # 获取最近30天的学习记录
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    recent_progress = UserProgress.query.filter(
-        UserProgress.user_id == user_id,
-        UserProgress.updated_at >= thirty_days_ago
-    ).all()
+    query = ProblemSolvingRecord.query.options(
+        *ProblemSolvingRecord.load_options(fields)
+    ).filter(ProblemSolvingRecord.user_id == user_id)
+    if problem_type:
+        query = query.filter(ProblemSolvingRecord.problem_type == problem_type)
+    records = query.order_by(
+        ProblemSolvingRecord.created_at.desc(), ProblemSolvingRecord.id.desc()
+    ).limit(limit).all()
     
-    # 获取解题记录
-    problem_records = ProblemSolvingRecord.query.filter_by(
-        user_id=user_id
-    ).all()
+    return jsonify({
+        'records': [record.to_dict(fields) for record in records]
+    })
+
+def parse_progress_event(item):
+    """校验一条批量进度事件并规范化字段，无效时抛出 ValueError"""
+    if not isinstance(item, dict):
+        raise ValueError('事件格式无效')
+    module = item.get('module')
+    lesson_id = item.get('lesson_id')
+    if not module or not lesson_id:
+        raise ValueError('缺少模块或课程ID')
+    if not isinstance(module, str) or not MODULE_PATTERN.match(module):
+        raise ValueError('无效的模块名称')
+    try:
+        score = int(item.get('score') or 0)
+        time_spent = int(item.get('time_spent') or 0)
+    except (TypeError, ValueError):
+        raise ValueError('分数或学习时间无效')
+    return {
+        'user_id': str(item.get('user_id') or 'default_user'),
+        'module': module,
+        'lesson_id': str(lesson_id),
+        'completed': bool(item.get('completed', False)),
+        'score': score,
+        'time_spent': time_spent
+    }
+
+def parse_problem_record(item):
+    """校验一条批量解题记录并规范化字段，无效时抛出 ValueError"""
+    if not isinstance(item, dict):
+        raise ValueError('记录格式无效')
+    if not item.get('problem_type') or not item.get('problem_id'):
+        raise ValueError('缺少问题类型或问题ID')
+    try:
+        completion_time = int(item.get('completion_time') or 0)
+        success_rate = float(item.get('success_rate') or 0.0)
+    except (TypeError, ValueError):
+        raise ValueError('完成时间或成功率无效')
+    return {
+        'user_id': str(item.get('user_id') or 'default_user'),
+        'problem_type': str(item['problem_type']),
+        'problem_id': str(item['problem_id']),
+        'steps_data': json.dumps(item.get('steps_data', {}), ensure_ascii=False),
+        'completion_time': completion_time,
+        'success_rate': success_rate
+    }
+
+@progress_bp.route('/progress/batch', methods=['POST'])
+def update_progress_batch():
+    """批量写入学习进度与解题记录
+    
+    请求体为 {"progress": [...], "problem_records": [...]}，字段与单条接口相同，可包含多个用户。
+    同一 (user_id, module, lesson_id) 的多条进度只写入最后一条，其余标记为 superseded；
+    学习时间按全部有效事件累计，结果与逐条提交一致。全部写入在一个事务内以批量 UPSERT 完成，
+    每个用户的学习统计只更新一次。返回与输入顺序一一对应的逐条结果。
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': '请求体应为 JSON 对象'}), 400
+    progress_items = data.get('progress') or []
+    record_items = data.get('problem_records') or []
+    if not isinstance(progress_items, list) or not isinstance(record_items, list):
+        return jsonify({'error': 'progress 与 problem_records 应为数组'}), 400
+    if len(progress_items) + len(record_items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'单次最多提交 {BATCH_MAX_ITEMS} 条数据'}), 413
+    
+    # 校验并去重：同一课程保留最后一条
+    progress_results = [None] * len(progress_items)
+    latest = {}
+    time_by_user = Counter()
+    for index, item in enumerate(progress_items):
+        try:
+            event = parse_progress_event(item)
+        except ValueError as e:
+            progress_results[index] = {'index': index, 'status': 'invalid', 'error': str(e)}
+            continue
+        key = (event['user_id'], event['module'], event['lesson_id'])
+        if key in latest:
+            previous = latest[key][0]
+            progress_results[previous] = {'index': previous, 'status': 'superseded', 'superseded_by': index}
+        latest[key] = (index, event)
+        time_by_user[event['user_id']] += event['time_spent']
+    
+    record_results = [None] * len(record_items)
+    records = []
+    for index, item in enumerate(record_items):
+        try:
+            records.append((index, parse_problem_record(item)))
+        except ValueError as e:
+            record_results[index] = {'index': index, 'status': 'invalid', 'error': str(e)}
     
-    # 按日期分组统计
-    daily_stats = {}
-    for progress in recent_progress:
-        date_key = progress.updated_at.strftime('%Y-%m-%d')
-        if date_key not in daily_stats:
-            daily_stats[date_key] = {
-                'date': date_key,
-                'completed_lessons': 0,
-                'total_time': 0,
-                'average_score': 0,
-                'scores': []
-            }
+    now = datetime.utcnow()
+    today = now.date()
+    # 先取得写锁，读取旧进度到写入之间不会有其他写入插入
+    db.session.connection().exec_driver_sql('BEGIN IMMEDIATE')
+    try:
+        old_states = UserProgress.load_states(latest)
+        module_deltas = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+        day_deltas = defaultdict(Counter)
+        progress_rows = []
+        for key, (index, event) in latest.items():
+            user_id, module, _ = key
+            completed, score, time_spent = event['completed'], event['score'], event['time_spent']
+            old = old_states.get(key)
+            was_completed = bool(old and old[0])
+            old_score = (old[1] or 0) if was_completed else 0
+            old_time = (old[2] or 0) if was_completed else 0
+            
+            entry = module_deltas[user_id][module]
+            entry[0] += int(completed) - int(was_completed)
+            entry[1] += (score if completed else 0) - old_score
+            
+            # 每日汇总：从旧的更新日期移到今天
+            if old and old[3]:
+                old_day = day_deltas[(user_id, old[3].date())]
+                old_day['active_lessons'] -= 1
+                old_day['completed_lessons'] -= int(was_completed)
+                old_day['total_time'] -= old_time
+                old_day['score_sum'] -= old_score
+            new_day = day_deltas[(user_id, today)]
+            new_day['active_lessons'] += 1
+            new_day['completed_lessons'] += int(completed)
+            new_day['total_time'] += time_spent if completed else 0
+            new_day['score_sum'] += score if completed else 0
+            
+            progress_rows.append(dict(event, created_at=now, updated_at=now))
         
-        if progress.completed:
-            daily_stats[date_key]['completed_lessons'] += 1
-            daily_stats[date_key]['total_time'] += progress.time_spent
-            daily_stats[date_key]['scores'].append(progress.score)
-    
-    # 计算每日平均分
-    for date_key in daily_stats:
-        scores = daily_stats[date_key]['scores']
-        if scores:
-            daily_stats[date_key]['average_score'] = sum(scores) / len(scores)
-    
-    # 按问题类型统计
-    problem_type_stats = {}
-    for record in problem_records:
-        ptype = record.problem_type
-        if ptype not in problem_type_stats:
-            problem_type_stats[ptype] = {
-                'type': ptype,
-                'count': 0,
-                'average_time': 0,
-                'average_success_rate': 0,
-                'times': [],
-                'success_rates': []
-            }
+        progress_ids = UserProgress.bulk_upsert(progress_rows)
+        record_ids = db.session.scalars(
+            db.insert(ProblemSolvingRecord).returning(ProblemSolvingRecord.id, sort_by_parameter_order=True),
+            [ProblemSolvingRecord.storage_row(dict(record, created_at=now)) for _, record in records]
+        ).all() if records else []
+        for _, record in records:
+            day_deltas[(record['user_id'], today)]['problem_records'] += 1
+        DailyUserActivity.bulk_apply(day_deltas, today)
         
-        problem_type_stats[ptype]['count'] += 1
-        problem_type_stats[ptype]['times'].append(record.completion_time)
-        problem_type_stats[ptype]['success_rates'].append(record.success_rate)
-    
-    # 计算平均值
-    for ptype in problem_type_stats:
-        stats = problem_type_stats[ptype]
-        if stats['times']:
-            stats['average_time'] = sum(stats['times']) / len(stats['times'])
-        if stats['success_rates']:
-            stats['average_success_rate'] = sum(stats['success_rates']) / len(stats['success_rates'])
+        # 每个用户的统计只读写一次
+        existing = {
+            s.user_id: s for s in LearningStats.query.filter(LearningStats.user_id.in_(list(module_deltas)))
+        } if module_deltas else {}
+        user_stats = {}
+        for user_id, deltas in module_deltas.items():
+            stats = existing.get(user_id)
+            if stats is None:
+                stats = LearningStats(
+                    user_id=user_id, total_problems_solved=0, total_time_spent=0, average_score=0.0,
+                    streak_days=0, score_sum=0, completed_count=0
+                )
+                db.session.add(stats)
+            stats.apply_module_deltas({module: tuple(d) for module, d in deltas.items()})
+            stats.total_time_spent = (stats.total_time_spent or 0) + time_by_user[user_id]
+            stats.last_activity = now
+            user_stats[user_id] = stats
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    
+    for (key, (index, _)), progress_id in zip(latest.items(), progress_ids):
+        user_id, module, lesson_id = key
+        progress_results[index] = {
+            'index': index, 'status': 'applied', 'id': progress_id,
+            'user_id': user_id, 'module': module, 'lesson_id': lesson_id
+        }
+    for (index, _), record_id in zip(records, record_ids):
+        record_results[index] = {'index': index, 'status': 'created', 'id': record_id}
+    
+    for user_id in set(user_stats) | {record['user_id'] for _, record in records}:
+        result_cache.bump_version(user_id)
+    stats_data = {user_id: stats.to_dict() for user_id, stats in user_stats.items()}
+    if len(stats_data) <= LEADERBOARD_SIZE:
+        for entry in stats_data.values():
+            leaderboard_snapshot.patch(entry)
+    else:
+        leaderboard_snapshot.invalidate()
     
     return jsonify({
-        'daily_progress': list(daily_stats.values()),
-        'problem_type_stats': list(problem_type_stats.values()),
-        'total_records': len(problem_records),
-        'recent_activity': len(recent_progress)
+        'success': True,
+        'applied': len(progress_ids),
+        'created': len(record_ids),
+        'invalid': sum(1 for r in progress_results + record_results if r['status'] == 'invalid'),
+        'progress': progress_results,
+        'problem_records': record_results,
+        'stats': stats_data
     })
 
+def analytics_etag_parts():
+    # 未指定日期范围时默认窗口随日期移动
+    return user_version_parts(result_cache)() + [datetime.utcnow().date().isoformat()]
+
+@progress_bp.route('/analytics', methods=['GET'])
+@conditional_get(analytics_etag_parts, CACHE_PRIVATE_REVALIDATE)
+@reporting_reads
+def get_analytics():
+    """获取学习分析数据
+    
+    可选参数 from/to（YYYY-MM-DD）指定日期范围，默认为最近30天；
+    每日数据读取 daily_user_activity 汇总表，每天最多一行。
+    问题类型统计在指定 from/to 时只统计该范围内的解题记录，否则统计全部记录。
+    """
+    user_id = request.args.get('user_id', 'default_user')
+    try:
+        date_to = parse_date_arg('to') or datetime.utcnow().date()
+        date_from = parse_date_arg('from') or (datetime.utcnow() - timedelta(days=30)).date()
+    except ValueError:
+        return jsonify({'error': '日期格式应为 YYYY-MM-DD'}), 400
+    filter_records = 'from' in request.args or 'to' in request.args
+    
+    return jsonify(result_cache.get_or_compute(
+        'analytics', user_id, [date_from.isoformat(), date_to.isoformat(), filter_records],
+        lambda: build_analytics(user_id, date_from, date_to, filter_records)
+    ))
+
+def build_analytics(user_id, date_from, date_to, filter_records):
+    # 按日期读取汇总数据
+    daily_rows = DailyUserActivity.query.filter(
+        DailyUserActivity.user_id == user_id,
+        DailyUserActivity.activity_date >= date_from,
+        DailyUserActivity.activity_date <= date_to,
+        db.or_(DailyUserActivity.active_lessons > 0, DailyUserActivity.problem_records > 0)
+    ).order_by(DailyUserActivity.activity_date).all()
+    
+    # 按问题类型聚合，只读取需要的列
+    type_query = db.session.query(
+        ProblemSolvingRecord.problem_type,
+        db.func.count(ProblemSolvingRecord.id),
+        db.func.avg(ProblemSolvingRecord.completion_time),
+        db.func.avg(ProblemSolvingRecord.success_rate)
+    ).filter(ProblemSolvingRecord.user_id == user_id)
+    if filter_records:
+        type_query = type_query.filter(
+            ProblemSolvingRecord.created_at >= datetime.combine(date_from, datetime.min.time()),
+            ProblemSolvingRecord.created_at < datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+        )
+    problem_type_stats = [
+        {
+            'type': ptype,
+            'count': count,
+            'average_time': avg_time or 0,
+            'average_success_rate': avg_rate or 0
+        }
+        for ptype, count, avg_time, avg_rate in type_query.group_by(ProblemSolvingRecord.problem_type)
+    ]
+    
+    return {
+        'daily_progress': [row.to_dict() for row in daily_rows],
+        'problem_type_stats': problem_type_stats,
+        'total_records': sum(s['count'] for s in problem_type_stats),
+        'recent_activity': sum(row.active_lessons for row in daily_rows),
+        'from': date_from.isoformat(),
+        'to': date_to.isoformat()
+    }
+
+def parse_date_arg(name):
+    """解析 YYYY-MM-DD 格式的查询参数"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    return date.fromisoformat(value)
+
+# 排行榜名称与对应的统计列
+LEADERBOARD_BOARDS = {
+    'by_problems_solved': 'total_problems_solved',
+    'by_average_score': 'average_score',
+    'by_streak_days': 'streak_days'
+}
+LEADERBOARD_SIZE = 10
+# to_dict() 需要的列，排行榜查询只读取这些列
+LEADERBOARD_LOAD_COLUMNS = (
+    LearningStats.id, LearningStats.user_id, LearningStats.total_problems_solved,
+    LearningStats.total_time_spent, LearningStats.average_score, LearningStats.streak_days,
+    LearningStats.last_activity, LearningStats.skill_levels
+)
+
+def query_leaderboard(column_name, limit):
+    """按 (指标 DESC, id) 走索引取前 limit 名"""
+    column = getattr(LearningStats, column_name)
+    return LearningStats.query.options(
+        db.load_only(*LEADERBOARD_LOAD_COLUMNS)
+    ).order_by(column.desc(), LearningStats.id).limit(limit).all()
+
+class LeaderboardSnapshot:
+    """进程内排行榜快照
+    
+    统计写入后调用 patch() 增量修补；无法确定新的第 K 名时失效重建。
+    多进程部署时其他进程的写入看不到，因此快照另有 max_age 秒的有效期。
+    patch() 与 invalidate() 递增代数；重建期间代数变化（有写入）时，重建结果不保存为快照。
+    """
+    
+    def __init__(self, size=LEADERBOARD_SIZE, max_age=30):
+        self.size = size
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._boards = None
+        self._built_at = 0.0
+        self._generation = 0
+    
+    def get(self):
+        with self._lock:
+            if self._boards is not None and time.monotonic() - self._built_at < self.max_age:
+                return self._boards
+            generation = self._generation
+        boards = {
+            name: [s.to_dict() for s in query_leaderboard(column, self.size)]
+            for name, column in LEADERBOARD_BOARDS.items()
+        }
+        with self._lock:
+            if self._generation == generation:
+                self._boards = boards
+                self._built_at = time.monotonic()
+        return boards
+    
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._boards = None
+    
+    def patch(self, stats):
+        """用一条刚写入的统计记录（to_dict() 结果）修补快照"""
+        with self._lock:
+            self._generation += 1
+            if self._boards is None:
+                return
+            boards = {}
+            for name, column in LEADERBOARD_BOARDS.items():
+                board = self._boards[name]
+                remaining = [e for e in board if e['user_id'] != stats['user_id']]
+                was_listed = len(remaining) < len(board)
+                remaining.append(stats)
+                remaining.sort(key=lambda e: (-(e[column] or 0), e['id']))
+                # 该用户原本在榜上且现在落到已知条目之后：真正的第 K 名可能不在快照里
+                if was_listed and len(board) == self.size and remaining[-1] is stats:
+                    self._boards = None
+                    return
+                boards[name] = remaining[:self.size]
+            self._boards = boards
+
+leaderboard_snapshot = LeaderboardSnapshot()
+
+def leaderboard_around_user(user_id, window):
+    """返回用户在各排行榜中的排名及前后各 window 名，只扫描排行榜索引"""
+    stats = LearningStats.query.options(
+        db.load_only(*LEADERBOARD_LOAD_COLUMNS)
+    ).filter_by(user_id=user_id).first()
+    if not stats:
+        return None
+    
+    result = {'user_id': user_id}
+    for name, column_name in LEADERBOARD_BOARDS.items():
+        column = getattr(LearningStats, column_name)
+        value = getattr(stats, column_name) or 0
+        ahead = db.or_(column > value, db.and_(column == value, LearningStats.id < stats.id))
+        behind = db.or_(column < value, db.and_(column == value, LearningStats.id > stats.id))
+        
+        # 拆成两段计数，各自是排行榜索引上的一段范围扫描（OR 条件无法直接用作索引范围）
+        count = db.session.query(db.func.count(LearningStats.id))
+        rank = (
+            count.filter(column > value).scalar()
+            + count.filter(column == value, LearningStats.id < stats.id).scalar()
+            + 1
+        )
+        above = LearningStats.query.options(db.load_only(*LEADERBOARD_LOAD_COLUMNS)).filter(
+            ahead
+        ).order_by(column.asc(), LearningStats.id.desc()).limit(window).all()
+        below = LearningStats.query.options(db.load_only(*LEADERBOARD_LOAD_COLUMNS)).filter(
+            behind
+        ).order_by(column.desc(), LearningStats.id).limit(window).all()
+        
+        entries = list(reversed(above)) + [stats] + below
+        first_rank = rank - len(above)
+        result[name] = {
+            'rank': rank,
+            'entries': [
+                dict(s.to_dict(), rank=first_rank + i) for i, s in enumerate(entries)
+            ]
+        }
+    return result
+
 @progress_bp.route('/leaderboard', methods=['GET'])
+@reporting_reads
 def get_leaderboard():
-    """获取排行榜数据"""
-    # 获取所有用户的统计数据
-    all_stats = LearningStats.query.all()
-    
-    # 按不同维度排序
-    leaderboard = {
-        'by_problems_solved': sorted(
-            [s.to_dict() for s in all_stats],
-            key=lambda x: x['total_problems_solved'],
-            reverse=True
-        )[:10],
-        'by_average_score': sorted(
-            [s.to_dict() for s in all_stats],
-            key=lambda x: x['average_score'],
-            reverse=True
-        )[:10],
-        'by_streak_days': sorted(
-            [s.to_dict() for s in all_stats],
-            key=lambda x: x['streak_days'],
-            reverse=True
-        )[:10]
-    }
+    """获取排行榜数据
+    
+    可选参数 around_user 返回该用户的排名及前后 window 名（默认5名）。
+    """
+    leaderboard = dict(leaderboard_snapshot.get())
+    
+    around_user = request.args.get('around_user')
+    if around_user:
+        window = min(max(request.args.get('window', 5, type=int), 0), 50)
+        leaderboard['around_user'] = leaderboard_around_user(around_user, window)
     
     return jsonify(leaderboard)
 
+@progress_bp.route('/cache-stats', methods=['GET'])
+def get_cache_stats():
+    """获取结果缓存的命中统计与解题记录写入队列状态
+
+    两者都只反映处理本次请求的工作进程：每个进程有自己的写入队列与命中计数（write_behind.pid 标明进程）。
+    """
+    return jsonify(dict(result_cache.stats(), write_behind=problem_record_queue().stats()))
+
+@progress_bp.cli.command('rebuild-stats')
+@click.option('--user-id', default=None, help='只重建指定用户的统计数据')
+def rebuild_stats_command(user_id):
+    """根据原始进度记录重建学习统计聚合值"""
+    if user_id:
+        user_ids = [user_id]
+    else:
+        user_ids = {row[0] for row in db.session.query(UserProgress.user_id).distinct()}
+        user_ids |= {row[0] for row in db.session.query(LearningStats.user_id).distinct()}
+    
+    for uid in user_ids:
+        stats = LearningStats.query.filter_by(user_id=uid).first()
+        if not stats:
+            stats = LearningStats(user_id=uid, total_time_spent=0)
+            db.session.add(stats)
+        stats.rebuild_aggregates()
+    
+    db.session.commit()
+    for uid in user_ids:
+        result_cache.bump_version(uid)
+    leaderboard_snapshot.invalidate()
+    click.echo(f'已重建 {len(user_ids)} 个用户的学习统计')
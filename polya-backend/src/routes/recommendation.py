@@ -1,16 +1,39 @@
 from flask import Blueprint, request, jsonify
-import numpy as np
 from datetime import datetime, timedelta
 from collections import defaultdict
 import json
+import os
+import threading
+import time
+import click
+from src.models.database import reporting_reads
+from src.services.conditional import conditional_get, user_version_parts, CACHE_PRIVATE_REVALIDATE
 from src.models.progress import db, UserProgress, ProblemSolvingRecord, LearningStats
+from src.services.collaborative_filtering import RatingMatrix, CFModelStore, train_model
+from src.services.content_based import ContentCatalog
+from src.services.result_cache import result_cache
+from src.services.lazy import LazyObject
 
 recommendation_bp = Blueprint('recommendation', __name__)
 
+# 基于课程的协同过滤：每门课程保留的相似课程数与索引刷新间隔（秒）
+ITEM_NEIGHBOURS_K = 20
+ITEM_INDEX_MAX_AGE = 600
+
+# 离线训练的协同过滤模型目录
+CF_MODEL_DIR = os.environ.get(
+    'CF_MODEL_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'database', 'cf_model')
+)
+cf_model_store = CFModelStore(CF_MODEL_DIR)
+
 class PersonalizedRecommendationEngine:
     """个性化推荐引擎"""
     
     def __init__(self):
+        # 课程邻居索引：课程目录小且稳定，按需构建并定期刷新
+        self._item_index = None
+        self._item_index_lock = threading.Lock()
         self.content_features = {
             'theory_lessons': [
                 {
@@ -139,13 +162,44 @@ class PersonalizedRecommendationEngine:
                 }
             ]
         }
+        # 预编码内容目录，打分时不再逐条遍历
+        self.content_catalog = ContentCatalog(self.content_features)
     
     def get_user_profile(self, user_id):
-        """获取用户画像"""
-        # 获取用户学习历史
-        user_progress = UserProgress.query.filter_by(user_id=user_id).all()
-        problem_records = ProblemSolvingRecord.query.filter_by(user_id=user_id).all()
-        learning_stats = LearningStats.query.filter_by(user_id=user_id).first()
+        """获取用户画像（按用户数据版本缓存）"""
+        return result_cache.get_or_compute(
+            'profile', user_id, None, lambda: self.build_user_profile(user_id)
+        )
+    
+    def build_user_profile(self, user_id):
+        """根据学习记录计算用户画像"""
+        # 按模块聚合学习进度：总数、完成数、已完成课程的分数总和
+        module_rows = db.session.query(
+            UserProgress.module,
+            db.func.count(UserProgress.id),
+            db.func.sum(db.case((UserProgress.completed.is_(True), 1), else_=0)),
+            db.func.sum(db.case((UserProgress.completed.is_(True), db.func.coalesce(UserProgress.score, 0)), else_=0))
+        ).filter(
+            UserProgress.user_id == user_id
+        ).group_by(UserProgress.module).order_by(
+            # 与逐行计算时一致：模块按其第一条已完成记录（ix_user_progress_user_completed 中按 id）出现的顺序
+            db.func.min(db.case((UserProgress.completed.is_(True), UserProgress.id)))
+        ).all()
+        
+        # 按问题类型聚合解题记录：数量、成功率总和、完成时间总和；
+        # 逐行计算时记录按 ix_problem_records_user_type_created 扫描，类型按 problem_type 的顺序出现
+        type_rows = db.session.query(
+            ProblemSolvingRecord.problem_type,
+            db.func.count(ProblemSolvingRecord.id),
+            db.func.sum(ProblemSolvingRecord.success_rate),
+            db.func.sum(ProblemSolvingRecord.completion_time)
+        ).filter(
+            ProblemSolvingRecord.user_id == user_id
+        ).group_by(ProblemSolvingRecord.problem_type).order_by(ProblemSolvingRecord.problem_type).all()
+        
+        learning_stats = db.session.query(
+            LearningStats.skill_levels, LearningStats.total_time_spent
+        ).filter(LearningStats.user_id == user_id).first()
         
         profile = {
             'skill_levels': {'understanding': 1, 'planning': 1, 'execution': 1, 'reflection': 1},
@@ -160,49 +214,44 @@ class PersonalizedRecommendationEngine:
         }
         
         if learning_stats:
-            profile['skill_levels'] = learning_stats.get_skill_levels()
-            profile['total_time_spent'] = learning_stats.total_time_spent
+            skill_levels, total_time_spent = learning_stats
+            if skill_levels:
+                profile['skill_levels'] = json.loads(skill_levels)
+            profile['total_time_spent'] = total_time_spent
         
-        if user_progress:
+        if module_rows:
             # 分析完成率
-            completed_count = len([p for p in user_progress if p.completed])
-            total_count = len(user_progress)
+            total_count = sum(row[1] for row in module_rows)
+            completed_count = sum(row[2] for row in module_rows)
             profile['completion_rate'] = completed_count / total_count if total_count > 0 else 0
             
             # 分析偏好难度
-            completed_progress = [p for p in user_progress if p.completed]
-            if completed_progress:
-                avg_score = sum(p.score for p in completed_progress) / len(completed_progress)
+            if completed_count:
+                avg_score = sum(row[3] for row in module_rows) / completed_count
                 if avg_score >= 85:
                     profile['preferred_difficulty'] = min(4, profile['preferred_difficulty'] + 1)
                 elif avg_score < 70:
                     profile['preferred_difficulty'] = max(1, profile['preferred_difficulty'] - 1)
             
             # 分析模块偏好
-            module_performance = defaultdict(list)
-            for progress in completed_progress:
-                module_performance[progress.module].append(progress.score)
-            
-            for module, scores in module_performance.items():
-                avg_score = sum(scores) / len(scores)
+            for module, _, module_completed, score_sum in module_rows:
+                if not module_completed:
+                    continue
+                avg_score = score_sum / module_completed
                 if avg_score >= 80:
                     profile['strong_areas'].append(module)
                 elif avg_score < 70:
                     profile['weak_areas'].append(module)
         
-        if problem_records:
+        if type_rows:
             # 分析问题类型偏好
-            type_performance = defaultdict(list)
-            for record in problem_records:
-                type_performance[record.problem_type].append(record.success_rate)
-            
-            for ptype, rates in type_performance.items():
-                avg_rate = sum(rates) / len(rates)
+            for ptype, count, rate_sum, _ in type_rows:
+                avg_rate = (rate_sum or 0) / count
                 if avg_rate >= 0.8:
                     profile['preferred_problem_types'].append(ptype)
             
             # 分析学习节奏
-            avg_time = sum(r.completion_time for r in problem_records) / len(problem_records)
+            avg_time = sum(row[3] or 0 for row in type_rows) / sum(row[1] for row in type_rows)
             if avg_time < 600:  # 10分钟
                 profile['learning_pace'] = 'fast'
             elif avg_time > 1800:  # 30分钟
@@ -211,26 +260,16 @@ class PersonalizedRecommendationEngine:
         return profile
     
     def content_based_recommendation(self, user_profile, content_type='all'):
-        """基于内容的推荐"""
-        recommendations = []
-        
-        content_types = ['theory_lessons', 'case_studies', 'practice_problems']
-        if content_type != 'all':
-            content_types = [content_type]
-        
-        for ctype in content_types:
-            for item in self.content_features[ctype]:
-                score = self.calculate_content_score(user_profile, item)
-                recommendations.append({
-                    'content_type': ctype,
-                    'item': item,
-                    'score': score,
-                    'reason': self.get_recommendation_reason(user_profile, item)
-                })
-        
-        # 按分数排序
-        recommendations.sort(key=lambda x: x['score'], reverse=True)
-        return recommendations[:10]  # 返回前10个推荐
+        """基于内容的推荐：一次向量化计算全部内容的分数，只为返回的内容生成推荐理由"""
+        return [
+            {
+                'content_type': ctype,
+                'item': item,
+                'score': score,
+                'reason': self.get_recommendation_reason(user_profile, item)
+            }
+            for ctype, item, score in self.content_catalog.top(user_profile, 10, content_type)
+        ]
     
     def calculate_content_score(self, user_profile, item):
         """计算内容推荐分数"""
@@ -286,42 +325,45 @@ class PersonalizedRecommendationEngine:
         return reasons if reasons else ["推荐尝试"]
     
     def collaborative_filtering_recommendation(self, user_id):
-        """协同过滤推荐"""
-        # 简化的协同过滤实现
-        # 在实际应用中，这里会使用更复杂的算法
-        
-        # 获取所有用户的学习记录
-        all_progress = UserProgress.query.all()
-        
-        # 构建用户-物品矩阵
-        user_item_matrix = defaultdict(dict)
-        for progress in all_progress:
-            user_item_matrix[progress.user_id][progress.lesson_id] = progress.score
-        
-        # 找到相似用户
-        target_user_items = user_item_matrix.get(user_id, {})
-        similar_users = []
-        
-        for other_user, other_items in user_item_matrix.items():
-            if other_user != user_id:
-                similarity = self.calculate_user_similarity(target_user_items, other_items)
-                if similarity > 0.5:  # 相似度阈值
-                    similar_users.append((other_user, similarity))
-        
-        # 基于相似用户推荐
-        recommendations = []
-        for similar_user, similarity in similar_users:
-            for item_id, score in user_item_matrix[similar_user].items():
-                if item_id not in target_user_items and score >= 80:
-                    recommendations.append({
-                        'item_id': item_id,
-                        'predicted_score': score * similarity,
-                        'reason': f"相似用户喜欢 (相似度: {similarity:.2f})"
-                    })
-        
-        # 按预测分数排序
-        recommendations.sort(key=lambda x: x['predicted_score'], reverse=True)
-        return recommendations[:5]
+        """协同过滤推荐（基于用户）"""
+        model = cf_model_store.current()
+        if model is not None:
+            matrix = model.matrix
+        else:
+            # 尚无离线训练的模型：只读取评分需要的三列，现场构建整数编码的稀疏评分矩阵
+            rows = db.session.query(
+                UserProgress.user_id, UserProgress.lesson_id, UserProgress.score
+            ).order_by(UserProgress.id).all()
+            matrix = RatingMatrix.from_rows(rows)
+        return matrix.user_based_recommendations(user_id)
+    
+    def item_based_recommendation(self, user_id, top_n=5):
+        """协同过滤推荐（基于课程），只合并用户已评分课程的邻居列表"""
+        index = self.get_item_neighbour_index()
+        user_items = dict(
+            db.session.query(UserProgress.lesson_id, UserProgress.score)
+            .filter(UserProgress.user_id == user_id)
+            .order_by(UserProgress.id)
+            .all()
+        )
+        return index.recommend(user_items, top_n)
+    
+    def get_item_neighbour_index(self):
+        """获取课程邻居索引：优先使用离线训练的模型，否则现场构建并每 ITEM_INDEX_MAX_AGE 秒刷新"""
+        model = cf_model_store.current()
+        if model is not None:
+            return model.item_index
+        index = self._item_index
+        if index is None or time.time() - index.built_at > ITEM_INDEX_MAX_AGE:
+            with self._item_index_lock:
+                index = self._item_index
+                if index is None or time.time() - index.built_at > ITEM_INDEX_MAX_AGE:
+                    rows = db.session.query(
+                        UserProgress.user_id, UserProgress.lesson_id, UserProgress.score
+                    ).order_by(UserProgress.id).all()
+                    index = RatingMatrix.from_rows(rows).item_neighbours(ITEM_NEIGHBOURS_K)
+                    self._item_index = index
+        return index
     
     def calculate_user_similarity(self, user1_items, user2_items):
         """计算用户相似度"""
@@ -347,14 +389,28 @@ class PersonalizedRecommendationEngine:
         
         return numerator / denominator
 
-# 创建推荐引擎实例
-recommendation_engine = PersonalizedRecommendationEngine()
+# 创建推荐引擎实例：课程目录的特征矩阵依赖 numpy，第一次推荐时才创建
+recommendation_engine = LazyObject(PersonalizedRecommendationEngine)
+
+def personalized_etag_parts():
+    # 没有离线模型时协同过滤实时读取所有用户的数据，结果不只取决于该用户的数据版本
+    cf_model = cf_model_store.current()
+    if cf_model is None:
+        return None
+    return user_version_parts(result_cache)() + [cf_model.version]
 
 @recommendation_bp.route('/personalized', methods=['GET'])
+# 响应带生成时间与模型年龄，内容逐字节不同，只能使用弱 ETag
+@conditional_get(personalized_etag_parts, CACHE_PRIVATE_REVALIDATE, weak=True)
+@reporting_reads
 def get_personalized_recommendations():
     """获取个性化推荐"""
     user_id = request.args.get('user_id', 'default_user')
     content_type = request.args.get('content_type', 'all')
+    # 协同过滤模式：user 为基于用户（默认），item 为基于课程
+    cf_mode = request.args.get('cf_mode', 'user')
+    if cf_mode not in ('user', 'item'):
+        return jsonify({'error': 'cf_mode 只能是 user 或 item'}), 400
     
     # 获取用户画像
     user_profile = recommendation_engine.get_user_profile(user_id)
@@ -364,8 +420,18 @@ def get_personalized_recommendations():
         user_profile, content_type
     )
     
-    # 协同过滤推荐
-    collaborative_recommendations = recommendation_engine.collaborative_filtering_recommendation(user_id)
+    # 协同过滤推荐：使用离线模型时结果只取决于模型版本和该用户的数据，可以缓存
+    cf_model = cf_model_store.current()
+    if cf_mode == 'item':
+        compute = lambda: recommendation_engine.item_based_recommendation(user_id)
+    else:
+        compute = lambda: recommendation_engine.collaborative_filtering_recommendation(user_id)
+    if cf_model is not None:
+        collaborative_recommendations = result_cache.get_or_compute(
+            'collaborative', user_id, [cf_mode, cf_model.version], compute
+        )
+    else:
+        collaborative_recommendations = compute()
     
     return jsonify({
         'user_profile': user_profile,
@@ -383,10 +449,14 @@ def get_personalized_recommendations():
             for rec in content_recommendations
         ],
         'collaborative_recommendations': collaborative_recommendations,
+        'cf_mode': cf_mode,
+        'cf_model': cf_model.info() if cf_model else None,
         'timestamp': datetime.utcnow().isoformat()
     })
 
 @recommendation_bp.route('/learning-path', methods=['GET'])
+@conditional_get(user_version_parts(result_cache), CACHE_PRIVATE_REVALIDATE)
+@reporting_reads
 def get_learning_path():
     """获取个性化学习路径"""
     user_id = request.args.get('user_id', 'default_user')
@@ -463,6 +533,7 @@ def get_learning_path():
     })
 
 @recommendation_bp.route('/next-recommendation', methods=['POST'])
+@reporting_reads
 def get_next_recommendation():
     """获取下一个推荐内容"""
     data = request.get_json()
@@ -504,7 +575,7 @@ def get_next_recommendation():
         'performance_feedback': {
             'score': performance_score,
             'level_adjustment': user_profile['preferred_difficulty'],
-            'encouragement': self.get_encouragement_message(performance_score)
+            'encouragement': get_encouragement_message(performance_score)
         }
     })
 
@@ -520,6 +591,7 @@ def get_encouragement_message(score):
         return "没关系，学习需要时间。建议先巩固基础知识。"
 
 @recommendation_bp.route('/adaptive-difficulty', methods=['POST'])
+@reporting_reads
 def adjust_adaptive_difficulty():
     """自适应难度调整"""
     data = request.get_json()
@@ -564,7 +636,7 @@ def adjust_adaptive_difficulty():
             'type': recommendation_type,
             'message': message
         },
-        'recommended_actions': self.get_recommended_actions(avg_score, recent_trend)
+        'recommended_actions': get_recommended_actions(avg_score, recent_trend)
     })
 
 def get_recommended_actions(avg_score, trend):
@@ -588,3 +660,14 @@ def get_recommended_actions(avg_score, trend):
     
     return actions
 
+@recommendation_bp.cli.command('train-cf')
+@click.option('--model-dir', default=None, help='模型输出目录，默认为 CF_MODEL_DIR')
+@click.option('--neighbours', default=ITEM_NEIGHBOURS_K, help='每门课程保留的相似课程数')
+def train_cf_command(model_dir, neighbours):
+    """从数据库快照训练协同过滤模型并发布新版本"""
+    # 一条查询读取全部评分，得到一致的快照
+    rows = db.session.query(
+        UserProgress.user_id, UserProgress.lesson_id, UserProgress.score
+    ).order_by(UserProgress.id).all()
+    version = train_model(rows, model_dir or CF_MODEL_DIR, neighbours)
+    click.echo(f'已发布协同过滤模型 {version}（{len(rows)} 条评分）')
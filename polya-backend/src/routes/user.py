@@ -1,12 +1,28 @@
 from flask import Blueprint, jsonify, request
 from src.models.user import User, db
+from src.services.pagination import wants_legacy, wants_stream, page_args, keyset_page, ndjson_response
 
 user_bp = Blueprint('user', __name__)
 
+# 用户列表按 id 分页
+USER_PAGE_COLUMNS = (User.id,)
+
 @user_bp.route('/users', methods=['GET'])
 def get_users():
-    users = User.query.all()
-    return jsonify([user.to_dict() for user in users])
+    if wants_legacy():
+        users = User.query.all()
+        return jsonify([user.to_dict() for user in users])
+    try:
+        limit, cursor = page_args(USER_PAGE_COLUMNS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if wants_stream():
+        return ndjson_response(User.query, USER_PAGE_COLUMNS, User.to_dict, cursor)
+    users, next_cursor = keyset_page(User.query, USER_PAGE_COLUMNS, limit, cursor)
+    return jsonify({
+        'users': [user.to_dict() for user in users],
+        'next_cursor': next_cursor
+    })
 
 @user_bp.route('/users', methods=['POST'])
 def create_user():
@@ -0,0 +1,339 @@
+"""协同过滤模型
+
+RatingMatrix / ItemNeighbourIndex 是推荐时使用的数据结构。train_model() 在独立进程中
+（如定时执行 flask recommendation train-cf）从数据库一致快照训练模型，写入带版本号的目录；
+服务进程通过 CFModelStore 以内存映射方式加载最新版本，并原子替换当前模型引用，
+正在处理的请求继续使用旧模型，不会中断。
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+from src.services.lazy import lazy_module
+
+np = lazy_module('numpy')
+
+def top_k_indices(scores, k):
+    """返回分数最高的 k 个下标，按分数降序、同分按下标升序（与稳定排序一致）"""
+    if k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.int64)
+    if len(scores) > k:
+        threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(len(scores))
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
+
+class RatingMatrix:
+    """整数编码的稀疏用户×课程评分矩阵（坐标格式）
+    
+    条目按用户首次出现顺序、再按课程在该用户下首次出现的顺序排列，
+    与按记录顺序构建 dict-of-dicts 时的遍历顺序一致；同一用户同一课程以最后一条记录的分数为准。
+    """
+    
+    def __init__(self, user_ids, item_ids, users, items, scores):
+        self.user_ids = user_ids  # 编码 -> user_id
+        self.item_ids = item_ids  # 编码 -> lesson_id
+        self.users = users  # 每个条目的用户编码
+        self.items = items  # 每个条目的课程编码
+        self.scores = scores  # 每个条目的分数
+        self.user_index = {uid: code for code, uid in enumerate(user_ids)}
+        self.item_index = {iid: code for code, iid in enumerate(item_ids)}
+    
+    @classmethod
+    def from_rows(cls, rows):
+        """由按记录顺序排列的 (user_id, lesson_id, score) 构建矩阵"""
+        if not rows:
+            empty = np.empty(0, dtype=np.int64)
+            return cls([], [], empty, empty, np.empty(0, dtype=np.float64))
+        user_col, item_col, score_col = zip(*rows)
+        user_ids, users = _intern_in_order(np.array(user_col, dtype=object))
+        item_ids, items = _intern_in_order(np.array(item_col, dtype=object))
+        scores = np.array([s or 0 for s in score_col], dtype=np.float64)
+        
+        # 同一 (用户, 课程) 取最后一条的分数，位置按第一次出现
+        keys = users * len(item_ids) + items
+        _, first = np.unique(keys, return_index=True)
+        _, last_reversed = np.unique(keys[::-1], return_index=True)
+        last = len(keys) - 1 - last_reversed
+        order = np.lexsort((first, users[first]))
+        return cls(
+            user_ids, item_ids,
+            users[first][order], items[first][order], scores[last][order]
+        )
+    
+    def user_vector(self, user_id):
+        """返回用户的稠密评分向量与已评分掩码"""
+        values = np.zeros(len(self.item_ids))
+        mask = np.zeros(len(self.item_ids))
+        code = self.user_index.get(user_id)
+        if code is not None:
+            # 条目按用户编码排序，二分查找该用户的条目区间
+            lo, hi = np.searchsorted(self.users, [code, code + 1])
+            values[self.items[lo:hi]] = self.scores[lo:hi]
+            mask[self.items[lo:hi]] = 1.0
+        return values, mask
+    
+    def user_similarities(self, target_values, target_mask):
+        """一次向量化计算目标用户与所有用户在共同评分课程上的皮尔逊相关系数"""
+        n_users = len(self.user_ids)
+        t = target_values[self.items]
+        m = target_mask[self.items]
+        s = self.scores
+        n = np.bincount(self.users, weights=m, minlength=n_users)
+        sum1 = np.bincount(self.users, weights=t, minlength=n_users)
+        sum2 = np.bincount(self.users, weights=s * m, minlength=n_users)
+        sum1_sq = np.bincount(self.users, weights=t * t, minlength=n_users)
+        sum2_sq = np.bincount(self.users, weights=s * s * m, minlength=n_users)
+        sum_products = np.bincount(self.users, weights=s * t, minlength=n_users)
+        
+        similarities = np.zeros(n_users)
+        valid = n >= 2
+        n, sum1, sum2 = n[valid], sum1[valid], sum2[valid]
+        numerator = sum_products[valid] - sum1 * sum2 / n
+        variance = (sum1_sq[valid] - sum1 ** 2 / n) * (sum2_sq[valid] - sum2 ** 2 / n)
+        denominator = np.sqrt(np.maximum(variance, 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarities[valid] = np.where(denominator > 0, numerator / denominator, 0)
+        return similarities
+    
+    def user_based_recommendations(self, user_id, top_n=5, threshold=0.5, min_score=80):
+        """相似用户（相似度 > threshold）评分不低于 min_score 且目标用户未学过的课程"""
+        target_values, target_mask = self.user_vector(user_id)
+        similarities = self.user_similarities(target_values, target_mask)
+        target_code = self.user_index.get(user_id)
+        if target_code is not None:
+            similarities[target_code] = 0
+        
+        entry_similarity = similarities[self.users]
+        candidates = np.flatnonzero(
+            (entry_similarity > threshold)
+            & (self.scores >= min_score)
+            & (target_mask[self.items] == 0)
+        )
+        predicted = self.scores[candidates] * entry_similarity[candidates]
+        
+        recommendations = []
+        for idx in top_k_indices(predicted, top_n):
+            entry = candidates[idx]
+            recommendations.append({
+                'item_id': self.item_ids[self.items[entry]],
+                'predicted_score': float(predicted[idx]),
+                'reason': f"相似用户喜欢 (相似度: {entry_similarity[entry]:.2f})"
+            })
+        return recommendations
+
+    def item_neighbours(self, k=20):
+        """预计算每门课程的前 k 个相似课程（按用户均值中心化后的调整余弦相似度）"""
+        n_users, n_items = len(self.user_ids), len(self.item_ids)
+        counts = np.bincount(self.users, minlength=n_users)
+        means = np.bincount(self.users, weights=self.scores, minlength=n_users) / np.maximum(counts, 1)
+        centred = self.scores - means[self.users]
+        
+        # 条目按用户编码排序，按用户分块构建稠密子矩阵累加 X^T X，内存占用有上界
+        gram = np.zeros((n_items, n_items))
+        block = max(1, (1 << 22) // max(n_items, 1))
+        bounds = np.searchsorted(self.users, np.arange(0, n_users + block, block))
+        for start_user, (lo, hi) in zip(range(0, n_users, block), zip(bounds[:-1], bounds[1:])):
+            if lo == hi:
+                continue
+            dense = np.zeros((block, n_items))
+            dense[self.users[lo:hi] - start_user, self.items[lo:hi]] = centred[lo:hi]
+            gram += dense.T @ dense
+        
+        norms = np.sqrt(np.diag(gram))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            similarities = np.where(np.outer(norms, norms) > 0, gram / np.outer(norms, norms), 0)
+        np.fill_diagonal(similarities, 0)
+        
+        k = min(k, max(n_items - 1, 0))
+        neighbours = np.full((n_items, k), -1, dtype=np.int64)
+        neighbour_similarities = np.zeros((n_items, k))
+        for item in range(n_items):
+            top = top_k_indices(similarities[item], k)
+            top = top[similarities[item][top] > 0]
+            neighbours[item, :len(top)] = top
+            neighbour_similarities[item, :len(top)] = similarities[item][top]
+        return ItemNeighbourIndex(self.item_ids, neighbours, neighbour_similarities)
+
+class ItemNeighbourIndex:
+    """每门课程截断后的相似课程列表，推荐时只合并用户已评分课程的邻居列表"""
+    
+    def __init__(self, item_ids, neighbours, similarities, built_at=None):
+        self.item_ids = item_ids
+        self.neighbours = neighbours  # (课程数, K)，不足 K 个时以 -1 填充
+        self.similarities = similarities  # (课程数, K)
+        self.item_index = {iid: code for code, iid in enumerate(item_ids)}
+        self.built_at = built_at or time.time()
+    
+    def recommend(self, user_items, top_n=5):
+        """user_items 为 {lesson_id: score}，按相似度加权平均预测未学课程的分数"""
+        seen = np.array(
+            [self.item_index[i] for i in user_items if i in self.item_index], dtype=np.int64
+        )
+        if len(seen) == 0:
+            return []
+        ratings = np.array(
+            [user_items[self.item_ids[code]] or 0 for code in seen], dtype=np.float64
+        )
+        neighbours = self.neighbours[seen].ravel()
+        weights = self.similarities[seen].ravel()
+        sources = np.repeat(seen, self.neighbours.shape[1])
+        contributions = weights * np.repeat(ratings, self.neighbours.shape[1])
+        valid = neighbours >= 0
+        neighbours, weights, sources, contributions = (
+            neighbours[valid], weights[valid], sources[valid], contributions[valid]
+        )
+        
+        candidates, inverse = np.unique(neighbours, return_inverse=True)
+        numerator = np.bincount(inverse, weights=contributions, minlength=len(candidates))
+        denominator = np.bincount(inverse, weights=weights, minlength=len(candidates))
+        keep = ~np.isin(candidates, seen) & (denominator > 0)
+        candidates, inverse_keep = candidates[keep], np.flatnonzero(keep)
+        predicted = numerator[keep] / denominator[keep]
+        
+        recommendations = []
+        for idx in top_k_indices(predicted, top_n):
+            # 推荐理由取与该课程最相似的已学课程
+            contributing = np.flatnonzero(inverse == inverse_keep[idx])
+            best = contributing[np.argmax(weights[contributing])]
+            recommendations.append({
+                'item_id': self.item_ids[candidates[idx]],
+                'predicted_score': float(predicted[idx]),
+                'reason': f"与已学课程 {self.item_ids[sources[best]]} 相似 (相似度: {weights[best]:.2f})"
+            })
+        return recommendations
+
+def _intern_in_order(values):
+    """把值编码为按首次出现顺序分配的整数，返回 (编码 -> 值列表, 每个值的编码)"""
+    uniques, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    codes = np.empty(len(uniques), dtype=np.int64)
+    codes[order] = np.arange(len(uniques))
+    return list(uniques[order]), codes[inverse.ravel()]
+
+# 模型目录中的数组文件
+MODEL_ARRAYS = ('users', 'items', 'scores', 'neighbours', 'similarities')
+CURRENT_FILE = 'CURRENT'
+
+class CFModel:
+    """一个训练好的协同过滤模型版本"""
+    
+    def __init__(self, version, trained_at, matrix, item_index):
+        self.version = version
+        self.trained_at = trained_at
+        self.matrix = matrix
+        self.item_index = item_index
+    
+    def age_seconds(self):
+        return time.time() - self.trained_at
+    
+    def info(self):
+        return {'version': self.version, 'age_seconds': round(self.age_seconds(), 1)}
+
+def train_model(rows, model_dir, neighbours_k=20, keep_versions=3):
+    """由 (user_id, lesson_id, score) 快照训练模型并写入新版本目录，返回版本号
+    
+    先写入临时目录再重命名，最后原子替换 CURRENT 指针，读者不会看到写了一半的模型。
+    """
+    matrix = RatingMatrix.from_rows(rows)
+    item_index = matrix.item_neighbours(neighbours_k)
+    trained_at = time.time()
+    version = datetime.utcfromtimestamp(trained_at).strftime('%Y%m%dT%H%M%S%f')
+    
+    os.makedirs(model_dir, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=f'.{version}-', dir=model_dir)
+    arrays = {
+        'users': matrix.users,
+        'items': matrix.items,
+        'scores': matrix.scores,
+        'neighbours': item_index.neighbours,
+        'similarities': item_index.similarities
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, f'{name}.npy'), np.ascontiguousarray(array))
+    with open(os.path.join(staging, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': version,
+            'trained_at': trained_at,
+            'user_ids': matrix.user_ids,
+            'item_ids': matrix.item_ids
+        }, f, ensure_ascii=False)
+    os.rename(staging, os.path.join(model_dir, version))
+    
+    pointer = os.path.join(model_dir, f'.{CURRENT_FILE}.tmp')
+    with open(pointer, 'w') as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(model_dir, CURRENT_FILE))
+    
+    # 清理旧版本，保留最近 keep_versions 个
+    versions = sorted(
+        name for name in os.listdir(model_dir)
+        if not name.startswith('.') and name != CURRENT_FILE
+    )
+    for name in versions[:-keep_versions]:
+        shutil.rmtree(os.path.join(model_dir, name), ignore_errors=True)
+    return version
+
+def load_model(model_dir, version):
+    """以内存映射方式加载指定版本的模型"""
+    path = os.path.join(model_dir, version)
+    with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    arrays = {
+        name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+        for name in MODEL_ARRAYS
+    }
+    matrix = RatingMatrix(
+        meta['user_ids'], meta['item_ids'],
+        arrays['users'], arrays['items'], arrays['scores']
+    )
+    item_index = ItemNeighbourIndex(
+        meta['item_ids'], arrays['neighbours'], arrays['similarities'],
+        built_at=meta['trained_at']
+    )
+    return CFModel(meta['version'], meta['trained_at'], matrix, item_index)
+
+class CFModelStore:
+    """服务进程持有的当前模型，发现新版本时热替换
+    
+    每隔 check_interval 秒检查一次 CURRENT 指针；加载新版本期间其他请求继续使用旧模型。
+    """
+    
+    def __init__(self, model_dir, check_interval=5):
+        self.model_dir = model_dir
+        self.check_interval = check_interval
+        self._model = None
+        self._checked_at = 0.0
+        self._load_lock = threading.Lock()
+    
+    def current(self):
+        """返回当前模型，没有训练好的模型时返回 None"""
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            # 只有一个线程负责检查与加载，其余线程直接使用已有模型
+            if self._load_lock.acquire(blocking=False):
+                try:
+                    self._refresh()
+                finally:
+                    self._checked_at = time.monotonic()
+                    self._load_lock.release()
+        return self._model
+    
+    def _refresh(self):
+        try:
+            with open(os.path.join(self.model_dir, CURRENT_FILE)) as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return
+        if self._model is not None and self._model.version == version:
+            return
+        try:
+            model = load_model(self.model_dir, version)
+        except (OSError, ValueError) as e:
+            print(f"加载协同过滤模型 {version} 失败：{e}")
+            return
+        self._model = model
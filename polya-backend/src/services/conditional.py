@@ -0,0 +1,68 @@
+"""读取接口的 ETag 与条件请求
+
+视图用 conditional_get 声明决定响应内容的值（静态数据的内容哈希、用户数据版本、模型版本等），
+这些值必须不访问业务数据库就能得到。ETag 由这些值、请求路径与查询参数、视图模块源码的哈希
+计算得出（代码更新后旧 ETag 自动失效）。请求的 If-None-Match 命中时直接返回 304，
+不执行视图；否则执行视图并在 200 响应上附加 ETag。每个接口单独指定 Cache-Control。
+响应体中含有生成时间等不影响语义、每次都不同的字段时使用弱 ETag（W/），
+这样的响应只在语义上等价，不能用于 Range / If-Match。
+"""
+import functools
+import hashlib
+import json
+import sys
+from flask import Response, make_response, request
+
+# 静态数据：允许浏览器直接复用一段时间
+CACHE_STATIC = 'public, max-age=3600'
+# 用户数据：每次都带 If-None-Match 重新验证，未变化时只有一次 304
+CACHE_PRIVATE_REVALIDATE = 'private, no-cache'
+
+_module_digests = {}
+
+def content_hash(data):
+    """JSON 可序列化数据的内容哈希"""
+    raw = json.dumps(data, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+def _module_digest(module_name):
+    if module_name not in _module_digests:
+        path = getattr(sys.modules.get(module_name), '__file__', None)
+        try:
+            with open(path, 'rb') as f:
+                _module_digests[module_name] = hashlib.sha256(f.read()).hexdigest()[:16]
+        except (OSError, TypeError):
+            _module_digests[module_name] = ''
+    return _module_digests[module_name]
+
+def compute_etag(view, parts):
+    args = sorted(request.args.items(multi=True))
+    return content_hash([_module_digest(view.__module__), request.path, args, parts])
+
+def conditional_get(etag_parts, cache_control, weak=False):
+    """为 GET 视图启用 ETag 与 If-None-Match
+
+    etag_parts() 返回决定响应内容的值列表，返回 None 时本次请求不使用 ETag。
+    weak=True 时发出弱 ETag。
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            parts = etag_parts()
+            etag = compute_etag(view, parts) if parts is not None else None
+            if etag is not None and request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            if etag is not None:
+                response.set_etag(etag, weak=weak)
+            response.headers['Cache-Control'] = cache_control
+            return response
+        return wrapper
+    return decorator
+
+def user_version_parts(result_cache):
+    """按 user_id 参数对应的用户数据版本生成 ETag 的 etag_parts"""
+    return lambda: [result_cache.version_tag(request.args.get('user_id', 'default_user'))]
@@ -0,0 +1,122 @@
+"""基于内容的推荐打分
+
+把内容目录预先编码为数组（难度、预计时间、问题类型编码、主题与弱项关联位集），
+对一个用户画像只需一次向量化计算即可为全部内容打分，权重与逐条计算时一致。
+"""
+from src.services.lazy import lazy_module
+from src.services.collaborative_filtering import top_k_indices
+
+np = lazy_module('numpy')
+
+# 学习节奏对应的预计时间区间（分钟），落在区间内即加分
+PACE_TIME_RANGES = {
+    'fast': (None, 15),
+    'slow': (25, None),
+    'normal': (15, 25)
+}
+
+class ContentCatalog:
+    """预编码的内容目录"""
+
+    def __init__(self, content_features):
+        self.content_types = list(content_features)
+        self.entries = []  # (content_type, item)，顺序与逐条遍历时一致
+        for ctype in self.content_types:
+            for item in content_features[ctype]:
+                self.entries.append((ctype, item))
+
+        self.topic_index = {}
+        self.problem_type_index = {}
+        for _, item in self.entries:
+            for topic in item.get('topics', []):
+                self.topic_index.setdefault(topic, len(self.topic_index))
+            if item.get('problem_type') is not None:
+                self.problem_type_index.setdefault(item['problem_type'], len(self.problem_type_index))
+
+        n = len(self.entries)
+        self.content_type_codes = np.array(
+            [self.content_types.index(ctype) for ctype, _ in self.entries], dtype=np.int64
+        )
+        self.difficulty = np.array([item['difficulty'] for _, item in self.entries], dtype=np.float64)
+        self.estimated_time = np.array(
+            [item.get('estimated_time', 20) for _, item in self.entries], dtype=np.float64
+        )
+        self.problem_type_codes = np.array(
+            [self.problem_type_index.get(item.get('problem_type'), -1) for _, item in self.entries],
+            dtype=np.int64
+        )
+        # 主题关联位集：每个内容一行 uint64，第 j 位表示是否包含主题 j
+        words = max(1, (len(self.topic_index) + 63) // 64)
+        self.topic_bits = np.zeros((n, words), dtype=np.uint64)
+        for row, (_, item) in enumerate(self.entries):
+            for topic in item.get('topics', []):
+                code = self.topic_index[topic]
+                self.topic_bits[row, code // 64] |= np.uint64(1) << np.uint64(code % 64)
+
+    def _topic_mask(self, topics):
+        mask = np.zeros(self.topic_bits.shape[1], dtype=np.uint64)
+        for topic in topics:
+            code = self.topic_index.get(topic)
+            if code is not None:
+                mask[code // 64] |= np.uint64(1) << np.uint64(code % 64)
+        return mask
+
+    def _topic_matches(self, topics):
+        """每个内容与给定主题集合的交集大小"""
+        mask = self._topic_mask(topics)
+        if not mask.any():
+            return np.zeros(len(self.entries), dtype=np.int64)
+        words = np.flatnonzero(mask)
+        return np.bitwise_count(self.topic_bits[:, words] & mask[words]).sum(axis=1)
+
+    def score(self, user_profile):
+        """为全部内容计算推荐分数（权重 0.3/0.2/0.2/0.15/0.15）"""
+        n = len(self.entries)
+        score = np.zeros(n)
+
+        # 难度匹配 (权重: 0.3)
+        difficulty_diff = np.abs(self.difficulty - user_profile['preferred_difficulty'])
+        score += np.maximum(0, 1 - difficulty_diff * 0.3) * 0.3
+
+        # 主题匹配 (权重: 0.2)
+        topic_match = self._topic_matches(user_profile['preferred_topics'])
+        score += np.minimum(1.0, topic_match * 0.5) * 0.2
+
+        # 问题类型匹配 (权重: 0.2)
+        preferred_types = [
+            self.problem_type_index[t] for t in user_profile['preferred_problem_types']
+            if t in self.problem_type_index
+        ]
+        score += np.where(np.isin(self.problem_type_codes, preferred_types), 0.2, 0.0)
+
+        # 学习时间匹配 (权重: 0.15)
+        time_range = PACE_TIME_RANGES.get(user_profile['learning_pace'])
+        if time_range is not None:
+            low, high = time_range
+            matched = np.ones(n, dtype=bool)
+            if low is not None:
+                matched &= self.estimated_time >= low
+            if high is not None:
+                matched &= self.estimated_time <= high
+            score += np.where(matched, 0.15, 0.0)
+
+        # 弱点补强 (权重: 0.15)
+        weak_match = self._topic_matches(user_profile['weak_areas'])
+        score += np.where(weak_match > 0, 0.15, 0.0)
+
+        return score
+
+    def top(self, user_profile, k=10, content_type='all'):
+        """返回分数最高的 k 个 (content_type, item, score)，同分保持目录顺序"""
+        scores = self.score(user_profile)
+        if content_type != 'all':
+            if content_type not in self.content_types:
+                return []
+            selected = np.flatnonzero(self.content_type_codes == self.content_types.index(content_type))
+        else:
+            selected = np.arange(len(self.entries))
+        result = []
+        for idx in top_k_indices(scores[selected], k):
+            ctype, item = self.entries[selected[idx]]
+            result.append((ctype, item, float(scores[selected[idx]])))
+        return result
@@ -0,0 +1,172 @@
+"""导师对话历史与提示词预算
+
+每个用户在每个问题（按问题背景区分）下的对话逐条保存。构建提示词时只原样带上最近的消息，
+原样部分超过 TUTOR_HISTORY_TOKENS 时，把较早的消息并入保存的滚动摘要（不超过 TUTOR_SUMMARY_TOKENS），
+并把原样部分压缩到预算的一半以下，使压缩不会每轮都发生。
+无论会话多长，历史部分的 token 数都不超过两者之和。
+
+调用模型生成摘要较慢，不放在对话请求中：请求内用 fit_prompt() 以截取式摘要临时并入较早的消息，
+回复之后再由 fit_budget() 调用模型生成并保存摘要。
+"""
+import hashlib
+import os
+from datetime import datetime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from src.models.user import db
+from src.models.conversation import ConversationTurn, ConversationSummary
+from src.services.llm_cache import normalize_text
+from src.services.token_budget import count_tokens, truncate_to_tokens, TOKENS_PER_MESSAGE
+
+HISTORY_TOKEN_BUDGET = int(os.environ.get('TUTOR_HISTORY_TOKENS', '1200'))
+SUMMARY_MAX_TOKENS = int(os.environ.get('TUTOR_SUMMARY_TOKENS', '300'))
+
+ROLE_NAMES = {'user': '学生', 'assistant': '导师'}
+
+def conversation_key(problem_context):
+    return hashlib.sha1(normalize_text(problem_context).encode('utf-8')).hexdigest()[:32]
+
+def format_turns(turns):
+    return '\n'.join(f"{ROLE_NAMES.get(t.role, t.role)}：{t.content}" for t in turns)
+
+def extractive_summary(previous_summary, turns, max_tokens=SUMMARY_MAX_TOKENS):
+    """无法调用模型时的摘要：旧摘要接上被并入的消息，只保留末尾 max_tokens"""
+    text = '\n'.join(part for part in (previous_summary, format_turns(turns)) if part)
+    return truncate_to_tokens(text, max_tokens, keep='tail')
+
+class ConversationHistory:
+    """一个用户在一个问题下的对话：滚动摘要 + 尚未并入摘要的最近消息"""
+
+    def __init__(self, user_id, problem_context, budget=None, summary_max_tokens=None):
+        self.user_id = user_id
+        self.key = conversation_key(problem_context)
+        self.budget = budget or HISTORY_TOKEN_BUDGET
+        self.summary_max_tokens = summary_max_tokens or SUMMARY_MAX_TOKENS
+        self.summary = ConversationSummary.query.filter_by(
+            user_id=user_id, conversation_key=self.key
+        ).first()
+        self.prompt_summary = None  # fit_prompt() 生成的临时摘要，只用于本次提示词
+        summarized_until = self.summary.summarized_until if self.summary else 0
+        self.turns = ConversationTurn.query.filter(
+            ConversationTurn.user_id == user_id,
+            ConversationTurn.conversation_key == self.key,
+            ConversationTurn.id > summarized_until
+        ).order_by(ConversationTurn.id).all()
+
+    @property
+    def is_empty(self):
+        return not self.turns and not (self.summary and self.summary.summary)
+
+    @property
+    def turn_tokens(self):
+        return sum(t.tokens for t in self.turns)
+
+    @property
+    def saved_summary(self):
+        return self.summary.summary if self.summary else ''
+
+    def prompt_messages(self):
+        """插入提示词的历史消息：摘要（若有）+ 最近的原样消息"""
+        messages = []
+        summary = self.prompt_summary or self.saved_summary
+        if summary:
+            messages.append({'role': 'system', 'content': f"此前对话摘要：{summary}"})
+        messages.extend({'role': t.role, 'content': t.content} for t in self.turns)
+        return messages
+
+    def _split(self):
+        """原样消息超出预算时返回应并入摘要的较早消息，否则返回空列表"""
+        if self.turn_tokens <= self.budget:
+            return []
+        keep_tokens = self.turn_tokens
+        split = 0
+        while split < len(self.turns) and keep_tokens > self.budget // 2:
+            keep_tokens -= self.turns[split].tokens
+            split += 1
+        # 成对并入，避免最近消息以导师回复开头
+        if split < len(self.turns) and self.turns[split].role == 'assistant':
+            split += 1
+        return self.turns[:split]
+
+    def fit_prompt(self):
+        """原样消息超出预算时，用截取式摘要把较早的消息临时并入本次提示词的摘要，返回是否需要滚动摘要
+
+        不调用模型、不写入数据库；保存的摘要之后由 fit_budget() 生成。
+        """
+        rolled = self._split()
+        if not rolled:
+            return False
+        self.turns = self.turns[len(rolled):]
+        self.prompt_summary = extractive_summary(self.saved_summary, rolled, self.summary_max_tokens)
+        return True
+
+    def fit_budget(self, summarize):
+        """原样消息超出预算时把较早的消息并入保存的摘要，返回是否发生了压缩
+
+        summarize(旧摘要, 被并入的消息) 返回新摘要；失败时改用截取式摘要。
+        """
+        rolled = self._split()
+        if not rolled:
+            return False
+        self.turns = self.turns[len(rolled):]
+
+        previous = self.saved_summary
+        try:
+            text = summarize(previous, rolled)
+        except Exception as e:
+            print(f"生成对话摘要失败，改用截取式摘要：{e}")
+            text = extractive_summary(previous, rolled, self.summary_max_tokens)
+        text = truncate_to_tokens(text or '', self.summary_max_tokens)
+
+        values = {
+            'summary': text,
+            'tokens': count_tokens(text),
+            'summarized_until': rolled[-1].id,
+            'updated_at': datetime.utcnow()
+        }
+        stmt = sqlite_insert(ConversationSummary).values(
+            user_id=self.user_id, conversation_key=self.key, **values
+        )
+        # 同一对话的并发请求可能同时创建或更新摘要：以并入消息更多的摘要为准
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'conversation_key'],
+            set_=values,
+            where=ConversationSummary.summarized_until < stmt.excluded.summarized_until
+        )
+        db.session.execute(stmt)
+        db.session.commit()
+        self.summary = ConversationSummary.query.filter_by(
+            user_id=self.user_id, conversation_key=self.key
+        ).populate_existing().first()
+        self.prompt_summary = None
+        self.turns = [t for t in self.turns if t.id > self.summary.summarized_until]
+        return True
+
+    def record(self, user_message, answer):
+        """保存一轮问答"""
+        new_turns = [
+            ConversationTurn(
+                user_id=self.user_id, conversation_key=self.key, role=role, content=content,
+                tokens=TOKENS_PER_MESSAGE + count_tokens(content)
+            )
+            for role, content in (('user', user_message), ('assistant', answer))
+        ]
+        db.session.add_all(new_turns)
+        db.session.commit()
+        self.turns.extend(new_turns)
+
+    def clear(self):
+        """删除该对话的全部消息与摘要"""
+        ConversationTurn.query.filter_by(user_id=self.user_id, conversation_key=self.key).delete()
+        ConversationSummary.query.filter_by(user_id=self.user_id, conversation_key=self.key).delete()
+        db.session.commit()
+        self.turns = []
+        self.summary = None
+        self.prompt_summary = None
+
+    def to_dict(self):
+        return {
+            'summary': self.summary.to_dict() if self.summary else None,
+            'turns': [t.to_dict() for t in self.turns],
+            'turn_tokens': self.turn_tokens,
+            'budget': self.budget
+        }
@@ -0,0 +1,52 @@
+"""按需导入与按需创建
+
+numpy、openai/httpx 等重量级依赖，以及构造时就要用到它们的单例，只在第一次使用时加载，
+导入路由模块与创建应用时不付出这部分时间。用法：
+
+    np = lazy_module('numpy')                        # 第一次访问 np.xxx 时才导入 numpy
+    index = LazyObject(SemanticAnswerIndex.from_env)  # 第一次访问属性时才创建索引
+"""
+import importlib
+import threading
+
+class LazyModule:
+    """第一次访问属性时导入的模块"""
+
+    def __init__(self, name):
+        self.__dict__['_LazyModule__name'] = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name)
+        # 导入后把模块属性复制过来，之后的访问不再经过 __getattr__
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f'<lazy module {self.__name!r}>'
+
+def lazy_module(name):
+    return LazyModule(name)
+
+class LazyObject:
+    """第一次访问属性时调用 factory() 创建的对象，创建过程线程安全"""
+
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _get(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                instance = self._instance
+                if instance is None:
+                    instance = self._factory()
+                    object.__setattr__(self, '_instance', instance)
+        return instance
+
+    def __getattr__(self, attr):
+        return getattr(self._get(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._get(), attr, value)
@@ -0,0 +1,136 @@
+"""AI 导师回复的持久化缓存
+
+以规范化后的完整消息列表、模型、temperature 与 max_tokens 的哈希为键，
+保存在本地 SQLite 文件中，带过期时间（TTL）和按最近访问时间的容量淘汰。
+每条缓存记录上游调用耗时，命中时累计节省的延迟。只缓存成功的回复。
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_text(text):
+    """统一 Unicode 形式并折叠空白，使仅有格式差异的提示词命中同一条缓存"""
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFKC', text or '')).strip()
+
+def cache_key(messages, params):
+    """由消息列表与生成参数计算缓存键"""
+    payload = {
+        'messages': [
+            {'role': m['role'], 'content': normalize_text(m['content'])} for m in messages
+        ],
+        'params': {k: params[k] for k in sorted(params)}
+    }
+    return hashlib.sha256(
+        json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+class LLMResponseCache:
+    """本地 SQLite 回复缓存"""
+
+    # 每写入多少次检查一次容量
+    EVICT_EVERY = 50
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=50000, enabled=True):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if enabled:
+            self._connect().executescript('''
+                CREATE TABLE IF NOT EXISTS llm_responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    latency REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS ix_llm_responses_accessed ON llm_responses (accessed_at);
+            ''')
+
+    @classmethod
+    def from_env(cls):
+        """根据环境变量 LLM_CACHE_PATH / LLM_CACHE_TTL / LLM_CACHE_SIZE / LLM_CACHE_DISABLED 创建缓存"""
+        path = os.environ.get('LLM_CACHE_PATH') or os.path.join(
+            os.path.dirname(os.path.dirname(__file__)), 'database', 'llm_cache.db'
+        )
+        return cls(
+            path,
+            ttl=int(os.environ.get('LLM_CACHE_TTL', str(7 * 24 * 3600))),
+            max_entries=int(os.environ.get('LLM_CACHE_SIZE', '50000')),
+            enabled=os.environ.get('LLM_CACHE_DISABLED', '') not in ('1', 'true')
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """返回未过期的缓存回复，没有时返回 None"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT response, latency FROM llm_responses WHERE key = ? AND created_at > ?',
+            (key, now - self.ttl)
+        ).fetchone()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_latency += row[1]
+        conn.execute('UPDATE llm_responses SET accessed_at = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def set(self, key, response, latency):
+        """保存一条成功的回复及其上游耗时（秒）"""
+        if not self.enabled or not response:
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO llm_responses (key, response, latency, created_at, accessed_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (key, response, latency, now, now)
+        )
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.EVICT_EVERY == 0
+        if evict:
+            conn.execute('DELETE FROM llm_responses WHERE created_at <= ?', (now - self.ttl,))
+            conn.execute('''
+                DELETE FROM llm_responses WHERE key IN (
+                    SELECT key FROM llm_responses ORDER BY accessed_at
+                    LIMIT MAX((SELECT COUNT(*) FROM llm_responses) - ?, 0)
+                )
+            ''', (self.max_entries,))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+            'saved_latency_seconds': round(self.saved_latency, 3)
+        }
@@ -0,0 +1,285 @@
+"""共享的上游模型客户端
+
+所有导师请求共用一个 httpx 连接池（keep-alive），显式设置连接与读取超时，
+失败时按带抖动的指数退避重试，重试次数受全局重试预算限制，避免上游故障时重试放大流量。
+可选对冲请求：非流式调用超过近期 p95 延迟仍未返回时，再发一个相同请求，取先返回的结果。
+每次调用的延迟与结果计入指标，可通过 stats() 查看。base_url 可配置，便于对本地桩服务压测。
+"""
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from src.services.lazy import lazy_module
+
+# openai SDK 与 httpx 导入耗时较长，第一次调用上游时才导入
+httpx = lazy_module('httpx')
+openai = lazy_module('openai')
+
+def retryable_errors():
+    """可重试的上游错误：连接失败/超时、限流、5xx"""
+    return (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+def outcome_of(error):
+    """把异常归类为指标中的结果名称"""
+    if error is None:
+        return 'ok'
+    if isinstance(error, openai.APITimeoutError):
+        return 'timeout'
+    if isinstance(error, openai.APIConnectionError):
+        return 'connection_error'
+    if isinstance(error, openai.RateLimitError):
+        return 'rate_limited'
+    if isinstance(error, openai.APIStatusError):
+        return f'http_{error.status_code}'
+    return 'error'
+
+class RetryBudget:
+    """重试预算：每次调用存入 ratio 个令牌，每次重试或对冲消耗一个，余额上限为 reserve"""
+
+    def __init__(self, ratio=0.2, reserve=10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._balance = float(reserve)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self.reserve, self._balance + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self._balance < 1:
+                return False
+            self._balance -= 1
+            return True
+
+    @property
+    def balance(self):
+        return self._balance
+
+class LatencyMetrics:
+    """最近调用的延迟窗口与按结果累计的计数"""
+
+    def __init__(self, window=1000):
+        self._latencies = deque(maxlen=window)
+        self.outcomes = Counter()
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, latency, outcome, attempts=1):
+        with self._lock:
+            self.outcomes[outcome] += 1
+            self.counters['calls'] += 1
+            self.counters['retries'] += attempts - 1
+            if outcome == 'ok':
+                self._latencies.append(latency)
+
+    def incr(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def quantile(self, q):
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def sample_count(self):
+        return len(self._latencies)
+
+    def snapshot(self):
+        latency = {
+            f'p{int(q * 100)}': round(value, 4) if value is not None else None
+            for q in (0.5, 0.95, 0.99)
+            for value in [self.quantile(q)]
+        }
+        with self._lock:
+            return {
+                'outcomes': dict(self.outcomes),
+                'counters': dict(self.counters),
+                'latency_seconds': latency,
+                'samples': len(self._latencies)
+            }
+
+class LLMClient:
+    """带连接池、超时、重试预算与对冲请求的模型客户端"""
+
+    def __init__(self, base_url=None, api_key=None, pool_size=10, connect_timeout=3.0,
+                 read_timeout=30.0, max_retries=2, backoff_base=0.25, backoff_max=4.0,
+                 retry_budget=None, hedge=False, hedge_quantile=0.95, hedge_min_delay=0.5,
+                 hedge_min_samples=20):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_budget = retry_budget or RetryBudget()
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.metrics = LatencyMetrics()
+        # 流式调用只计到响应头的延迟，单独统计，不参与对冲延迟估计
+        self.stream_metrics = LatencyMetrics()
+        self._client = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """根据环境变量创建客户端
+
+        LLM_BASE_URL（默认 OPENAI_BASE_URL 或官方地址）、OPENAI_API_KEY、
+        LLM_POOL_SIZE（应与工作进程的并发线程数一致）、LLM_CONNECT_TIMEOUT / LLM_READ_TIMEOUT（秒）、
+        LLM_MAX_RETRIES、LLM_RETRY_BUDGET（每次调用存入的重试令牌）、
+        LLM_HEDGE=1 启用对冲请求、LLM_HEDGE_MIN_DELAY（对冲前的最短等待，秒）。
+        """
+        return cls(
+            base_url=os.environ.get('LLM_BASE_URL') or os.environ.get('OPENAI_BASE_URL'),
+            api_key=os.environ.get('OPENAI_API_KEY'),
+            pool_size=int(os.environ.get('LLM_POOL_SIZE', '10')),
+            connect_timeout=float(os.environ.get('LLM_CONNECT_TIMEOUT', '3')),
+            read_timeout=float(os.environ.get('LLM_READ_TIMEOUT', '30')),
+            max_retries=int(os.environ.get('LLM_MAX_RETRIES', '2')),
+            retry_budget=RetryBudget(ratio=float(os.environ.get('LLM_RETRY_BUDGET', '0.2'))),
+            hedge=os.environ.get('LLM_HEDGE', '') in ('1', 'true'),
+            hedge_min_delay=float(os.environ.get('LLM_HEDGE_MIN_DELAY', '0.5'))
+        )
+
+    @property
+    def client(self):
+        """首次使用时创建 OpenAI 客户端；SDK 自带的重试关闭，由本类统一控制"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    # 对冲时同一调用可能占用两个连接
+                    connections = self.pool_size * 2 if self.hedge else self.pool_size
+                    timeout = httpx.Timeout(
+                        connect=self.connect_timeout, read=self.read_timeout,
+                        write=self.connect_timeout, pool=self.connect_timeout
+                    )
+                    http_client = httpx.Client(
+                        timeout=timeout,
+                        limits=httpx.Limits(
+                            max_connections=connections,
+                            max_keepalive_connections=connections,
+                            keepalive_expiry=60
+                        )
+                    )
+                    self._client = openai.OpenAI(
+                        base_url=self.base_url,
+                        api_key=self.api_key,
+                        http_client=http_client,
+                        max_retries=0,
+                        timeout=timeout
+                    )
+        return self._client
+
+    def _backoff(self, attempt):
+        """第 attempt 次重试前的等待时间（全抖动指数退避）"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _call_with_retries(self, call):
+        """执行 call()，可重试的错误在重试预算内退避重试；返回 (结果, 尝试次数)"""
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                return call(), attempt + 1
+            except retryable_errors() as e:
+                if attempt >= self.max_retries or not self.retry_budget.withdraw():
+                    e.attempts = attempt + 1
+                    raise
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+
+    def _hedge_delay(self):
+        """对冲前的等待时间；样本不足时返回 None，不对冲"""
+        if self.metrics.sample_count() < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.metrics.quantile(self.hedge_quantile))
+
+    def _executor_for_hedge(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.pool_size * 2, thread_name_prefix='llm-hedge'
+                    )
+        return self._executor
+
+    def _hedged(self, call, delay):
+        """先发主请求，delay 秒内未返回则再发一个对冲请求，返回先成功的结果"""
+        executor = self._executor_for_hedge()
+        pending = {executor.submit(call)}
+        done, pending = wait(pending, timeout=delay)
+        if not done and self.retry_budget.withdraw():
+            self.metrics.incr('hedged')
+            hedge_future = executor.submit(call)
+            pending.add(hedge_future)
+        else:
+            hedge_future = None
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge_future:
+                        self.metrics.incr('hedge_won')
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                raise error
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    def complete(self, messages, **params):
+        """非流式生成，返回 SDK 的响应对象；失败时抛出最后一次的异常"""
+        def call():
+            return self.client.chat.completions.create(messages=messages, **params)
+
+        delay = self._hedge_delay() if self.hedge else None
+        single = call if delay is None else (lambda: self._hedged(call, delay))
+        start = time.perf_counter()
+        try:
+            response, attempts = self._call_with_retries(single)
+        except Exception as e:
+            self.metrics.record(time.perf_counter() - start, outcome_of(e), getattr(e, 'attempts', 1))
+            raise
+        self.metrics.record(time.perf_counter() - start, 'ok', attempts)
+        return response
+
+    def stream(self, messages, **params):
+        """流式生成，返回 SDK 的 Stream 对象
+
+        只在收到响应头之前重试，不做对冲；记录的延迟为收到响应头的时间。
+        """
+        start = time.perf_counter()
+        try:
+            stream, attempts = self._call_with_retries(
+                lambda: self.client.chat.completions.create(messages=messages, stream=True, **params)
+            )
+        except Exception as e:
+            self.stream_metrics.record(
+                time.perf_counter() - start, outcome_of(e), getattr(e, 'attempts', 1)
+            )
+            raise
+        self.stream_metrics.record(time.perf_counter() - start, 'ok', attempts)
+        return stream
+
+    def stats(self):
+        stats = self.metrics.snapshot()
+        stats.update({
+            'stream': self.stream_metrics.snapshot(),
+            'base_url': str(self.client.base_url) if self._client is not None else self.base_url,
+            'pool_size': self.pool_size,
+            'hedge': self.hedge,
+            'hedge_delay_seconds': self._hedge_delay() if self.hedge else None,
+            'retry_budget_balance': round(self.retry_budget.balance, 2)
+        })
+        return stats
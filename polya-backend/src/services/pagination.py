@@ -0,0 +1,82 @@
+"""列表接口的游标分页与流式输出
+
+分页按一组升序且组合唯一的列（如 (updated_at, id)）做键集（keyset）查询：
+下一页从上一页最后一行之后开始，用行值比较命中索引，翻页成本与页码无关。
+游标是最后一行键值的 base64 编码，对客户端不透明。
+
+stream=1 时用 yield_per 从数据库游标分批读取，逐行输出 NDJSON，服务端内存与结果大小无关。
+legacy=1（或环境变量 LEGACY_LIST_RESPONSES=1 作为默认值）时接口返回分页前的完整响应。
+"""
+import base64
+import json
+import os
+from datetime import datetime
+from flask import Response, request, stream_with_context
+from src.models.user import db
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# 流式输出时每次从数据库游标读取的行数
+STREAM_BATCH_SIZE = 500
+
+LEGACY_LIST_RESPONSES = os.environ.get('LEGACY_LIST_RESPONSES', '0') not in ('0', 'false', '')
+
+def _flag(name):
+    value = request.args.get(name)
+    return None if value is None else value not in ('0', 'false', '')
+
+def wants_legacy():
+    flag = _flag('legacy')
+    return LEGACY_LIST_RESPONSES if flag is None else flag
+
+def wants_stream():
+    return bool(_flag('stream'))
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, columns):
+    """把游标还原为 columns 对应的键值，无效时抛出 ValueError"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return tuple(
+            datetime.fromisoformat(value) if column.type.python_type is datetime else column.type.python_type(value)
+            for column, value in zip(columns, values)
+        )
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise ValueError('无效的分页游标')
+
+def page_args(columns):
+    """读取 limit 与 cursor 参数，返回 (limit, 游标键值或 None)"""
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor')
+    return limit, decode_cursor(cursor, columns) if cursor else None
+
+def _after(query, columns, cursor):
+    if cursor is not None:
+        query = query.filter(db.tuple_(*columns) > db.tuple_(*cursor))
+    return query.order_by(*columns)
+
+def keyset_page(query, columns, limit, cursor=None):
+    """返回 (本页对象, next_cursor)，没有下一页时 next_cursor 为 None"""
+    items = _after(query, columns, cursor).limit(limit + 1).all()
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor([getattr(items[-1], column.key) for column in columns])
+
+def ndjson_response(query, columns, to_dict, cursor=None):
+    """以 NDJSON 逐行输出 query 的全部结果（可从游标之后开始）"""
+    def generate():
+        lines = []
+        for item in _after(query, columns, cursor).yield_per(STREAM_BATCH_SIZE):
+            lines.append(json.dumps(to_dict(item), ensure_ascii=False))
+            if len(lines) >= STREAM_BATCH_SIZE:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
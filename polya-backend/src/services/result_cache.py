@@ -0,0 +1,204 @@
+"""按用户数据版本缓存的计算结果
+
+用户的数据只在提交进度或解题记录时变化。写入接口提交后调用 bump_version()，
+读取接口以 (命名空间, user_id, 数据版本, 参数) 为键缓存结果，两次写入之间的重复读取
+不再访问进度表。版本号本身也保存在缓存后端中。
+后端的 epoch 标识版本号序列：进程内字典的版本号随进程重启从 0 开始，每个进程有不同的 epoch；
+SQLite 后端的 epoch 保存在缓存文件中，删除缓存文件后会重新生成。
+
+后端可选进程内字典（memory）或多个工作进程共享的 SQLite 文件（sqlite），
+均按最近最少使用淘汰，值以 JSON 保存，读取时返回新的副本。
+memory 后端的版本号只在本进程内递增，缓存项也没有过期时间：多个工作进程部署时，
+一个进程中的写入不会使其他进程的缓存失效，它们会一直返回旧结果，直到缓存项被淘汰。
+因此 memory 只适用于单进程部署（默认值，如开发服务器）；多进程部署须设置 RESULT_CACHE_BACKEND=sqlite。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+class MemoryCacheBackend:
+    """进程内 LRU 缓存，版本号不在进程间共享，只适用于单进程部署"""
+
+    shared = False
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.epoch = uuid.uuid4().hex
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_version(self, user_id):
+        return self._versions.get(user_id, 0)
+
+    def bump_version(self, user_id):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            return self._versions[user_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class SQLiteCacheBackend:
+    """多个工作进程共享的 SQLite 文件缓存，按最近访问时间淘汰"""
+
+    shared = True
+
+    # 每写入多少次检查一次容量，避免每次写入都统计行数
+    EVICT_EVERY = 100
+
+    def __init__(self, path, max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._connect()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL, accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed ON cache_entries (accessed_at);
+            CREATE TABLE IF NOT EXISTS data_versions (
+                user_id TEXT PRIMARY KEY, version INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS cache_meta (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL
+            );
+        ''')
+        conn.execute("INSERT OR IGNORE INTO cache_meta (key, value) VALUES ('epoch', ?)", (uuid.uuid4().hex,))
+        self.epoch = conn.execute("SELECT value FROM cache_meta WHERE key = 'epoch'").fetchone()[0]
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute('SELECT value FROM cache_entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE cache_entries SET accessed_at = ? WHERE key = ?', (time.time(), key))
+        return row[0]
+
+    def set(self, key, value):
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache_entries (key, value, accessed_at) VALUES (?, ?, ?)',
+            (key, value, time.time())
+        )
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            conn.execute('''
+                DELETE FROM cache_entries WHERE key IN (
+                    SELECT key FROM cache_entries ORDER BY accessed_at
+                    LIMIT MAX((SELECT COUNT(*) FROM cache_entries) - ?, 0)
+                )
+            ''', (self.max_entries,))
+
+    def get_version(self, user_id):
+        row = self._connect().execute(
+            'SELECT version FROM data_versions WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump_version(self, user_id):
+        return self._connect().execute('''
+            INSERT INTO data_versions (user_id, version) VALUES (?, 1)
+            ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+            RETURNING version
+        ''', (user_id,)).fetchone()[0]
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache_entries')
+
+class ResultCache:
+    """以 (namespace, user_id, 数据版本, 参数) 为键的结果缓存，带命中/未命中计数"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """根据环境变量 RESULT_CACHE_BACKEND / RESULT_CACHE_PATH / RESULT_CACHE_SIZE 创建缓存
+
+        RESULT_CACHE_BACKEND 默认为 memory（仅单进程），多进程部署使用 sqlite。
+        """
+        backend = os.environ.get('RESULT_CACHE_BACKEND', 'memory')
+        size = int(os.environ.get('RESULT_CACHE_SIZE', '10000'))
+        if backend == 'sqlite':
+            path = os.environ.get('RESULT_CACHE_PATH') or os.path.join(
+                os.path.dirname(os.path.dirname(__file__)), 'database', 'result_cache.db'
+            )
+            return cls(SQLiteCacheBackend(path, size))
+        return cls(MemoryCacheBackend(size))
+
+    def version(self, user_id):
+        return self.backend.get_version(user_id)
+
+    def version_tag(self, user_id):
+        """跨进程、跨重启都可比较的用户数据版本，用于生成 ETag"""
+        return f'{self.backend.epoch}:{self.version(user_id)}'
+
+    def bump_version(self, user_id):
+        """用户数据发生变化，使其全部缓存结果失效"""
+        return self.backend.bump_version(user_id)
+
+    def get_or_compute(self, namespace, user_id, params, compute):
+        key = json.dumps(
+            [namespace, user_id, self.version(user_id), params], ensure_ascii=False
+        )
+        cached = self.backend.get(key)
+        with self._lock:
+            if cached is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached is not None:
+            return json.loads(cached)
+        value = compute()
+        self.backend.set(key, json.dumps(value, ensure_ascii=False))
+        return value
+
+    def stats(self):
+        """命中统计只反映当前进程"""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'backend': type(self.backend).__name__,
+            # 版本号是否在工作进程间共享（memory 后端为 False，只适用于单进程部署）
+            'shared': self.backend.shared,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else 0.0
+        }
+
+result_cache = ResultCache.from_env()
@@ -0,0 +1,397 @@
+"""近义问题的回复复用
+
+精确缓存只在提示词完全相同时命中。这里对导师对话中已回答过的问题建立相似度索引：
+问题按字符 2/3-gram 计算哈希特征的 TF-IDF 向量，只在相同的 (解题步骤, 问题背景) 分桶内比较，
+余弦相似度超过阈值且问题中的数字完全相同时直接复用已有回复，不再调用模型
+（只差一个数字的两个问题字符 n-gram 相似度很高，答案却不同）。
+
+检索分两步：每条记录保存由 TF-IDF 向量计算的 256 位 SimHash，先用汉明距离（位集 popcount）
+在分桶内筛出候选，再用保存的稀疏向量计算精确余弦相似度重排。
+
+索引以追加写入的二进制文件保存在一个目录中，新增记录只追加到文件末尾；
+其他工作进程读取时按文件长度增量加载新记录，写入时用文件锁串行化。
+每条记录保存原始词频，IDF 在查询时按当前的文档频率计算，同一对问题的相似度不随索引增长而漂移。
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+from src.services.lazy import lazy_module
+from src.services.llm_cache import normalize_text
+
+np = lazy_module('numpy')
+
+NGRAM_SIZES = (2, 3)
+CODE_WORDS = 4  # SimHash 位数 = 64 * CODE_WORDS
+DF_BUCKETS = 1 << 20  # 文档频率按特征哈希分桶统计
+MAX_QUESTION_CHARS = 1000
+
+_NON_WORD = re.compile(r'[\W_]+')
+_NUMBER = re.compile(r'\d+(?:\.\d+)?')
+
+# 索引文件格式版本；1：weights 保存写入时的 TF-IDF 权重，2：weights 保存词频
+FORMAT_VERSION = 2
+
+# (文件名, dtype, 每条记录的元素数)；codes 最后写入，其长度决定记录数
+_RECORD_FILES = (
+    ('text_offsets', 'int64', 1),
+    ('offsets', 'int64', 1),
+    ('buckets', 'uint64', 1),
+    ('codes', 'uint64', CODE_WORDS),
+)
+
+def _splitmix64(x):
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def question_ngrams(question):
+    """规范化问题文本并切分为字符 n-gram"""
+    text = _NON_WORD.sub(' ', normalize_text(question).lower()).strip()[:MAX_QUESTION_CHARS]
+    grams = []
+    for n in NGRAM_SIZES:
+        grams.extend(text[i:i + n] for i in range(len(text) - n + 1))
+    return [g for g in grams if g.strip()] or ([text] if text else [])
+
+def question_numbers(question):
+    """问题中依次出现的数字；数字不同的问题不复用回复"""
+    return _NUMBER.findall(normalize_text(question))
+
+def term_counts(question):
+    """返回 (排序后的特征哈希, 词频)"""
+    grams = question_ngrams(question)
+    if not grams:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.float32)
+    hashed = np.array([zlib.crc32(g.encode('utf-8')) for g in grams], dtype=np.uint32)
+    feats, tf = np.unique(hashed, return_counts=True)
+    return feats, tf.astype(np.float32)
+
+def bucket_key(current_step, problem_context):
+    """相同解题步骤与问题背景的问题才互相比较"""
+    raw = f'{current_step}\x1f{normalize_text(problem_context)}'.encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), 'little')
+
+def simhash(feats, weights):
+    """由加权特征计算 SimHash（每个特征的伪随机 ±1 位向量按权重求和后取符号）"""
+    seeds = feats.astype(np.uint64)[:, None] * np.uint64(CODE_WORDS) + np.arange(CODE_WORDS, dtype=np.uint64)
+    bits = np.unpackbits(_splitmix64(seeds).view(np.uint8), axis=1).astype(np.float32)
+    votes = weights @ (bits * 2 - 1)
+    return np.packbits(votes > 0).view(np.uint64)
+
+class SemanticAnswerIndex:
+    """按 (步骤, 问题背景) 分桶的近义问题回复索引"""
+
+    def __init__(self, path, threshold=0.85, candidates=64, dedupe_threshold=0.98, enabled=True):
+        self.path = path
+        self.threshold = threshold
+        self.candidates = candidates
+        self.dedupe_threshold = dedupe_threshold
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = 0
+        self._capacity = 0
+        self._arrays = {}
+        self._df = np.zeros(DF_BUCKETS, dtype=np.uint32)
+        self._feats = np.zeros(0, dtype=np.uint32)
+        self._weights = np.zeros(0, dtype=np.float16)
+        # 按分桶排序的布局：(行号, 分桶键, 各分桶区间, 按列存放的 SimHash)，之后追加的记录逐条扫描
+        self._layout = (
+            np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64),
+            np.zeros(0, dtype=np.int64), np.zeros((CODE_WORDS, 0), dtype=np.uint64)
+        )
+        self._sorted_size = 0
+        if enabled:
+            os.makedirs(path, exist_ok=True)
+            with self._file_lock():
+                self._repair()
+                self._upgrade()
+                self._load_tail()
+
+    @classmethod
+    def from_env(cls):
+        """根据环境变量 SEMANTIC_CACHE_DIR / SEMANTIC_CACHE_THRESHOLD / SEMANTIC_CACHE_DISABLED 创建索引"""
+        path = os.environ.get('SEMANTIC_CACHE_DIR') or os.path.join(
+            os.path.dirname(os.path.dirname(__file__)), 'database', 'semantic_index'
+        )
+        return cls(
+            path,
+            threshold=float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', '0.85')),
+            enabled=os.environ.get('SEMANTIC_CACHE_DISABLED', '') not in ('1', 'true')
+        )
+
+    def _file(self, name):
+        return os.path.join(self.path, f'{name}.bin')
+
+    @contextmanager
+    def _file_lock(self):
+        """写入索引文件时的进程间互斥锁"""
+        import fcntl
+        with open(os.path.join(self.path, 'write.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _file_records(self, name, dtype, width):
+        path = self._file(name)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        return size // (np.dtype(dtype).itemsize * width)
+
+    def _read(self, name, dtype, start, count, width=1):
+        itemsize = np.dtype(dtype).itemsize * width
+        with open(self._file(name), 'rb') as f:
+            f.seek(start * itemsize)
+            data = np.fromfile(f, dtype=dtype, count=count * width)
+        return data.reshape(-1, width) if width > 1 else data
+
+    def _repair(self):
+        """截断中途写入失败留下的不完整记录，使各文件长度一致"""
+        n = min(self._file_records(name, dtype, width) for name, dtype, width in _RECORD_FILES)
+        feat_end = int(self._read('offsets', np.int64, n - 1, 1)[0]) if n else 0
+        text_end = int(self._read('text_offsets', np.int64, n - 1, 1)[0]) if n else 0
+        sizes = {name: n * np.dtype(dtype).itemsize * width for name, dtype, width in _RECORD_FILES}
+        sizes.update({'feats': feat_end * 4, 'weights': feat_end * 2, 'texts': text_end})
+        for name, size in sizes.items():
+            with open(self._file(name), 'ab') as f:
+                if f.tell() != size:
+                    f.truncate(size)
+
+    def _upgrade(self):
+        """把旧格式的 weights（写入时的 TF-IDF 权重）按保存的问题文本改写为词频"""
+        marker = os.path.join(self.path, 'format')
+        if os.path.exists(marker):
+            with open(marker) as f:
+                if f.read().strip() == str(FORMAT_VERSION):
+                    return
+        n = self._file_records('codes', np.uint64, CODE_WORDS)
+        if n:
+            text_offsets = self._read('text_offsets', np.int64, 0, n)
+            with open(self._file('texts'), 'rb') as f:
+                texts = f.read(int(text_offsets[-1]))
+            starts = np.concatenate([[0], text_offsets[:-1]])
+            counts = [
+                term_counts(json.loads(texts[start:end].decode('utf-8'))['q'])[1]
+                for start, end in zip(starts, text_offsets)
+            ]
+            tmp = self._file('weights') + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(np.concatenate(counts).astype(np.float16).tobytes())
+            os.replace(tmp, self._file('weights'))
+        with open(marker, 'w') as f:
+            f.write(str(FORMAT_VERSION))
+
+    def _ensure_capacity(self, size):
+        if size <= self._capacity:
+            return
+        capacity = max(size, self._capacity * 2, 1024)
+        for name, dtype, width in _RECORD_FILES:
+            shape = (capacity, width) if width > 1 else (capacity,)
+            grown = np.zeros(shape, dtype=dtype)
+            if name in self._arrays:
+                grown[:self._size] = self._arrays[name][:self._size]
+            self._arrays[name] = grown
+        self._capacity = capacity
+
+    def _load_tail(self):
+        """加载其他进程（或启动前）追加的新记录"""
+        n = self._file_records('codes', np.uint64, CODE_WORDS)
+        if n <= self._size:
+            return
+        start = self._size
+        self._ensure_capacity(n)
+        for name, dtype, width in _RECORD_FILES:
+            self._arrays[name][start:n] = self._read(name, dtype, start, n - start, width)
+        feat_start = int(self._arrays['offsets'][start - 1]) if start else 0
+        feat_end = int(self._arrays['offsets'][n - 1])
+        new_feats = self._read('feats', np.uint32, feat_start, feat_end - feat_start)
+        if len(new_feats) > DF_BUCKETS // 8:
+            self._df += np.bincount(new_feats & (DF_BUCKETS - 1), minlength=DF_BUCKETS).astype(np.uint32)
+        else:
+            np.add.at(self._df, new_feats & (DF_BUCKETS - 1), 1)
+        # 稀疏向量只在重排候选时读取，使用内存映射
+        if feat_end:
+            self._feats = np.memmap(self._file('feats'), dtype=np.uint32, mode='r', shape=(feat_end,))
+            self._weights = np.memmap(self._file('weights'), dtype=np.float16, mode='r', shape=(feat_end,))
+        self._size = n
+        if n - self._sorted_size > max(4096, n // 8):
+            self._reindex()
+
+    def _reindex(self):
+        """把全部记录按分桶排序，使每个分桶的 SimHash 连续存放"""
+        n = self._size
+        order = np.argsort(self._arrays['buckets'][:n], kind='stable')
+        sorted_buckets = self._arrays['buckets'][:n][order]
+        keys, starts = np.unique(sorted_buckets, return_index=True)
+        bounds = np.append(starts, n)
+        codes = np.ascontiguousarray(self._arrays['codes'][:n][order].T)
+        self._layout = (order, keys, bounds, codes)
+        self._sorted_size = n
+
+    def _refresh(self):
+        if self._file_records('codes', np.uint64, CODE_WORDS) > self._size:
+            with self._lock:
+                self._load_tail()
+
+    def tfidf(self, feats, tf):
+        """按当前的文档频率计算 L2 归一化的 TF-IDF 权重"""
+        if not len(feats):
+            return tf
+        df = self._df[feats & (DF_BUCKETS - 1)]
+        weights = tf * (np.log((1 + self._size) / (1 + df)) + 1)
+        return (weights / np.linalg.norm(weights)).astype(np.float32)
+
+    def vectorize(self, question):
+        """返回 (排序后的特征哈希, L2 归一化的 TF-IDF 权重)"""
+        feats, tf = term_counts(question)
+        return feats, self.tfidf(feats, tf)
+
+    def _entry(self, row):
+        """返回一条记录的 (特征哈希, 按当前文档频率计算的 TF-IDF 权重)"""
+        end = int(self._arrays['offsets'][row])
+        start = int(self._arrays['offsets'][row - 1]) if row else 0
+        feats = self._feats[start:end]
+        return feats, self.tfidf(feats, self._weights[start:end].astype(np.float32))
+
+    def _text(self, row):
+        end = int(self._arrays['text_offsets'][row])
+        start = int(self._arrays['text_offsets'][row - 1]) if row else 0
+        with open(self._file('texts'), 'rb') as f:
+            f.seek(start)
+            return json.loads(f.read(end - start).decode('utf-8'))
+
+    def _search(self, feats, weights, bucket, k):
+        """返回分桶内相似度最高的 k 个 (相似度, 行号)"""
+        with self._lock:
+            size = self._size
+            sorted_size = self._sorted_size
+            order, keys, bounds, sorted_codes = self._layout
+            codes = self._arrays.get('codes')
+            buckets = self._arrays.get('buckets')
+        if not size or not len(feats):
+            return []
+        code = simhash(feats, weights)
+        bucket = np.uint64(bucket)
+
+        # 已排序部分：分桶内的 SimHash 连续存放，逐个 64 位字计算汉明距离
+        pos = int(np.searchsorted(keys, bucket))
+        if pos < len(keys) and keys[pos] == bucket:
+            lo, hi = int(bounds[pos]), int(bounds[pos + 1])
+            sorted_rows = order[lo:hi]
+            sorted_distance = np.zeros(hi - lo, dtype=np.uint16)
+            for word in range(CODE_WORDS):
+                sorted_distance += np.bitwise_count(sorted_codes[word, lo:hi] ^ code[word])
+        else:
+            sorted_rows = np.zeros(0, dtype=np.int64)
+            sorted_distance = np.zeros(0, dtype=np.uint16)
+        # 排序之后追加的记录
+        tail_rows = sorted_size + np.flatnonzero(buckets[sorted_size:size] == bucket)
+        tail_distance = np.bitwise_count(codes[tail_rows] ^ code).sum(axis=1).astype(np.uint16)
+
+        rows = np.concatenate([sorted_rows, tail_rows])
+        if not len(rows):
+            return []
+        distance = np.concatenate([sorted_distance, tail_distance])
+        if len(rows) > self.candidates:
+            # 距离只有 0..256，按计数找出截止距离，比 argpartition 快
+            counts = np.cumsum(np.bincount(distance, minlength=64 * CODE_WORDS + 1))
+            cutoff = int(np.searchsorted(counts, self.candidates))
+            below = np.flatnonzero(distance < cutoff)
+            ties = np.flatnonzero(distance == cutoff)[:self.candidates - len(below)]
+            rows = rows[np.concatenate([below, ties])]
+        results = []
+        for row in rows:
+            entry_feats, entry_weights = self._entry(int(row))
+            _, qi, ei = np.intersect1d(feats, entry_feats, assume_unique=True, return_indices=True)
+            results.append((float(weights[qi] @ entry_weights[ei]), int(row)))
+        results.sort(key=lambda r: (-r[0], r[1]))
+        return results[:k]
+
+    def search(self, question, current_step, problem_context, k=5):
+        """返回最相近的 k 个已回答问题：[{similarity, question, answer}]"""
+        if not self.enabled:
+            return []
+        self._refresh()
+        feats, weights = self.vectorize(question)
+        results = []
+        for similarity, row in self._search(feats, weights, bucket_key(current_step, problem_context), k):
+            text = self._text(row)
+            results.append({
+                'similarity': round(similarity, 4),
+                'question': text['q'],
+                'answer': text['a']
+            })
+        return results
+
+    def lookup(self, question, current_step, problem_context):
+        """相似度不低于阈值且数字相同时返回可复用的回复，否则返回 None"""
+        if not self.enabled:
+            return None
+        numbers = question_numbers(question)
+        answer = next((
+            r['answer'] for r in self.search(question, current_step, problem_context)
+            if r['similarity'] >= self.threshold and question_numbers(r['question']) == numbers
+        ), None)
+        with self._lock:
+            if answer is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return answer
+
+    def add(self, question, current_step, problem_context, answer):
+        """记录一个成功回答的问题；分桶内已有几乎相同（且数字相同）的问题时不重复写入，返回是否写入"""
+        if not self.enabled or not answer:
+            return False
+        feats, tf = term_counts(question)
+        if not len(feats):
+            return False
+        numbers = question_numbers(question)
+        bucket = bucket_key(current_step, problem_context)
+        text = json.dumps({'q': question, 'a': answer, 't': time.time()}, ensure_ascii=False).encode('utf-8')
+        with self._file_lock():
+            with self._lock:
+                self._load_tail()
+            weights = self.tfidf(feats, tf)
+            for similarity, row in self._search(feats, weights, bucket, 5):
+                if similarity >= self.dedupe_threshold and question_numbers(self._text(row)['q']) == numbers:
+                    return False
+            with self._lock:
+                row = self._size
+                feat_end = (int(self._arrays['offsets'][row - 1]) if row else 0) + len(feats)
+                text_end = (int(self._arrays['text_offsets'][row - 1]) if row else 0) + len(text)
+                values = {
+                    'text_offsets': np.array([text_end], dtype=np.int64),
+                    'offsets': np.array([feat_end], dtype=np.int64),
+                    'buckets': np.array([bucket], dtype=np.uint64),
+                    'codes': simhash(feats, weights),
+                }
+                # 先写变长数据，最后写 codes：读者按 codes 的长度判断记录是否完整
+                for name, data in (('texts', text), ('feats', feats.tobytes()),
+                                   ('weights', tf.astype(np.float16).tobytes())):
+                    with open(self._file(name), 'ab') as f:
+                        f.write(data)
+                for name, _, _ in _RECORD_FILES:
+                    with open(self._file(name), 'ab') as f:
+                        f.write(values[name].tobytes())
+                self._load_tail()
+        return True
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': self._size,
+            'threshold': self.threshold,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0
+        }
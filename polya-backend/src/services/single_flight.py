@@ -0,0 +1,200 @@
+"""相同请求的在途合并（single-flight）
+
+同一时刻到达的相同提示词只向上游发起一次调用：第一个请求成为发起者，
+其余请求挂到同一次调用上，收到相同的回复。流式调用由后台线程从上游读取片段，
+所有订阅者（包括中途加入的）都从第一个片段开始读取；全部订阅者断开后才关闭上游连接。
+
+可选跨进程模式：按键哈希分片的文件锁（flock）保证多个工作进程中同时只有一个发起调用，
+其余进程等锁释放后从回复缓存读取结果（需启用回复缓存，跨进程时不能挂到进行中的流上）。
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+class Flight:
+    """一次进行中的上游调用，chunks 为已收到的回复片段"""
+
+    def __init__(self, cancellable=False):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.cancellable = cancellable
+        self.cancelled = False
+        self.cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error=None):
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+class SingleFlight:
+    """按键合并并发的相同上游调用"""
+
+    # 跨进程锁文件的分片数，不同的键可能共用一个锁文件
+    LOCK_STRIPES = 256
+
+    def __init__(self, enabled=True, lock_dir=None, lock_timeout=60.0):
+        self.enabled = enabled
+        self.lock_dir = lock_dir
+        self.lock_timeout = lock_timeout
+        self.leaders = 0
+        self.followers = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """根据环境变量 LLM_SINGLE_FLIGHT（默认开启）/ LLM_SINGLE_FLIGHT_DIR（跨进程锁目录）/
+        LLM_SINGLE_FLIGHT_WAIT（跨进程等锁上限，秒）创建"""
+        return cls(
+            enabled=os.environ.get('LLM_SINGLE_FLIGHT', '1') not in ('0', 'false'),
+            lock_dir=os.environ.get('LLM_SINGLE_FLIGHT_DIR') or None,
+            lock_timeout=float(os.environ.get('LLM_SINGLE_FLIGHT_WAIT', '60'))
+        )
+
+    def _join(self, key, cancellable):
+        """返回 (flight, 是否为发起者)；已取消的流不再接受新的订阅者"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and not flight.cancelled:
+                self.followers += 1
+                return flight, False
+            flight = Flight(cancellable)
+            self._flights[key] = flight
+            self.leaders += 1
+            return flight, True
+
+    def _finish(self, key, flight, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(error)
+
+    def _follow(self, flight):
+        """从第一个片段开始读取 flight 的回复，直到调用结束"""
+        index = 0
+        with flight.cond:
+            flight.subscribers += 1
+        try:
+            while True:
+                with flight.cond:
+                    while index >= len(flight.chunks) and not flight.done:
+                        flight.cond.wait()
+                    chunks = flight.chunks[index:]
+                    index = len(flight.chunks)
+                    done, error = flight.done, flight.error
+                yield from chunks
+                if done:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with flight.cond:
+                flight.subscribers -= 1
+                if flight.cancellable and flight.subscribers == 0 and not flight.done:
+                    flight.cancelled = True
+
+    @contextmanager
+    def _process_lock(self, key):
+        """跨进程模式下持有 key 所在分片的文件锁，产出是否曾等待其他进程"""
+        if not self.lock_dir:
+            yield False
+            return
+        import fcntl
+        stripe = int(key[:8], 16) % self.LOCK_STRIPES
+        with open(os.path.join(self.lock_dir, f'{stripe:03d}.lock'), 'a') as f:
+            waited = False
+            deadline = time.monotonic() + self.lock_timeout
+            while True:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    waited = True
+                    if time.monotonic() >= deadline:
+                        # 等待超时则不再合并，直接发起调用
+                        yield waited
+                        return
+                    time.sleep(0.05)
+            try:
+                yield waited
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def call(self, key, compute, recheck=None):
+        """合并非流式调用，返回 compute() 的结果（字符串）
+
+        recheck 用于跨进程模式：等到其他进程释放锁后先调用 recheck()，有结果时不再发起调用。
+        """
+        if not self.enabled:
+            return compute()
+        flight, leader = self._join(key, cancellable=False)
+        if not leader:
+            return ''.join(self._follow(flight))
+        try:
+            with self._process_lock(key) as waited:
+                result = recheck() if waited and recheck else None
+                if result is None:
+                    result = compute()
+        except Exception as e:
+            self._finish(key, flight, e)
+            raise
+        flight.publish(result)
+        self._finish(key, flight)
+        return result
+
+    def stream(self, key, produce, recheck=None):
+        """合并流式调用，返回逐段产出回复的生成器
+
+        produce() 返回上游片段的生成器，由后台线程读取；所有订阅者都断开后关闭它。
+        """
+        if not self.enabled:
+            return produce()
+        flight, leader = self._join(key, cancellable=True)
+        if leader:
+            threading.Thread(
+                target=self._pump, args=(key, flight, produce, recheck),
+                name='llm-single-flight', daemon=True
+            ).start()
+        return self._follow(flight)
+
+    def _pump(self, key, flight, produce, recheck):
+        try:
+            with self._process_lock(key) as waited:
+                cached = recheck() if waited and recheck else None
+                if cached is not None:
+                    flight.publish(cached)
+                else:
+                    chunks = produce()
+                    try:
+                        for chunk in chunks:
+                            if flight.cancelled:
+                                break
+                            flight.publish(chunk)
+                    finally:
+                        chunks.close()
+        except Exception as e:
+            self._finish(key, flight, e)
+            return
+        self._finish(key, flight)
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._flights)
+        return {
+            'enabled': self.enabled,
+            'cross_process': bool(self.lock_dir),
+            'leaders': self.leaders,
+            'followers': self.followers,
+            'in_flight': in_flight
+        }
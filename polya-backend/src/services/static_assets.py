@@ -0,0 +1,199 @@
+"""前端静态文件服务
+
+第一次请求静态文件时扫描 static/ 生成内存清单（路径 -> 类型、大小、ETag、预压缩版本），
+之后请求只查字典，不再逐个请求检查文件是否存在；创建应用时不读取静态文件。
+- 预压缩：同目录下的 .br / .gz 文件按 Accept-Encoding 选用（br 优先），响应带 Vary: Accept-Encoding。
+  预压缩版本在部署时由 flask compress-static 生成（.br 需要可选依赖 brotli）。
+- 缓存：文件名带内容哈希的构建产物（assets/name-哈希.ext）返回一年有效期的 immutable；
+  index.html 与其他文件带 ETag，需要重新验证，未变化时返回 304。
+- 小文件（index.html、favicon 等）内容保存在内存中；大文件按清单中的大小与修改时间直接打开发送，
+  请求时不再 stat，支持 Range 请求，并由 WSGI 服务器的 file_wrapper（sendfile）或 USE_X_SENDFILE 发送。
+- 不存在的路径返回 index.html（前端路由），assets/ 下不存在的文件返回 404。
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from flask import Response, abort, current_app, request
+from werkzeug.wsgi import wrap_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 构建产物文件名中的内容哈希，如 index-Bpyjm5hG.js
+HASHED_NAME = re.compile(r'-[A-Za-z0-9_-]{8,}\.\w+$')
+CACHE_IMMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_REVALIDATE = 'no-cache'
+CACHE_DEFAULT = 'public, max-age=3600'
+# 不超过该大小的文件内容保存在内存中
+MEMORY_FILE_LIMIT = 64 * 1024
+# 值得压缩的最小文件大小
+COMPRESS_MIN_SIZE = 1024
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml', 'application/xml')
+# (编码名, 文件后缀)，按优先级排列
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+def is_compressible(mimetype, size):
+    return size >= COMPRESS_MIN_SIZE and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+def precompress(path, use_brotli=False):
+    """为 path 生成缺少或过期的 .gz（以及 .br），返回生成的文件列表"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    mtime = os.path.getmtime(path)
+    encoders = [('.gz', lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if use_brotli and brotli is not None:
+        encoders.append(('.br', lambda d: brotli.compress(d, quality=11)))
+    written = []
+    for suffix, encode in encoders:
+        target = path + suffix
+        if os.path.exists(target) and os.path.getmtime(target) >= mtime:
+            continue
+        encoded = encode(data)
+        if len(encoded) >= len(data):
+            continue
+        tmp = f'{target}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(encoded)
+        os.replace(tmp, target)
+        written.append(target)
+    return written
+
+class StaticFile:
+    """清单中的一个文件及其预压缩版本"""
+
+    def __init__(self, root, rel_path):
+        self.path = os.path.join(root, rel_path)
+        self.name = os.path.basename(rel_path)
+        stat = os.stat(self.path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.mimetype = mimetypes.guess_type(rel_path)[0] or 'application/octet-stream'
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.etag = hashlib.sha1(data).hexdigest()[:20]
+        self.data = data if self.size <= MEMORY_FILE_LIMIT else None
+        if rel_path.startswith('assets/') and HASHED_NAME.search(rel_path):
+            self.cache_control = CACHE_IMMUTABLE
+        elif rel_path.endswith('.html'):
+            self.cache_control = CACHE_REVALIDATE
+        else:
+            self.cache_control = CACHE_DEFAULT
+        self.compressible = is_compressible(self.mimetype, self.size)
+        # 编码名 -> (文件路径, 内存中的内容或 None, 文件大小)
+        self.variants = {}
+        if self.compressible:
+            for encoding, suffix in ENCODINGS:
+                variant = self.path + suffix
+                try:
+                    variant_stat = os.stat(variant)
+                except FileNotFoundError:
+                    continue
+                if variant_stat.st_mtime < self.mtime:
+                    continue  # 原文件更新后未重新压缩
+                content = None
+                if variant_stat.st_size <= MEMORY_FILE_LIMIT:
+                    with open(variant, 'rb') as f:
+                        content = f.read()
+                self.variants[encoding] = (variant, content, variant_stat.st_size)
+
+    def choose(self, accept_encodings):
+        """按 Accept-Encoding 选择版本，返回 (编码名或 None, 文件路径, 内存内容或 None, 文件大小)"""
+        for encoding, _ in ENCODINGS:
+            if encoding in self.variants and accept_encodings[encoding] > 0:
+                return (encoding,) + self.variants[encoding]
+        return None, self.path, self.data, self.size
+
+class StaticManifest:
+    """static/ 目录的内存清单"""
+
+    def __init__(self, root, precompress_missing=False, lazy=False):
+        self.root = root
+        self.precompress_missing = precompress_missing
+        self.files = None
+        self._lock = threading.Lock()
+        if not lazy:
+            self.build()
+
+    def ensure_built(self):
+        """返回清单；延迟构建时第一次调用才扫描目录"""
+        if self.files is None:
+            with self._lock:
+                if self.files is None:
+                    self.build()
+        return self.files
+
+    def build(self):
+        files = {}
+        if not self.root or not os.path.isdir(self.root):
+            self.files = files
+            return
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(('.gz', '.br', '.tmp')):
+                    continue
+                rel_path = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, '/')
+                if self.precompress_missing:
+                    mimetype = mimetypes.guess_type(name)[0] or ''
+                    if is_compressible(mimetype, os.path.getsize(os.path.join(dirpath, name))):
+                        try:
+                            precompress(os.path.join(dirpath, name))
+                        except OSError as e:
+                            print(f"预压缩 {rel_path} 失败：{e}")
+                files[rel_path] = StaticFile(self.root, rel_path)
+        self.files = files
+
+    def serve(self, path):
+        """返回 path 对应的响应；找不到时回退到 index.html"""
+        files = self.ensure_built()
+        entry = files.get(path)
+        if entry is None:
+            if path.startswith('assets/'):
+                abort(404)
+            entry = files.get('index.html')
+            if entry is None:
+                return "index.html not found", 404
+
+        encoding, file_path, content, size = entry.choose(request.accept_encodings)
+        sendfile = content is None and current_app.config.get('USE_X_SENDFILE')
+        # 大小与修改时间取自清单，发送时不再 stat；文件名始终是原文件名，不暴露 .gz / .br
+        if content is not None:
+            response = Response(content, mimetype=entry.mimetype)
+        elif sendfile:
+            response = Response(mimetype=entry.mimetype, headers={'X-Sendfile': file_path})
+        else:
+            response = Response(
+                wrap_file(request.environ, open(file_path, 'rb')),
+                mimetype=entry.mimetype,
+                direct_passthrough=True
+            )
+        response.content_length = size
+        response.headers.set('Content-Disposition', 'inline', filename=entry.name)
+        response.set_etag(f'{entry.etag}-{encoding}' if encoding else entry.etag)
+        response.last_modified = entry.mtime
+        if sendfile:
+            # 响应体由前端服务器按 X-Sendfile 发送，Range 也交给它处理
+            response = response.make_conditional(request)
+        else:
+            response = response.make_conditional(request, accept_ranges=True, complete_length=size)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if entry.compressible:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = entry.cache_control
+        return response
+
+    def stats(self):
+        files = self.ensure_built()
+        return {
+            'files': len(files),
+            'bytes': sum(f.size for f in files.values()),
+            'precompressed': {
+                encoding: sum(1 for f in files.values() if encoding in f.variants)
+                for encoding, _ in ENCODINGS
+            }
+        }
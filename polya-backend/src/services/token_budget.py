@@ -0,0 +1,77 @@
+"""本地计算提示词的 token 数
+
+使用 tiktoken 按与模型一致的编码精确计数。编码文件第一次使用时下载并缓存，
+离线部署需预先放入 TIKTOKEN_CACHE_DIR。tiktoken 或编码文件不可用时记录警告并按字符估算：
+ASCII 每 3 个字符算 1 个，其他字符每个算 2 个，结果偏高，预算不会被突破。
+"""
+import logging
+import math
+import re
+
+DEFAULT_MODEL = 'gpt-3.5-turbo'
+
+# 对话格式的额外开销：每条消息 4 个，回复前缀 3 个
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+_ASCII_RUN = re.compile(r'[\x00-\x7f]+')
+_encodings = {}
+
+logger = logging.getLogger(__name__)
+
+def get_encoding(model=DEFAULT_MODEL):
+    """返回模型对应的 tiktoken 编码，不可用时返回 None（第一次调用时才导入 tiktoken）"""
+    if model not in _encodings:
+        try:
+            import tiktoken
+        except ImportError:
+            logger.warning("未安装 tiktoken，token 数按字符估算，对话预算不精确")
+            _encodings[model] = None
+            return None
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except Exception:
+            try:
+                _encodings[model] = tiktoken.get_encoding('cl100k_base')
+            except Exception as e:
+                logger.warning(f"无法加载 {model} 的 tiktoken 编码（{e!r}），token 数按字符估算，对话预算不精确")
+                _encodings[model] = None
+    return _encodings[model]
+
+def tokenizer_name(model=DEFAULT_MODEL):
+    encoding = get_encoding(model)
+    return f'tiktoken:{encoding.name}' if encoding is not None else 'estimate'
+
+def count_tokens(text, model=DEFAULT_MODEL):
+    text = text or ''
+    encoding = get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    ascii_chars = sum(len(run) for run in _ASCII_RUN.findall(text))
+    return math.ceil(ascii_chars / 3) + 2 * (len(text) - ascii_chars)
+
+def count_message_tokens(messages, model=DEFAULT_MODEL):
+    """整个消息列表作为一次请求的提示词 token 数"""
+    return sum(
+        TOKENS_PER_MESSAGE + count_tokens(m['content'], model) for m in messages
+    ) + TOKENS_PER_REPLY
+
+def truncate_to_tokens(text, max_tokens, model=DEFAULT_MODEL, keep='head'):
+    """截断文本使其不超过 max_tokens；keep='tail' 时保留末尾"""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = get_encoding(model)
+    if encoding is not None:
+        ids = encoding.encode(text)
+        ids = ids[:max_tokens] if keep == 'head' else ids[len(ids) - max_tokens:]
+        return encoding.decode(ids)
+    # 估算计数随长度单调，二分查找能保留的最多字符数
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        part = text[:mid] if keep == 'head' else text[len(text) - mid:]
+        if count_tokens(part, model) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] if keep == 'head' else text[len(text) - low:]
@@ -0,0 +1,298 @@
+"""延迟写入队列（write-behind）
+
+请求线程把记录追加到本地日志文件并放入有界的进程内队列后立即返回，
+后台线程每隔 flush_interval 秒或凑满 batch_size 条时在一个事务内批量写入数据库。
+队列已满时提交方最多等待 put_timeout 秒，仍无空位则抛出 QueueFull（由接口返回 503）。
+
+日志按段追加写入，一段中的记录全部写入数据库后删除该段。每个进程对自己的日志段持有文件锁，
+启动时接管没有被任何进程锁住的日志段（进程崩溃后遗留的）并重放其中的记录；
+写入端按记录 id 幂等，重复写入不会产生重复数据。进程正常退出时先把队列写完。
+
+一批记录写入失败时退避重试；同一批重试 max_retries 次仍失败时逐条写入，
+仍然失败的记录（约束冲突、数据错误等永久性错误）连同错误信息移入死信日志段
+dead-letter-<pid>.log，不再阻塞后续记录。排查原因后把死信文件改名为 journal-*.log，
+下次启动时即可重放。队列与统计都属于单个进程，多进程部署时每个工作进程各有一个队列。
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+class QueueFull(Exception):
+    """写入队列已满或正在关闭"""
+
+class WriteBehindQueue:
+    """带本地日志的有界延迟写入队列"""
+
+    def __init__(self, journal_dir, write_batch, enabled=True, maxsize=10000, batch_size=500,
+                 flush_interval=0.2, put_timeout=0.5, fsync=False, segment_bytes=4 << 20, max_retries=5,
+                 name='write-behind'):
+        self.enabled = enabled
+        self.journal_dir = journal_dir
+        self.write_batch = write_batch  # write_batch([(记录 id, 数据), ...])，须幂等
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.fsync = fsync
+        self.segment_bytes = segment_bytes
+        self.max_retries = max_retries
+        self.name = name
+        self.app = None
+        self.written = 0
+        self.rejected = 0
+        self.replayed = 0
+        self.failures = 0
+        self.dead_lettered = 0
+        self._attempts = Counter()  # 记录 id -> 已失败的写入次数
+        self._cond = threading.Condition()
+        self._pending = deque()  # (记录 id, 日志段路径, 数据)
+        self._pending_ids = set()
+        self._outstanding = 0  # 已接收但尚未写入数据库的记录数（含正在写入的批次）
+        self._segments = {}  # 日志段路径 -> 持有文件锁的文件对象
+        self._segment_counts = Counter()
+        self._current = None
+        self._seq = 0
+        self._closed = False
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, write_batch, journal_dir, name='write-behind'):
+        """根据环境变量创建：PROBLEM_RECORD_WRITE_BEHIND（默认关闭）/ WRITE_BEHIND_DIR（日志目录）/
+        WRITE_BEHIND_QUEUE_SIZE / WRITE_BEHIND_BATCH_SIZE / WRITE_BEHIND_FLUSH_MS /
+        WRITE_BEHIND_PUT_TIMEOUT（队列满时等待上限，秒）/ WRITE_BEHIND_FSYNC（每条记录落盘）/
+        WRITE_BEHIND_MAX_RETRIES（一批记录的重试上限，之后逐条写入并把失败的记录移入死信）"""
+        return cls(
+            journal_dir=os.environ.get('WRITE_BEHIND_DIR') or journal_dir,
+            write_batch=write_batch,
+            enabled=os.environ.get('PROBLEM_RECORD_WRITE_BEHIND', '0') not in ('0', 'false', ''),
+            maxsize=int(os.environ.get('WRITE_BEHIND_QUEUE_SIZE', '10000')),
+            batch_size=int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', '500')),
+            flush_interval=int(os.environ.get('WRITE_BEHIND_FLUSH_MS', '200')) / 1000,
+            put_timeout=float(os.environ.get('WRITE_BEHIND_PUT_TIMEOUT', '0.5')),
+            fsync=os.environ.get('WRITE_BEHIND_FSYNC', '0') not in ('0', 'false', ''),
+            max_retries=int(os.environ.get('WRITE_BEHIND_MAX_RETRIES', '5')),
+            name=name
+        )
+
+    @property
+    def started(self):
+        return self._thread is not None
+
+    def start(self, app):
+        """重放遗留日志并启动后台写入线程；未启用时不做任何事"""
+        if not self.enabled or self.started:
+            return
+        self.app = app
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self._adopt_orphans()
+        self._open_segment()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _lock_file(self, path, blocking):
+        import fcntl
+        f = open(path, 'a+', encoding='utf-8')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            f.close()
+            return None
+        return f
+
+    def _adopt_orphans(self):
+        """接管没有进程持有的日志段，把其中的记录重新放入队列"""
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, 'journal-*.log'))):
+            f = self._lock_file(path, blocking=False)
+            if f is None:
+                continue
+            f.seek(0)
+            count = 0
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 崩溃时写了一半的最后一行
+                if entry['id'] in self._pending_ids:
+                    continue
+                self._pending.append((entry['id'], path, entry['data']))
+                self._pending_ids.add(entry['id'])
+                count += 1
+            if count:
+                self._segments[path] = f
+                self._segment_counts[path] = count
+                self._outstanding += count
+                self.replayed += count
+            else:
+                os.remove(path)
+                f.close()
+
+    def _open_segment(self):
+        self._seq += 1
+        name = f'{os.getpid()}-{int(time.time())}-{self._seq}'
+        # 先在临时文件名下加锁再改名，其他进程不会把刚创建的空段当作遗留日志接管
+        tmp_path = os.path.join(self.journal_dir, f'.open-{name}')
+        path = os.path.join(self.journal_dir, f'journal-{name}.log')
+        f = self._lock_file(tmp_path, blocking=True)
+        os.rename(tmp_path, path)
+        self._segments[path] = f
+        self._current = path
+
+    def _release_segments(self):
+        """删除记录已全部写入的日志段；当前段写满时换新段"""
+        f = self._segments[self._current]
+        if self._segment_counts[self._current] == 0 and f.tell() > 0 or f.tell() >= self.segment_bytes:
+            self._open_segment()
+        for path in list(self._segments):
+            if path != self._current and self._segment_counts[path] == 0:
+                os.remove(path)
+                self._segments.pop(path).close()
+                del self._segment_counts[path]
+
+    def submit(self, data):
+        """接收一条记录，写入日志并入队，返回记录 id；队列满时抛出 QueueFull"""
+        entry_id = uuid.uuid4().hex
+        line = json.dumps({'id': entry_id, 'data': data}, ensure_ascii=False) + '\n'
+        deadline = time.monotonic() + self.put_timeout
+        with self._cond:
+            while self._outstanding >= self.maxsize and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if self._closed or self._outstanding >= self.maxsize:
+                self.rejected += 1
+                raise QueueFull()
+            f = self._segments[self._current]
+            f.write(line)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            self._pending.append((entry_id, self._current, data))
+            self._pending_ids.add(entry_id)
+            self._segment_counts[self._current] += 1
+            self._outstanding += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+        return entry_id
+
+    def is_pending(self, entry_id):
+        with self._cond:
+            return entry_id in self._pending_ids
+
+    def _next_batch(self):
+        with self._cond:
+            deadline = time.monotonic() + self.flush_interval
+            while not self._closed and len(self._pending) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(self.batch_size, len(self._pending))
+            return [self._pending.popleft() for _ in range(count)], self._closed
+
+    def _write(self, batch):
+        with self.app.app_context():
+            self.write_batch([(entry_id, data) for entry_id, _, data in batch])
+
+    def _dead_letter(self, failed):
+        """把逐条写入仍失败的记录追加到本进程的死信日志段"""
+        path = os.path.join(self.journal_dir, f'dead-letter-{os.getpid()}.log')
+        with open(path, 'a', encoding='utf-8') as f:
+            for (entry_id, _, data), error in failed:
+                f.write(json.dumps({'id': entry_id, 'data': data, 'error': repr(error)}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        print(f"{len(failed)} 条记录多次写入失败，已移入死信日志 {path}")
+
+    def _run(self):
+        while True:
+            batch, closing = self._next_batch()
+            if not batch:
+                if closing:
+                    return
+                continue
+            failed = []
+            try:
+                self._write(batch)
+            except Exception as e:
+                with self._cond:
+                    self.failures += 1
+                    attempts = 1 + max(self._attempts[entry_id] for entry_id, _, _ in batch)
+                    for entry_id, _, _ in batch:
+                        self._attempts[entry_id] = attempts
+                if attempts < self.max_retries:
+                    print(f"批量写入失败（第 {attempts} 次），稍后重试：{e}")
+                    with self._cond:
+                        self._pending.extendleft(reversed(batch))
+                        if closing:
+                            # 关闭时仍写入失败：保留日志，下次启动重放
+                            return
+                    time.sleep(min(5.0, 0.1 * 2 ** min(attempts, 6)))
+                    continue
+                # 多次重试仍失败：逐条写入，找出无法写入的记录移入死信，其余记录照常写入
+                for item in batch:
+                    try:
+                        self._write([item])
+                    except Exception as item_error:
+                        failed.append((item, item_error))
+                if failed:
+                    self._dead_letter(failed)
+            with self._cond:
+                for entry_id, path, _ in batch:
+                    self._pending_ids.discard(entry_id)
+                    self._attempts.pop(entry_id, None)
+                    self._segment_counts[path] -= 1
+                self._outstanding -= len(batch)
+                self.written += len(batch) - len(failed)
+                self.dead_lettered += len(failed)
+                self._release_segments()
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """等待已接收的记录全部写入，返回是否在超时前完成"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._outstanding:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.1)
+        return True
+
+    def close(self, timeout=30):
+        """停止接收新记录，写完队列后结束后台线程"""
+        if not self.started:
+            return
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        with self._cond:
+            for path, f in list(self._segments.items()):
+                if self._segment_counts[path] == 0:
+                    os.remove(path)
+                    f.close()
+                    del self._segments[path]
+
+    def stats(self):
+        """当前进程中队列的状态"""
+        with self._cond:
+            return {
+                'pid': os.getpid(),
+                'enabled': self.started,
+                'queued': self._outstanding,
+                'maxsize': self.maxsize,
+                'written': self.written,
+                'rejected': self.rejected,
+                'replayed': self.replayed,
+                'failures': self.failures,
+                'dead_lettered': self.dead_lettered,
+                'journal_segments': len(self._segments)
+            }
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.main import create_app
+from src.models.user import db
+
+@pytest.fixture
+def app(tmp_path):
+    """使用临时数据库的应用，数据表已建好"""
+    app = create_app({
+        'TESTING': True,
+        'DATABASE_PATH': str(tmp_path / 'app.db'),
+        'UPGRADE_SCHEMA': True
+    })
+    yield app
+    with app.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,30 @@
+"""读取接口的 ETag 与条件请求"""
+from src.routes import recommendation
+from src.services.collaborative_filtering import CFModelStore
+
+def test_static_data_uses_strong_etag(client):
+    response = client.get('/api/tutor/knowledge-base')
+    etag = response.headers['ETag']
+    assert not etag.startswith('W/')
+    assert client.get('/api/tutor/knowledge-base', headers={'If-None-Match': etag}).status_code == 304
+
+def test_personalized_uses_weak_etag(app, client, tmp_path, monkeypatch):
+    for user_id, score in (('u1', 90), ('u2', 70), ('u3', 85)):
+        for lesson in ('theory_1', 'theory_2', 'practice_basic_1'):
+            client.post('/api/progress', json={
+                'user_id': user_id, 'module': 'theory', 'lesson_id': lesson, 'completed': True, 'score': score
+            })
+    monkeypatch.setattr(recommendation, 'cf_model_store', CFModelStore(str(tmp_path / 'cf_model')))
+    result = app.test_cli_runner().invoke(
+        args=['recommendation', 'train-cf', '--model-dir', str(tmp_path / 'cf_model')]
+    )
+    assert result.exit_code == 0, result.output
+
+    first = client.get('/api/recommend/personalized?user_id=u1')
+    assert first.status_code == 200
+    # 响应体带生成时间，两次响应内容不同，只能共用弱 ETag
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    revalidated = client.get('/api/recommend/personalized?user_id=u1', headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers['ETag'] == etag
@@ -0,0 +1,98 @@
+"""导师对话历史：滚动摘要在并发请求下的创建与更新；对话请求不等待模型生成摘要"""
+import threading
+import time
+from types import SimpleNamespace
+
+from src.models.conversation import ConversationSummary
+from src.routes import ai_tutor
+from src.services.conversation_history import ConversationHistory
+
+def join_summary(previous, turns):
+    return ' / '.join([previous] + [t.content for t in turns] if previous else [t.content for t in turns])
+
+def seed_turns(user_id, context, rounds):
+    history = ConversationHistory(user_id, context)
+    for i in range(rounds):
+        history.record(f'问题 {i} ' + '细节' * 20, f'回答 {i} ' + '提示' * 20)
+
+def test_fit_budget_rolls_old_turns_into_summary(app):
+    with app.app_context():
+        seed_turns('u1', '鸡兔同笼', 6)
+        history = ConversationHistory('u1', '鸡兔同笼', budget=600)
+        assert history.fit_budget(join_summary)
+        assert history.turn_tokens <= 300
+        assert history.summary.summarized_until == min(t.id for t in history.turns) - 1
+        reloaded = ConversationHistory('u1', '鸡兔同笼', budget=600)
+        assert [t.id for t in reloaded.turns] == [t.id for t in history.turns]
+
+def test_concurrent_first_summary_does_not_conflict(app):
+    with app.app_context():
+        seed_turns('u1', '鸡兔同笼', 6)
+        # 两个请求都在摘要创建之前读取了对话
+        first = ConversationHistory('u1', '鸡兔同笼', budget=600)
+        second = ConversationHistory('u1', '鸡兔同笼', budget=900)
+        assert first.summary is None and second.summary is None
+        assert first.fit_budget(join_summary)
+        assert second.fit_budget(join_summary)
+
+        summaries = ConversationSummary.query.filter_by(user_id='u1').all()
+        assert len(summaries) == 1
+        # 并入更少消息的第二个请求不覆盖已有摘要，并丢弃已并入摘要的消息
+        assert second.summary.summarized_until == first.summary.summarized_until
+        assert all(t.id > summaries[0].summarized_until for t in second.turns)
+        # 之后的请求照常记录
+        second.record('继续', '好的')
+        assert ConversationHistory('u1', '鸡兔同笼').turns[-1].content == '好的'
+
+def test_fit_prompt_uses_extractive_summary_without_saving(app):
+    with app.app_context():
+        seed_turns('u1', '鸡兔同笼', 6)
+        history = ConversationHistory('u1', '鸡兔同笼', budget=600)
+        assert history.fit_prompt()
+        assert history.turn_tokens <= 300
+        summary = history.prompt_messages()[0]
+        assert summary['role'] == 'system' and summary['content'].startswith('此前对话摘要：')
+        assert '回答 4' in summary['content']
+        assert ConversationSummary.query.count() == 0
+
+class SlowSummaryClient:
+    """对话回复立即返回，生成摘要的调用等到 release 后才返回"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.summary_calls = 0
+
+    def complete(self, messages, **params):
+        if messages[0]['content'] == ai_tutor.SUMMARY_PROMPT:
+            self.summary_calls += 1
+            assert self.release.wait(5)
+            content = '模型摘要'
+        else:
+            content = '继续分析'
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+def test_chat_does_not_wait_for_summary(app, client, monkeypatch):
+    llm = SlowSummaryClient()
+    monkeypatch.setattr(ai_tutor, 'llm_client', llm)
+    with app.app_context():
+        seed_turns('u1', '鸡兔同笼', 30)
+
+    response = client.post('/api/tutor/chat', json={
+        'message': '下一步呢？', 'user_id': 'u1', 'problem_context': '鸡兔同笼', 'no_cache': True
+    })
+    assert response.status_code == 200
+    assert response.get_json()['response'] == '继续分析'
+    # 回复已返回，摘要仍在后台生成
+    with app.app_context():
+        assert ConversationSummary.query.count() == 0
+
+    llm.release.set()
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        with app.app_context():
+            summary = ConversationSummary.query.first()
+        if summary is not None:
+            break
+        time.sleep(0.02)
+    assert summary is not None and summary.summary == '模型摘要'
+    assert llm.summary_calls == 1
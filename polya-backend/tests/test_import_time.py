@@ -0,0 +1,20 @@
+"""冷启动导入耗时预算：python -X importtime 导入并创建应用"""
+from src.devtools import DEFERRED_MODULES, IMPORT_BUDGET_MS, measure_cold_start, parse_importtime
+
+IMPORTTIME_SAMPLE = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:       300 |        900 | encodings
+import time:       500 |        500 |     numpy._core
+import time:      1000 |       2000 |   numpy
+import time:       400 |       5000 | src.main
+"""
+
+def test_parse_importtime():
+    top_level, modules = parse_importtime(IMPORTTIME_SAMPLE)
+    assert top_level == [('encodings', 900), ('src.main', 5000)]
+    assert modules == {'_io', 'encodings', 'numpy._core', 'numpy', 'src.main'}
+
+def test_cold_start_within_budget():
+    total_ms, loaded, _ = measure_cold_start()
+    assert loaded == [], f"创建应用时导入了 {loaded}，应在第一次使用时再导入（{DEFERRED_MODULES}）"
+    assert total_ms <= IMPORT_BUDGET_MS, f"导入耗时 {total_ms:.1f} ms 超出预算 {IMPORT_BUDGET_MS} ms"
@@ -0,0 +1,81 @@
+"""排行榜：around_user 的排名与按 (分值降序, id) 排序的结果一致，排名计数走排行榜索引；
+重建快照期间的写入不会被旧快照覆盖"""
+import random
+
+from sqlalchemy import event
+
+from src.models.progress import LearningStats
+from src.models.user import db
+from src.routes import progress
+from src.routes.progress import LEADERBOARD_BOARDS, LeaderboardSnapshot
+
+def seed(app, count=40):
+    rng = random.Random(5)
+    with app.app_context():
+        db.session.add_all(
+            LearningStats(
+                user_id=f'u{i}',
+                total_problems_solved=rng.randint(0, 5),  # 取值范围小，制造并列
+                average_score=rng.choice([0.0, 50.0, 75.5, 100.0]),
+                streak_days=rng.randint(0, 3)
+            )
+            for i in range(count)
+        )
+        db.session.commit()
+        return [s.to_dict() for s in LearningStats.query]
+
+def test_around_user_matches_sorted_ranking(app, client):
+    rows = seed(app)
+    for user_id in ('u0', 'u7', 'u21', 'u39'):
+        response = client.get(f'/api/leaderboard?around_user={user_id}&window=3')
+        assert response.status_code == 200
+        around = response.get_json()['around_user']
+        for name, column in LEADERBOARD_BOARDS.items():
+            ranking = [r['user_id'] for r in sorted(rows, key=lambda r: (-r[column], r['id']))]
+            rank = ranking.index(user_id) + 1
+            assert around[name]['rank'] == rank
+            first = max(rank - 3, 1)
+            assert [e['user_id'] for e in around[name]['entries']] == ranking[first - 1:rank + 3]
+            assert [e['rank'] for e in around[name]['entries']] == list(range(first, min(rank + 3, len(rows)) + 1))
+
+def test_rank_counts_use_leaderboard_index(app, client):
+    seed(app)
+    counts = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().lower().startswith('select count('):
+            counts.append((statement, parameters))
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', record)
+    try:
+        assert client.get('/api/leaderboard?around_user=u7').status_code == 200
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', record)
+
+    assert len(counts) == 2 * len(LEADERBOARD_BOARDS)
+    with app.app_context():
+        for statement, parameters in counts:
+            plan = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+            [(_, _, _, detail)] = plan
+            assert 'SEARCH learning_stats USING COVERING INDEX ix_learning_stats_rank_' in detail, detail
+
+def test_write_during_rebuild_is_not_overwritten(app, monkeypatch):
+    seed(app)
+    snapshot = LeaderboardSnapshot(max_age=3600)
+    query_leaderboard = progress.query_leaderboard
+    def query_then_write(column_name, limit):
+        rows = query_leaderboard(column_name, limit)
+        if column_name == 'total_problems_solved':
+            # 重建查询之后、保存快照之前提交了一次写入
+            stats = LearningStats.query.filter_by(user_id='u7').one()
+            stats.total_problems_solved = 1000
+            db.session.commit()
+            snapshot.patch(stats.to_dict())
+        return rows
+    monkeypatch.setattr(progress, 'query_leaderboard', query_then_write)
+    with app.app_context():
+        snapshot.get()
+        monkeypatch.setattr(progress, 'query_leaderboard', query_leaderboard)
+        assert snapshot.get()['by_problems_solved'][0]['user_id'] == 'u7'
@@ -0,0 +1,85 @@
+"""学习统计的增量聚合值与 rebuild-stats 从原始进度重建的结果一致"""
+import random
+
+from src.models.progress import LearningStats, UserProgress
+
+def aggregates(user_id):
+    stats = LearningStats.query.filter_by(user_id=user_id).populate_existing().one()
+    # 增量维护时，课程全部取消完成的模块保留为零值条目，重建时不出现
+    modules = {
+        module: entry for module, entry in stats.get_module_stats().items()
+        if entry != {'score_sum': 0, 'completed_count': 0}
+    }
+    return {
+        'score_sum': stats.score_sum,
+        'completed_count': stats.completed_count,
+        'total_problems_solved': stats.total_problems_solved,
+        'average_score': round(float(stats.average_score or 0), 9),
+        'module_stats': modules
+    }
+
+def assert_matches_rebuild(app, user_id):
+    with app.app_context():
+        incremental = aggregates(user_id)
+    result = app.test_cli_runner().invoke(args=['progress', 'rebuild-stats', '--user-id', user_id])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert aggregates(user_id) == incremental
+
+def post_progress(client, **event):
+    response = client.post('/api/progress', json=dict({'user_id': 'u1', 'time_spent': 60}, **event))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['stats']
+
+def test_transitions_match_rebuild(app, client):
+    post_progress(client, module='theory', lesson_id='l1', completed=True, score=80)
+    post_progress(client, module='theory', lesson_id='l2', completed=True, score=60)
+    assert_matches_rebuild(app, 'u1')
+
+    # 重复提交不重复累计
+    stats = post_progress(client, module='theory', lesson_id='l1', completed=True, score=80)
+    assert stats['total_problems_solved'] == 2
+    assert stats['average_score'] == 70.0
+    assert_matches_rebuild(app, 'u1')
+
+    # 分数变化只调整差值
+    stats = post_progress(client, module='theory', lesson_id='l1', completed=True, score=100)
+    assert stats['average_score'] == 80.0
+    assert_matches_rebuild(app, 'u1')
+
+    # 完成 -> 未完成：移出完成数与分数总和
+    stats = post_progress(client, module='theory', lesson_id='l2', completed=False, score=90)
+    assert stats['total_problems_solved'] == 1
+    assert stats['average_score'] == 100.0
+    assert_matches_rebuild(app, 'u1')
+
+    # 模块内的课程全部取消完成
+    stats = post_progress(client, module='theory', lesson_id='l1', completed=False, score=0)
+    assert stats['total_problems_solved'] == 0
+    assert stats['average_score'] == 0.0
+    assert_matches_rebuild(app, 'u1')
+
+def test_random_transitions_match_rebuild(app, client):
+    rng = random.Random(1001)
+    for step in range(200):
+        post_progress(
+            client,
+            user_id=rng.choice(['u1', 'u2']),
+            module=rng.choice(['theory', 'cases', 'practice']),
+            lesson_id=f'l{rng.randint(1, 6)}',
+            completed=rng.random() < 0.6,
+            score=rng.randint(0, 100),
+            time_spent=rng.randint(0, 600)
+        )
+        if step % 25 == 24:
+            assert_matches_rebuild(app, 'u1')
+            assert_matches_rebuild(app, 'u2')
+
+def test_invalid_score_or_time_is_rejected(app, client):
+    for event in ({'score': 'abc', 'time_spent': 'x'}, {'score': 80, 'time_spent': [1]}, {'score': {'a': 1}}):
+        response = client.post('/api/progress', json=dict({'user_id': 'u1', 'module': 'theory', 'lesson_id': 'l1'}, **event))
+        assert response.status_code == 400
+    assert client.post('/api/progress', data='not json', content_type='application/json').status_code == 400
+    with app.app_context():
+        assert UserProgress.query.count() == 0
+        assert LearningStats.query.count() == 0
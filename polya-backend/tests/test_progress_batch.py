@@ -0,0 +1,76 @@
+"""批量写入接口与逐条提交的结果一致"""
+import random
+from datetime import datetime
+
+from src.models.progress import UserProgress, ProblemSolvingRecord, LearningStats, DailyUserActivity
+
+def random_events(rng, count):
+    return [{
+        'module': rng.choice(['theory', 'cases', 'practice']),
+        'lesson_id': f'l{rng.randint(1, 8)}',
+        'completed': rng.random() < 0.6,
+        'score': rng.randint(0, 100),
+        'time_spent': rng.randint(0, 600)
+    } for _ in range(count)]
+
+def random_records(rng, count):
+    return [{
+        'problem_type': rng.choice(['math', 'logic', 'life']),
+        'problem_id': f'p{rng.randint(1, 5)}',
+        'steps_data': {'understanding': f'第 {i} 次'},
+        'completion_time': rng.randint(60, 1800),
+        'success_rate': rng.choice([0.0, 0.5, 1.0])
+    } for i in range(count)]
+
+def snapshot(user_id):
+    stats = LearningStats.query.filter_by(user_id=user_id).populate_existing().one()
+    day = DailyUserActivity.query.filter_by(
+        user_id=user_id, activity_date=datetime.utcnow().date()
+    ).populate_existing().one()
+    return {
+        'progress': {
+            (p.module, p.lesson_id): (p.completed, p.score, p.time_spent)
+            for p in UserProgress.query.filter_by(user_id=user_id).populate_existing()
+        },
+        'stats': {
+            'score_sum': stats.score_sum,
+            'completed_count': stats.completed_count,
+            'total_problems_solved': stats.total_problems_solved,
+            'total_time_spent': stats.total_time_spent,
+            'average_score': round(float(stats.average_score or 0), 9),
+            'module_stats': {
+                module: entry for module, entry in stats.get_module_stats().items()
+                if entry != {'score_sum': 0, 'completed_count': 0}
+            }
+        },
+        'day': (day.active_lessons, day.completed_lessons, day.total_time, day.score_sum, day.problem_records),
+        'records': sorted(
+            (r.problem_type, r.problem_id, r.completion_time, r.success_rate, r.get_steps_data()['understanding'])
+            for r in ProblemSolvingRecord.query.filter_by(user_id=user_id)
+        )
+    }
+
+def test_batch_matches_per_item_writes(app, client):
+    rng = random.Random(1018)
+    for _ in range(3):
+        events = random_events(rng, 40)
+        records = random_records(rng, 5)
+        for event in events:
+            assert client.post('/api/progress', json=dict(event, user_id='a')).status_code == 200
+        for record in records:
+            assert client.post('/api/problem-record', json=dict(record, user_id='a')).status_code == 200
+
+        response = client.post('/api/progress/batch', json={
+            'progress': [dict(event, user_id='b') for event in events] + [{'user_id': 'b', 'module': 'theory'}],
+            'problem_records': [dict(record, user_id='b') for record in records] + [{'user_id': 'b'}]
+        })
+        assert response.status_code == 200
+        body = response.get_json()
+        assert body['invalid'] == 2
+        statuses = [r['status'] for r in body['progress']]
+        assert statuses.count('applied') == len({(e['module'], e['lesson_id']) for e in events})
+        assert statuses.count('superseded') == len(events) - statuses.count('applied')
+        assert body['created'] == len(records)
+
+        with app.app_context():
+            assert snapshot('b') == snapshot('a')
@@ -0,0 +1,40 @@
+"""按用户数据版本缓存的计算结果"""
+import threading
+
+from src.services.result_cache import MemoryCacheBackend, ResultCache, SQLiteCacheBackend
+
+def test_counters_are_exact_under_concurrency():
+    cache = ResultCache(MemoryCacheBackend())
+    calls_per_thread = 2000
+
+    def worker(n):
+        for i in range(calls_per_thread):
+            cache.get_or_compute('profile', f'u{i % 5}', None, lambda: {'n': n})
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = cache.stats()
+    assert stats['hits'] + stats['misses'] == 8 * calls_per_thread
+
+def test_sqlite_backend_invalidates_across_workers(tmp_path):
+    # 两个 ResultCache 模拟两个工作进程共享同一个缓存文件
+    path = str(tmp_path / 'result_cache.db')
+    worker_a = ResultCache(SQLiteCacheBackend(path))
+    worker_b = ResultCache(SQLiteCacheBackend(path))
+    assert worker_b.get_or_compute('profile', 'u1', None, lambda: 'old') == 'old'
+    worker_a.bump_version('u1')
+    assert worker_b.get_or_compute('profile', 'u1', None, lambda: 'new') == 'new'
+    assert worker_a.version_tag('u1') == worker_b.version_tag('u1')
+    assert worker_b.stats()['shared']
+
+def test_memory_backend_is_process_local():
+    worker_a = ResultCache(MemoryCacheBackend())
+    worker_b = ResultCache(MemoryCacheBackend())
+    assert worker_b.get_or_compute('profile', 'u1', None, lambda: 'old') == 'old'
+    worker_a.bump_version('u1')
+    # 另一个进程的写入不会使本进程的缓存失效，因此 memory 只适用于单进程部署
+    assert worker_b.get_or_compute('profile', 'u1', None, lambda: 'new') == 'old'
+    assert not worker_b.stats()['shared']
@@ -0,0 +1,113 @@
+"""近义问题索引：数字不同的问题不复用回复，相似度不随索引增长漂移；合并的请求只写入一次索引"""
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.routes import ai_tutor
+from src.services.semantic_cache import SemanticAnswerIndex
+from src.services.single_flight import SingleFlight
+
+QUESTION = '一个水池装有3个同样的进水管，每个进水管每小时进水12吨，水池容量为144吨，全部打开需要多久才能注满水池？'
+REQUESTS = 4
+ANSWER = '先找出未知量，再列出已知条件。'
+
+def test_questions_with_different_numbers_are_not_reused(tmp_path):
+    index = SemanticAnswerIndex(str(tmp_path / 'semantic'))
+    assert index.add(QUESTION, 1, '', '4小时')
+    changed = QUESTION.replace('12', '15')
+    assert index.search(changed, 1, '', 1)[0]['similarity'] >= index.threshold
+    assert index.lookup(changed, 1, '') is None
+    # 只差数字的问题单独写入索引，之后各自命中自己的回复
+    assert index.add(changed, 1, '', '3.2小时')
+    assert index.lookup(changed, 1, '') == '3.2小时'
+    assert index.lookup(QUESTION, 1, '') == '4小时'
+    # 关键词不同的问题低于默认阈值
+    assert index.lookup(QUESTION.replace('进水', '出水').replace('注满', '排空'), 1, '') is None
+
+def test_similarity_uses_current_document_frequencies(tmp_path):
+    index = SemanticAnswerIndex(str(tmp_path / 'semantic'))
+    index.add(QUESTION, 1, '', 'answer')
+    # 之后写入的问题与它共享大量 n-gram，文档频率随之变化
+    for i in range(40):
+        index.add(f'一个水池有{i}个进水管，每分钟进水{i + 1}升，第{i}次怎么算？', 1, '', f'a{i}')
+    [best] = index.search(QUESTION, 1, '', 1)
+    assert best['answer'] == 'answer'
+    assert best['similarity'] == 1.0
+
+def test_old_format_index_is_upgraded(tmp_path):
+    path = str(tmp_path / 'semantic')
+    index = SemanticAnswerIndex(path)
+    for i in range(10):
+        index.add(f'第{i}题：如何理解条件之间的关系？', 1, '', f'a{i}')
+    # 旧格式：没有版本标记，weights 中是写入时的 TF-IDF 权重
+    os.remove(os.path.join(path, 'format'))
+    weights = os.path.join(path, 'weights.bin')
+    with open(weights, 'r+b') as f:
+        f.write(b'\x00\x38' * (os.path.getsize(weights) // 2))
+    upgraded = SemanticAnswerIndex(path)
+    [best] = upgraded.search('第7题：如何理解条件之间的关系？', 1, '', 1)
+    assert (best['answer'], best['similarity']) == ('a7', 1.0)
+
+class FakeLLMClient:
+    """等所有并发请求都挂到同一次调用上后才返回回复"""
+
+    def __init__(self, single_flight):
+        self.single_flight = single_flight
+        self.calls = 0
+
+    def _wait_for_followers(self):
+        self.calls += 1
+        deadline = time.monotonic() + 5
+        while self.single_flight.followers < REQUESTS - 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def complete(self, messages, **params):
+        self._wait_for_followers()
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=ANSWER))])
+
+    def stream(self, messages, **params):
+        self._wait_for_followers()
+        return FakeStream([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=ANSWER))])])
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        pass
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_followers_do_not_index_again(app, tmp_path, monkeypatch, stream):
+    single_flight = SingleFlight()
+    client = FakeLLMClient(single_flight)
+    # dedupe_threshold > 1 关闭按相似度去重，重复调用 add 都会追加记录
+    index = SemanticAnswerIndex(str(tmp_path / 'semantic'), dedupe_threshold=2.0)
+    monkeypatch.setattr(ai_tutor, 'single_flight', single_flight)
+    monkeypatch.setattr(ai_tutor, 'llm_client', client)
+    monkeypatch.setattr(ai_tutor, 'semantic_index', index)
+
+    responses = [None] * REQUESTS
+    def ask(i):
+        # 不同用户的新对话：提示词相同，各自记录对话历史
+        response = app.test_client().post(
+            '/api/tutor/chat' + ('?stream=1' if stream else ''),
+            json={'message': '怎样理解这道题？', 'user_id': f'u{i}', 'current_step': 1, 'no_cache': True}
+        )
+        responses[i] = response.get_data(as_text=True) if stream else response.get_json()['response']
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(REQUESTS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert client.calls == 1
+    assert single_flight.followers == REQUESTS - 1
+    assert all(ANSWER in response for response in responses)
+    assert index.stats()['entries'] == 1
+    assert SemanticAnswerIndex(str(tmp_path / 'semantic')).stats()['entries'] == 1
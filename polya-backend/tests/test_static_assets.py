@@ -0,0 +1,83 @@
+"""前端静态文件清单：预压缩版本、Range、条件请求，请求时不访问文件元数据"""
+import gzip
+import os
+
+import pytest
+from flask import Flask
+
+from src.services.static_assets import StaticManifest, precompress
+
+BUNDLE = 'assets/app-Bpyjm5hG.js'
+
+@pytest.fixture
+def static_client(tmp_path, monkeypatch):
+    (tmp_path / 'assets').mkdir()
+    (tmp_path / 'index.html').write_text('<!doctype html><div id="root"></div>')
+    bundle = tmp_path / BUNDLE
+    # 超过内存缓存上限的大文件
+    bundle.write_text(''.join(f'export const value{i} = {i};\n' for i in range(8000)))
+    precompress(str(bundle))
+    manifest = StaticManifest(str(tmp_path))
+
+    app = Flask(__name__)
+
+    @app.route('/<path:path>')
+    def serve(path):
+        return manifest.serve(path)
+
+    stat_calls = []
+    real_stat = os.stat
+
+    def recording_stat(path, *args, **kwargs):
+        if str(path).startswith(str(tmp_path)):
+            stat_calls.append(path)
+        return real_stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, 'stat', recording_stat)
+    return app.test_client(), bundle, stat_calls
+
+def test_large_precompressed_file(static_client):
+    client, bundle, stat_calls = static_client
+    compressed = (bundle.parent / (bundle.name + '.gz')).read_bytes()
+    stat_calls.clear()
+    response = client.get(f'/{BUNDLE}', headers={'Accept-Encoding': 'gzip'})
+    assert stat_calls == []
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Content-Length'] == str(len(compressed))
+    assert response.headers['Content-Disposition'] == f'inline; filename={bundle.name}'
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert gzip.decompress(response.data) == bundle.read_bytes()
+
+    revalidated = client.get(
+        f'/{BUNDLE}', headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']}
+    )
+    assert revalidated.status_code == 304
+
+def test_range_request(static_client):
+    client, bundle, stat_calls = static_client
+    content = bundle.read_bytes()
+    stat_calls.clear()
+    response = client.get(f'/{BUNDLE}', headers={'Range': 'bytes=7-18'})
+    assert stat_calls == []
+    assert response.status_code == 206
+    assert response.data == content[7:19]
+    assert response.headers['Content-Range'] == f'bytes 7-18/{len(content)}'
+
+def test_x_sendfile_leaves_ranges_to_front_server(static_client):
+    client, bundle, _ = static_client
+    client.application.config['USE_X_SENDFILE'] = True
+    response = client.get(f'/{BUNDLE}', headers={'Range': 'bytes=0-99', 'Accept-Encoding': 'identity'})
+    assert response.status_code == 200
+    assert response.headers['X-Sendfile'] == str(bundle)
+    assert response.headers['Content-Length'] == str(bundle.stat().st_size)
+    assert 'Content-Range' not in response.headers
+    assert response.data == b''
+
+    revalidated = client.get(f'/{BUNDLE}', headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+
+def test_spa_fallback_and_missing_asset(static_client):
+    client, _, _ = static_client
+    assert b'id="root"' in client.get('/lessons/1').data
+    assert client.get('/assets/missing-Abcdefgh.js').status_code == 404
@@ -0,0 +1,112 @@
+"""用户画像：聚合查询与逐行计算的结果（包括列表顺序）完全一致"""
+import json
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from src.models.progress import db, UserProgress, ProblemSolvingRecord, LearningStats
+from src.routes.recommendation import recommendation_engine
+
+MODULES = ['theory', 'cases', 'practice', 'understanding', 'planning']
+PROBLEM_TYPES = ['math', 'logic', 'life', 'work']
+
+def legacy_user_profile(user_id):
+    """改为聚合查询之前逐行计算的实现"""
+    user_progress = UserProgress.query.filter_by(user_id=user_id).all()
+    problem_records = ProblemSolvingRecord.query.filter_by(user_id=user_id).all()
+    learning_stats = LearningStats.query.filter_by(user_id=user_id).first()
+
+    profile = {
+        'skill_levels': {'understanding': 1, 'planning': 1, 'execution': 1, 'reflection': 1},
+        'preferred_topics': [],
+        'preferred_difficulty': 1,
+        'preferred_problem_types': [],
+        'learning_pace': 'normal',
+        'weak_areas': [],
+        'strong_areas': [],
+        'total_time_spent': 0,
+        'completion_rate': 0
+    }
+
+    if learning_stats:
+        profile['skill_levels'] = learning_stats.get_skill_levels()
+        profile['total_time_spent'] = learning_stats.total_time_spent
+
+    if user_progress:
+        completed_count = len([p for p in user_progress if p.completed])
+        total_count = len(user_progress)
+        profile['completion_rate'] = completed_count / total_count if total_count > 0 else 0
+
+        completed_progress = [p for p in user_progress if p.completed]
+        if completed_progress:
+            avg_score = sum(p.score for p in completed_progress) / len(completed_progress)
+            if avg_score >= 85:
+                profile['preferred_difficulty'] = min(4, profile['preferred_difficulty'] + 1)
+            elif avg_score < 70:
+                profile['preferred_difficulty'] = max(1, profile['preferred_difficulty'] - 1)
+
+        module_performance = defaultdict(list)
+        for progress in completed_progress:
+            module_performance[progress.module].append(progress.score)
+
+        for module, scores in module_performance.items():
+            avg_score = sum(scores) / len(scores)
+            if avg_score >= 80:
+                profile['strong_areas'].append(module)
+            elif avg_score < 70:
+                profile['weak_areas'].append(module)
+
+    if problem_records:
+        type_performance = defaultdict(list)
+        for record in problem_records:
+            type_performance[record.problem_type].append(record.success_rate)
+
+        for ptype, rates in type_performance.items():
+            avg_rate = sum(rates) / len(rates)
+            if avg_rate >= 0.8:
+                profile['preferred_problem_types'].append(ptype)
+
+        avg_time = sum(r.completion_time for r in problem_records) / len(problem_records)
+        if avg_time < 600:
+            profile['learning_pace'] = 'fast'
+        elif avg_time > 1800:
+            profile['learning_pace'] = 'slow'
+
+    return profile
+
+def random_history(rng, user_id):
+    start = datetime(2026, 1, 1)
+    for i in range(rng.randint(0, 25)):
+        db.session.add(UserProgress(
+            user_id=user_id,
+            module=rng.choice(MODULES),
+            lesson_id=f'lesson_{i}',
+            completed=rng.random() < 0.6,
+            score=rng.randint(40, 100),
+            time_spent=rng.randint(0, 3600)
+        ))
+    for i in range(rng.randint(0, 25)):
+        db.session.add(ProblemSolvingRecord(
+            user_id=user_id,
+            problem_type=rng.choice(PROBLEM_TYPES),
+            problem_id=f'problem_{i}',
+            # 二进制可精确表示的成功率，求和顺序不影响结果
+            success_rate=rng.choice([0.0, 0.25, 0.5, 0.75, 0.875, 1.0]),
+            completion_time=rng.randint(60, 3600),
+            created_at=start + timedelta(minutes=rng.randint(0, 10000))
+        ))
+    if rng.random() < 0.5:
+        db.session.add(LearningStats(
+            user_id=user_id,
+            total_time_spent=rng.randint(0, 100000),
+            skill_levels=json.dumps({'understanding': rng.randint(1, 5), 'planning': 2, 'execution': 1, 'reflection': 3})
+        ))
+    db.session.commit()
+
+def test_profile_matches_row_based_implementation(app):
+    rng = random.Random(20261018)
+    with app.app_context():
+        for n in range(40):
+            user_id = f'user_{n}'
+            random_history(rng, user_id)
+            assert recommendation_engine.build_user_profile(user_id) == legacy_user_profile(user_id), user_id
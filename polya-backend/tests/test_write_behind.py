@@ -0,0 +1,141 @@
+"""解题记录延迟写入：崩溃后重放日志按 ingest_id 幂等"""
+import json
+import os
+import uuid
+from datetime import datetime
+
+from src.main import create_app
+from src.models.progress import ProblemSolvingRecord, DailyUserActivity
+from src.models.user import db
+from src.routes.progress import parse_problem_record, write_problem_records
+from src.services.write_behind import WriteBehindQueue
+
+def make_entries(count):
+    created_at = datetime.utcnow().isoformat()
+    return [
+        (uuid.uuid4().hex, dict(parse_problem_record({
+            'user_id': f'u{i % 3}', 'problem_type': 'math', 'problem_id': f'p{i}',
+            'steps_data': {'understanding': i}, 'completion_time': 60, 'success_rate': 1.0
+        }), created_at=created_at))
+        for i in range(count)
+    ]
+
+def write_orphan_segment(journal_dir, entries):
+    """崩溃进程遗留的日志段：没有进程持有文件锁，最后一行只写了一半"""
+    path = os.path.join(journal_dir, f'journal-0-0-{uuid.uuid4().hex[:8]}.log')
+    with open(path, 'w', encoding='utf-8') as f:
+        for entry_id, data in entries:
+            f.write(json.dumps({'id': entry_id, 'data': data}, ensure_ascii=False) + '\n')
+        f.write('{"id": "torn')
+
+def replay(app, journal_dir):
+    queue = WriteBehindQueue(journal_dir, write_problem_records, batch_size=7, flush_interval=0.01)
+    queue.start(app)
+    try:
+        assert queue.flush(timeout=10)
+        return queue.stats()
+    finally:
+        queue.close()
+
+def stored(app):
+    with app.app_context():
+        ingest_ids = [r.ingest_id for r in ProblemSolvingRecord.query]
+        problem_records = sum(d.problem_records for d in DailyUserActivity.query)
+    return ingest_ids, problem_records
+
+def test_replay_after_crash_is_idempotent(app, tmp_path):
+    journal_dir = str(tmp_path / 'journal')
+    os.makedirs(journal_dir)
+    entries = make_entries(25)
+    ids = sorted(entry_id for entry_id, _ in entries)
+
+    # 崩溃前已提交了一部分批次，但日志段还没来得及删除
+    with app.app_context():
+        write_problem_records(entries[:10])
+    write_orphan_segment(journal_dir, entries)
+
+    stats = replay(app, journal_dir)
+    assert stats['replayed'] == 25
+    assert os.listdir(journal_dir) == []
+    ingest_ids, problem_records = stored(app)
+    assert sorted(ingest_ids) == ids
+    assert problem_records == 25
+
+    # 同一日志段再次被重放（例如删除日志段之前再次崩溃）
+    write_orphan_segment(journal_dir, entries)
+    replay(app, journal_dir)
+    ingest_ids, problem_records = stored(app)
+    assert sorted(ingest_ids) == ids
+    assert problem_records == 25
+
+def test_submitted_records_are_written(app, tmp_path):
+    queue = WriteBehindQueue(str(tmp_path / 'journal'), write_problem_records, batch_size=4, flush_interval=0.01)
+    queue.start(app)
+    try:
+        submitted = [queue.submit(data) for _, data in make_entries(10)]
+        assert queue.flush(timeout=10)
+        assert not any(queue.is_pending(entry_id) for entry_id in submitted)
+    finally:
+        queue.close()
+    ingest_ids, problem_records = stored(app)
+    assert sorted(ingest_ids) == sorted(submitted)
+    assert problem_records == 10
+
+def test_permanently_failing_record_is_dead_lettered(app, tmp_path):
+    journal_dir = str(tmp_path / 'journal')
+    queue = WriteBehindQueue(journal_dir, write_problem_records, batch_size=4, flush_interval=0.01, max_retries=2)
+    queue.start(app)
+    try:
+        entries = make_entries(10)
+        entries[2][1]['problem_type'] = None  # NOT NULL 约束：永远无法写入
+        submitted = [queue.submit(data) for _, data in entries]
+        assert queue.flush(timeout=10)
+        stats = queue.stats()
+    finally:
+        queue.close()
+    assert stats['dead_lettered'] == 1
+    assert stats['written'] == 9
+    ingest_ids, problem_records = stored(app)
+    assert sorted(ingest_ids) == sorted(submitted[:2] + submitted[3:])
+    assert problem_records == 9
+
+    # 死信日志段保存失败的记录与错误，不会被当作日志段重放
+    [name] = os.listdir(journal_dir)
+    assert name.startswith('dead-letter-')
+    with open(os.path.join(journal_dir, name), encoding='utf-8') as f:
+        [line] = f.read().splitlines()
+    dead = json.loads(line)
+    assert dead['id'] == submitted[2]
+    assert 'NOT NULL' in dead['error']
+    assert replay(app, journal_dir)['replayed'] == 0
+
+def test_each_app_writes_through_its_own_queue(tmp_path, monkeypatch):
+    monkeypatch.setenv('PROBLEM_RECORD_WRITE_BEHIND', '1')
+    monkeypatch.setenv('WRITE_BEHIND_FLUSH_MS', '10')
+    apps = []
+    for name in ('first', 'second'):
+        (tmp_path / name).mkdir()
+        apps.append(create_app({
+            'TESTING': True, 'DATABASE_PATH': str(tmp_path / name / 'app.db'), 'UPGRADE_SCHEMA': True
+        }))
+    try:
+        record_ids = []
+        for app in apps:
+            response = app.test_client().post('/api/problem-record', json={
+                'user_id': 'u1', 'problem_type': 'math', 'problem_id': 'p1'
+            })
+            assert response.status_code == 202
+            record_ids.append(response.get_json()['record_id'])
+        for app, record_id in zip(apps, record_ids):
+            queue = app.extensions['problem_record_queue']
+            assert queue.flush(timeout=10)
+            assert queue.journal_dir == os.path.join(os.path.dirname(app.config['DATABASE_PATH']), 'write_behind')
+            # 记录写入发起请求的应用自己的数据库
+            assert stored(app)[0] == [record_id]
+    finally:
+        for app in apps:
+            app.extensions['problem_record_queue'].close()
+            with app.app_context():
+                db.session.remove()
+                for engine in db.engines.values():
+                    engine.dispose()
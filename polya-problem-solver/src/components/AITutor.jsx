@@ -18,6 +18,7 @@ import {
   ArrowRight,
   RefreshCw
 } from 'lucide-react'
+import { readEventStream } from '@/lib/eventStream.js'
 
 export default function AITutor() {
   const [messages, setMessages] = useState([
@@ -35,6 +36,7 @@ export default function AITutor() {
   const [showHints, setShowHints] = useState(false)
   const [hints, setHints] = useState(null)
   const messagesEndRef = useRef(null)
+  const abortRef = useRef(null)
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" })
@@ -44,6 +46,13 @@ export default function AITutor() {
     scrollToBottom()
   }, [messages])
 
+  // 离开页面时中断正在接收的回复，服务端随之停止生成
+  useEffect(() => () => abortRef.current?.abort(), [])
+
+  const updateMessage = (id, patch) => {
+    setMessages(prev => prev.map(m => (m.id === id ? { ...m, ...patch(m) } : m)))
+  }
+
   const polyaSteps = [
     {
       id: 1,
@@ -113,33 +122,66 @@ export default function AITutor() {
     setInputMessage('')
     setIsLoading(true)
 
+    const aiMessageId = messages.length + 2
+    const controller = new AbortController()
+    abortRef.current = controller
+    let bubbleShown = false
+
     try {
       const response = await fetch('/api/tutor/chat', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': 'text/event-stream',
         },
         body: JSON.stringify({
           message: inputMessage,
           user_id: 'default_user',
           problem_context: selectedProblem,
           current_step: currentStep
-        })
+        }),
+        signal: controller.signal
       })
 
-      const data = await response.json()
-      
-      const aiMessage = {
-        id: messages.length + 2,
-        type: 'ai',
-        content: data.response,
-        timestamp: new Date().toISOString(),
-        stepInfo: data.step_info
+      if (!response.headers.get('Content-Type')?.startsWith('text/event-stream')) {
+        const data = await response.json()
+        setMessages(prev => [...prev, {
+          id: aiMessageId,
+          type: 'ai',
+          content: data.response || data.error,
+          timestamp: new Date().toISOString(),
+          stepInfo: data.step_info
+        }])
+        return
       }
 
-      setMessages(prev => [...prev, aiMessage])
+      // 收到 step_info 后立即显示回复气泡，随后逐段追加内容
+      await readEventStream(response, (event, data) => {
+        if (event === 'step_info') {
+          bubbleShown = true
+          setIsLoading(false)
+          setMessages(prev => [...prev, {
+            id: aiMessageId,
+            type: 'ai',
+            content: '',
+            timestamp: new Date().toISOString(),
+            stepInfo: data.step_info
+          }])
+        } else if (event === 'delta') {
+          updateMessage(aiMessageId, m => ({ content: m.content + data.content }))
+        } else if (event === 'done') {
+          updateMessage(aiMessageId, () => ({ content: data.response, timestamp: data.timestamp }))
+        } else if (event === 'error') {
+          updateMessage(aiMessageId, () => ({ content: data.error }))
+        }
+      })
     } catch (error) {
+      if (error.name === 'AbortError') return
       console.error('发送消息失败:', error)
+      if (bubbleShown) {
+        updateMessage(aiMessageId, m => ({ content: m.content + '\n\n（连接中断，回复不完整）' }))
+        return
+      }
       const errorMessage = {
         id: messages.length + 2,
         type: 'ai',